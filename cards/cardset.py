@@ -0,0 +1,144 @@
+"""
+Sets of cards stored as 52-bit integers where bit i is set if the card with index i is in the set
+
+Cards are indexed by rank then suit (Ace of Hearts is 0, Ace of Diamonds is 1 ... King of Spades is 51)
+so the four cards of a rank sit in 4 consecutive bits
+
+Kept free of Django so it can be used anywhere the rules are needed
+"""
+import random
+
+SUIT_CODES = ('H', 'D', 'C', 'S')
+RANK_CODES = ('A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K')
+
+SUIT_INDEX = {suit: i for i, suit in enumerate(SUIT_CODES)}
+RANK_INDEX = {rank: i for i, rank in enumerate(RANK_CODES)}
+
+# Face value of each rank, what scoring in game.rules is built on
+RANK_VALUES = {
+    'A': 1,
+    '2': 2,
+    '3': 3,
+    '4': 4,
+    '5': 5,
+    '6': 6,
+    '7': 7,
+    '8': 8,
+    '9': 9,
+    '10': 10,
+    'J': 11,
+    'Q': 12,
+    'K': 13,
+}
+
+DECK_SIZE = 52
+FULL = (1 << DECK_SIZE) - 1
+RANK_BITS = 0xF
+
+
+def index(rank, suit):
+    return RANK_INDEX[rank] * 4 + SUIT_INDEX[suit]
+
+
+def card(i):
+    """
+    (rank, suit) of the card with index i
+    """
+    return RANK_CODES[i // 4], SUIT_CODES[i % 4]
+
+
+def bit(rank, suit):
+    return 1 << index(rank, suit)
+
+
+def from_cards(cards):
+    """
+    Builds a mask from an iterable of (rank, suit) tuples
+    """
+    mask = 0
+    for rank, suit in cards:
+        mask |= bit(rank, suit)
+
+    return mask
+
+
+def parse(card_strings):
+    """
+    Builds a mask from "rank suit" strings such as "10 H", as sent by the game page
+
+    Raises:
+        ValueError if a string isn't a card
+    """
+    mask = 0
+    for card_string in card_strings:
+        try:
+            rank, suit = card_string.split()
+            mask |= bit(rank, suit)
+        except (ValueError, KeyError):
+            raise ValueError("Not a card: %r" % card_string)
+
+    return mask
+
+
+def indexes(mask):
+    """
+    Indexes of the cards in the mask, lowest first
+    """
+    found = []
+
+    while mask:
+        low = mask & -mask
+        found.append(low.bit_length() - 1)
+        mask ^= low
+
+    return found
+
+
+def cards(mask):
+    """
+    (rank, suit) tuples of the cards in the mask, ordered by rank then suit
+    """
+    return [card(i) for i in indexes(mask)]
+
+
+def count(mask):
+    return bin(mask).count('1')
+
+
+def rank_mask(rank):
+    return RANK_BITS << RANK_INDEX[rank] * 4
+
+
+def lowest_rank(mask):
+    """
+    Rank code of the lowest card in a non-empty mask
+    """
+    return RANK_CODES[((mask & -mask).bit_length() - 1) // 4]
+
+
+def same_rank(mask):
+    """
+    True if the mask is non-empty and every card in it has the same rank
+    """
+    return mask != 0 and mask & ~rank_mask(lowest_rank(mask)) == 0
+
+
+def deal(num_hands, rng=random):
+    """
+    Shuffles a full deck and deals it round robin
+
+    Parameters:
+        num_hands - Number of hands to deal
+        rng - Source of randomness, pass a seeded random.Random to reproduce a deal
+
+    Returns:
+        List of cardset masks, one per hand
+    """
+    order = list(range(DECK_SIZE))
+    rng.shuffle(order)
+
+    hands = [0] * num_hands
+    for i, card in enumerate(order):
+        hands[i % num_hands] |= 1 << card
+
+    return hands
@@ -0,0 +1,25 @@
+"""
+Static files finder for the card sprite sheet
+
+build_sprites writes the sheet and its CSS to SPRITES_ROOT rather than the app,
+so building them never touches tracked files. Listed ahead of the app finders,
+this serves and collects the built cards/cards.css in place of the committed
+per-image one whenever a sheet has been built.
+"""
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import BaseStorageFinder
+from django.core.files.storage import FileSystemStorage
+
+
+class SpritesFinder(BaseStorageFinder):
+    def __init__(self, *args, **kwargs):
+        super(SpritesFinder, self).__init__(FileSystemStorage(location=settings.SPRITES_ROOT), *args, **kwargs)
+
+    def list(self, ignore_patterns):
+        # Nothing has been built yet
+        if not os.path.isdir(self.storage.location):
+            return []
+
+        return super(SpritesFinder, self).list(ignore_patterns)
@@ -0,0 +1,61 @@
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cards import sprites
+
+
+class Command(BaseCommand):
+    help = ("Packs the card faces and back into one sprite sheet, cards/cards.png under SPRITES_ROOT, "
+            "and writes the CSS class for each card to cards.css next to it")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-sprite', action='store_true',
+                            help="Only write CSS pointing at the separate images, doesn't need Pillow")
+        parser.add_argument('--output', default=None,
+                            help="Directory to write cards/ under instead of SPRITES_ROOT, e.g. cards/static "
+                                 "to update the committed per-image cards.css")
+
+    def handle(self, *args, **options):
+        source = os.path.join(apps.get_app_config('cards').path, 'static', 'cards')
+        directory = os.path.join(options['output'] or settings.SPRITES_ROOT, 'cards')
+        os.makedirs(directory, exist_ok=True)
+
+        built = not options['no_sprite'] and self.build_sheet(source, directory)
+        css = sprites.sprite_css() if built else sprites.separate_css()
+
+        # A sheet left from an earlier build would otherwise be collected with CSS that doesn't use it
+        sheet = os.path.join(directory, sprites.SHEET_NAME)
+        if not built and os.path.exists(sheet):
+            os.remove(sheet)
+
+        with open(os.path.join(directory, sprites.CSS_NAME), 'w') as css_file:
+            css_file.write(css)
+
+        self.stdout.write("Wrote %s" % os.path.join(directory, sprites.CSS_NAME))
+
+    def build_sheet(self, source, directory):
+        """
+        Draws the sheet into directory, False if Pillow isn't installed to draw it
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            self.stderr.write("Building the sprite sheet needs Pillow installed, "
+                              "writing CSS for the separate images instead")
+            return False
+
+        width = sprites.WIDTH * sprites.SCALE
+        height = sprites.HEIGHT * sprites.SCALE
+        sheet = Image.new('RGBA', sprites.sheet_size())
+
+        for image, column, row in sprites.layout():
+            card = Image.open(os.path.join(source, image)).convert('RGBA')
+            sheet.paste(card.resize((width, height), Image.LANCZOS), (column * width, row * height))
+
+        path = os.path.join(directory, sprites.SHEET_NAME)
+        sheet.save(path, optimize=True)
+        self.stdout.write("Wrote %s" % path)
+        return True
@@ -0,0 +1,21 @@
+from django.contrib.staticfiles.management.commands import collectstatic
+from django.core.management import call_command
+
+
+class Command(collectstatic.Command):
+    """
+    collectstatic which builds the card sprite sheet and its CSS into SPRITES_ROOT first, so
+    deploys ship the sheet rather than the per-image CSS committed for development
+    """
+    help = collectstatic.Command.help + ", after building the card sprite sheet"
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--no-sprite', action='store_true',
+                            help="Collect the CSS pointing at the separate card images instead of building the sheet")
+
+    def handle(self, **options):
+        if not options['dry_run']:
+            call_command('build_sprites', no_sprite=options['no_sprite'], stdout=self.stdout, stderr=self.stderr)
+
+        return super(Command, self).handle(**options)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from cards import cardset
+
+
+def hands_to_cardsets(apps, schema_editor):
+    Hand = apps.get_model('cards', 'Hand')
+
+    for hand in Hand.objects.all():
+        hand.cards_set = cardset.from_cards((card.rank, card.suit) for card in hand.cards.all())
+        hand.selected_set = cardset.from_cards((card.rank, card.suit) for card in hand.selected.all())
+        hand.save()
+
+
+def cardsets_to_hands(apps, schema_editor):
+    Hand = apps.get_model('cards', 'Hand')
+    Card = apps.get_model('cards', 'Card')
+
+    for hand in Hand.objects.all():
+        hand.cards.set([Card.objects.get_or_create(rank=rank, suit=suit)[0]
+                        for rank, suit in cardset.cards(hand.cards_set)])
+        hand.selected.set([Card.objects.get_or_create(rank=rank, suit=suit)[0]
+                           for rank, suit in cardset.cards(hand.selected_set)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0011_auto_20160802_0815'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hand',
+            name='cards_set',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='hand',
+            name='selected_set',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(hands_to_cardsets, cardsets_to_hands),
+        migrations.RemoveField(
+            model_name='hand',
+            name='cards',
+        ),
+        migrations.RemoveField(
+            model_name='hand',
+            name='selected',
+        ),
+        migrations.RenameField(
+            model_name='hand',
+            old_name='cards_set',
+            new_name='cards',
+        ),
+        migrations.RenameField(
+            model_name='hand',
+            old_name='selected_set',
+            new_name='selected',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from cards import cardset
+
+
+def seed_cards(apps, schema_editor):
+    """
+    One row per card with pk = cardset index + 1 so pks match cards.registry
+    """
+    Card = apps.get_model('cards', 'Card')
+
+    for i in range(cardset.DECK_SIZE):
+        rank, suit = cardset.card(i)
+        Card.objects.update_or_create(pk=i + 1, defaults={'rank': rank, 'suit': suit})
+
+    Card.objects.exclude(pk__in=range(1, cardset.DECK_SIZE + 1)).delete()
+
+
+class Migration(migrations.Migration):
+
+    # Actions have to be converted to cardsets before reseeding deletes the cards they refer to
+    dependencies = [
+        ('cards', '0012_hand_cardset'),
+        ('game', '0030_action_cardset'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_cards, migrations.RunPython.noop),
+    ]
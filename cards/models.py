@@ -1,6 +1,9 @@
 from django.db import models
 import random
 
+from . import cardset
+from .registry import registry, BACK
+
 SUITS = (
     ('H', 'Hearts'),
     ('D', 'Diamonds'),
@@ -25,68 +28,101 @@ RANKS = (
 
 )
 
-
 class Card(models.Model):
     suit = models.CharField(max_length=1, choices=SUITS)
     rank = models.CharField(max_length=2, choices=RANKS)
 
+    def info(self):
+        return registry.get(self.rank, self.suit)
+
     def image_path(self):
-        return str(self.get_rank_display()).lower() + "_of_" + str(self.get_suit_display()).lower() + ".png"
+        return self.info().image
 
     def short(self):
-        return self.rank, self.suit, self.image_path()
+        return self.info().short
 
     def back(self):
-        return 0, 0, "back.png"
+        return BACK
 
     def __str__(self):
         return self.get_rank_display() + " of " + self.get_suit_display()
 
 
 class Deck(models.Model):
-    cards = Card.objects.all()
-
-    def deal(self, players):
-        for player in players:
-            player.hand.cards.clear()
-            player.hand.selected.clear()
-
-            if player.action is not None:
-                player.action.cards.clear()
+    def deal(self, players, seed=None):
+        """
+        Deals a shuffled deck round robin to the players and clears their selections
+        Every hand is written by a single UPDATE
 
-        shuffle_order = list(range(len(self.cards)))
-        random.shuffle(shuffle_order)
+        Parameters:
+            players - List of Players to deal to
+            seed - Seed for the shuffle so a deal can be reproduced
+        """
+        hands = cardset.deal(len(players), random.Random(seed))
 
-        for i in range(len(self.cards)):
-            players[i % len(players)].hand.cards.add(self.cards[shuffle_order[i]])
+        Hand.objects.filter(player__in=players).update(
+            cards=models.Case(*[models.When(player=player, then=models.Value(cards))
+                                for player, cards in zip(players, hands)],
+                              output_field=models.BigIntegerField()),
+            selected=0)
 
 
 class Hand(models.Model):
-    cards = models.ManyToManyField('cards.Card', related_name="cards")
+    """
+    Cards held by a player
+
+    Fields:
+        cards - cardset mask of the cards in hand and not selected
+        selected - cardset mask of the cards selected to be played
+    """
+    cards = models.BigIntegerField(default=0)
     player = models.OneToOneField('game.Player')
-    selected = models.ManyToManyField('cards.Card', related_name="selected")
+    selected = models.BigIntegerField(default=0)
 
     def contains_card(self, card):
-        return self.cards.filter(suit=card['suit'], rank=card['rank']).count() == 1
+        return self.cards & cardset.bit(card['rank'], card['suit']) != 0
 
     def select(self, card):
         if not self.contains_card(card):
             return
 
-        c = self.cards.get(suit=card['suit'], rank=card['rank'])
-        self.selected.add(c)
-        self.cards.remove(c)
+        bit = cardset.bit(card['rank'], card['suit'])
+        self.selected |= bit
+        self.cards &= ~bit
+        self.save()
 
     def is_card_in_hand(self, card):
-        return self.selected.filter(suit=card['suit'], rank=card['rank']).count() == 1
+        return self.selected & cardset.bit(card['rank'], card['suit']) != 0
 
     def deselect(self, card):
         if not self.is_card_in_hand(card):
             return
 
-        c = self.selected.get(suit=card['suit'], rank=card['rank'])
-        self.cards.add(c)
-        self.selected.remove(c)
+        bit = cardset.bit(card['rank'], card['suit'])
+        self.cards |= bit
+        self.selected &= ~bit
+        self.save()
+
+    def set_selection(self, selected):
+        """
+        Moves cards between the hand and the selection so exactly the given cards are selected
+        Written by a single UPDATE
+
+        Parameters:
+            selected - cardset mask of cards to select, must all be held
+
+        Returns:
+            False without changing anything if a card isn't held
+        """
+        held = self.cards | self.selected
+
+        if selected & ~held:
+            return False
+
+        self.cards = held & ~selected
+        self.selected = selected
+        Hand.objects.filter(pk=self.pk).update(cards=self.cards, selected=self.selected)
+        return True
 
     def __str__(self):
-        return "Hand " + str(self.id)
\ No newline at end of file
+        return "Hand " + str(self.id)
@@ -0,0 +1,106 @@
+"""
+Process wide table of the 52 cards
+
+Everything about a card that never changes (index, rank, suit, Card primary key,
+image, CSS class and value) is worked out once when the cards app is ready, so rendering a
+hand is a tuple lookup per card instead of building names and tuples each time.
+
+Card rows are seeded by migration with pk = index + 1 (see 0013_seed_cards).
+"""
+from collections import namedtuple
+
+from . import cardset
+
+
+RANK_NAMES = {
+    'A': 'Ace',
+    'J': 'Jack',
+    'Q': 'Queen',
+    'K': 'King',
+}
+
+SUIT_NAMES = {
+    'H': 'Hearts',
+    'D': 'Diamonds',
+    'C': 'Clubs',
+    'S': 'Spades',
+}
+
+CardInfo = namedtuple('CardInfo', ['index', 'rank', 'suit', 'pk', 'image', 'css_class', 'value', 'short'])
+
+BACK_IMAGE = "back.png"
+
+
+def card_pk(index):
+    return index + 1
+
+
+def card_image(rank, suit):
+    return RANK_NAMES.get(rank, rank).lower() + "_of_" + SUIT_NAMES[suit].lower() + ".png"
+
+
+def card_class(image):
+    """
+    CSS class showing an image from cards/static/cards, defined in cards.css (see build_sprites)
+    """
+    return "card-" + image[:-len(".png")].replace("_", "-")
+
+
+# Display tuple of a face down card
+BACK = (0, 0, card_class(BACK_IMAGE))
+
+
+class CardRegistry(object):
+    """
+    Immutable lookup of every card by index, (rank, suit) or Card pk
+
+    Filled by load(), which CardsConfig.ready calls, or on first use outside Django
+    """
+    def __init__(self):
+        self._cards = None
+
+    def load(self):
+        cards = []
+        for i in range(cardset.DECK_SIZE):
+            rank, suit = cardset.card(i)
+            image = card_image(rank, suit)
+            css_class = card_class(image)
+            cards.append(CardInfo(i, rank, suit, card_pk(i), image, css_class, cardset.RANK_VALUES[rank],
+                                  (rank, suit, css_class)))
+
+        self._cards = tuple(cards)
+
+    @property
+    def cards(self):
+        if self._cards is None:
+            self.load()
+
+        return self._cards
+
+    def __getitem__(self, index):
+        return self.cards[index]
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def get(self, rank, suit):
+        return self.cards[cardset.index(rank, suit)]
+
+    def by_pk(self, pk):
+        if not 1 <= pk <= cardset.DECK_SIZE:
+            raise KeyError(pk)
+
+        return self.cards[pk - 1]
+
+    def shorts(self, mask):
+        """
+        Display tuples (rank, suit, css_class) of every card in a cardset mask
+        """
+        cards = self.cards
+        return [cards[i].short for i in cardset.indexes(mask)]
+
+
+registry = CardRegistry()
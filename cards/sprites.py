@@ -0,0 +1,70 @@
+"""
+Layout of the card sprite sheet and the CSS that shows each card from it
+
+The sheet is a grid with a column per rank and a row per suit, the back sits
+below in the first column. Cells are twice the size the cards are shown at so
+they stay sharp on high density screens. build_sprites draws the sheet with
+Pillow, without it the same classes can point at the separate images instead.
+
+build_sprites writes to SPRITES_ROOT, which cards.finders.SpritesFinder serves
+ahead of the committed per-image cards.css. collectstatic runs it first so
+deploys ship the sheet without the build touching tracked files.
+"""
+from .registry import registry, card_class, BACK_IMAGE
+from . import cardset
+
+
+# Size cards are shown at in CSS pixels, cells in the sheet are SCALE times bigger
+WIDTH = 70
+HEIGHT = 100
+SCALE = 2
+
+COLUMNS = len(cardset.RANK_CODES)
+ROWS = len(cardset.SUIT_CODES) + 1
+
+SHEET_NAME = "cards.png"
+CSS_NAME = "cards.css"
+
+HEADER = "/* Generated by manage.py build_sprites, don't edit */\n"
+
+
+def layout():
+    """
+    (image, column, row) of every image in the sheet
+    """
+    cells = [(card.image, cardset.RANK_INDEX[card.rank], cardset.SUIT_INDEX[card.suit]) for card in registry]
+    cells.append((BACK_IMAGE, 0, ROWS - 1))
+    return cells
+
+
+def sheet_size():
+    return COLUMNS * WIDTH * SCALE, ROWS * HEIGHT * SCALE
+
+
+def face_rule(extra):
+    return ".card-face {\n    display: block;\n    width: %dpx;\n    height: %dpx;\n%s}\n" % (WIDTH, HEIGHT, extra)
+
+
+def sprite_css():
+    """
+    CSS showing each card from the sheet
+    """
+    rules = [HEADER, face_rule('    background-image: url("%s");\n    background-size: %dpx %dpx;\n' % (
+        SHEET_NAME, COLUMNS * WIDTH, ROWS * HEIGHT))]
+
+    for image, column, row in layout():
+        rules.append(".%s { background-position: %dpx %dpx; }\n" % (card_class(image), -column * WIDTH, -row * HEIGHT))
+
+    return "".join(rules)
+
+
+def separate_css():
+    """
+    CSS showing each card from its own image, for when the sheet hasn't been built
+    """
+    rules = [HEADER, face_rule("    background-size: 100% 100%;\n")]
+
+    for image, column, row in layout():
+        rules.append('.%s { background-image: url("%s"); }\n' % (card_class(image), image))
+
+    return "".join(rules)
@@ -1,2 +1,152 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import skipIf
 
+from django.apps import apps
+from django.contrib.staticfiles import finders
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+try:
+    import PIL
+except ImportError:
+    PIL = None
+
+from . import cardset, sprites
+from .models import Card
+from .registry import registry
+
+
+class CardsetTestCase(SimpleTestCase):
+    def test_every_card_has_its_own_bit(self):
+        """Each of the 52 cards maps to a distinct bit and back"""
+        masks = set()
+
+        for i in range(cardset.DECK_SIZE):
+            rank, suit = cardset.card(i)
+            self.assertEqual(cardset.index(rank, suit), i)
+            masks.add(cardset.bit(rank, suit))
+
+        self.assertEqual(len(masks), 52)
+        self.assertEqual(sum(masks), cardset.FULL)
+
+    def test_cards_round_trip(self):
+        """Masks list cards ordered by rank then suit"""
+        cards = [('K', 'S'), ('A', 'D'), ('10', 'H')]
+        mask = cardset.from_cards(cards)
+
+        self.assertEqual(cardset.cards(mask), [('A', 'D'), ('10', 'H'), ('K', 'S')])
+        self.assertEqual(cardset.count(mask), 3)
+        self.assertEqual(cardset.lowest_rank(mask), 'A')
+
+    def test_same_rank(self):
+        """Only non-empty sets of a single rank are the same rank"""
+        self.assertFalse(cardset.same_rank(0))
+        self.assertTrue(cardset.same_rank(cardset.rank_mask('7')))
+        self.assertTrue(cardset.same_rank(cardset.from_cards([('Q', 'H'), ('Q', 'C')])))
+        self.assertFalse(cardset.same_rank(cardset.from_cards([('Q', 'H'), ('K', 'H')])))
+
+
+class CardRegistryTestCase(TestCase):
+    def test_seeded_cards_match_registry(self):
+        """The migration seeds every card with the pk the registry expects"""
+        self.assertEqual(Card.objects.count(), 52)
+
+        for card in Card.objects.all():
+            info = registry.by_pk(card.pk)
+            self.assertEqual((info.rank, info.suit), (card.rank, card.suit))
+            self.assertEqual(card.short(), info.short)
+
+    def test_lookups(self):
+        """Cards can be found by index, code or pk"""
+        king = registry.get('K', 'S')
+
+        self.assertEqual(king.index, 51)
+        self.assertEqual(king.image, "king_of_spades.png")
+        self.assertEqual(king.css_class, "card-king-of-spades")
+        self.assertEqual(king.value, 13)
+        self.assertIs(registry[51], king)
+        self.assertIs(registry.by_pk(52), king)
+        self.assertEqual(registry.get('10', 'D').image, "10_of_diamonds.png")
+        self.assertEqual(registry.shorts(cardset.from_cards([('K', 'S'), ('A', 'H')])),
+                         [('A', 'H', "card-ace-of-hearts"), ('K', 'S', "card-king-of-spades")])
+
+        with self.assertRaises(KeyError):
+            registry.by_pk(53)
+
+
+class SpritesTestCase(SimpleTestCase):
+    def test_layout(self):
+        """Every card and the back get their own cell in the sheet"""
+        cells = sprites.layout()
+        columns, rows = sprites.COLUMNS, sprites.ROWS
+
+        self.assertEqual(len(cells), 53)
+        self.assertEqual(len(set((column, row) for image, column, row in cells)), 53)
+        self.assertTrue(all(0 <= column < columns and 0 <= row < rows for image, column, row in cells))
+        self.assertEqual(sprites.sheet_size(), (columns * 140, rows * 200))
+
+    def test_css_has_a_class_per_card(self):
+        """Both stylesheets show every card and the back"""
+        for css in [sprites.sprite_css(), sprites.separate_css()]:
+            for card in registry:
+                self.assertIn(".%s {" % card.css_class, css)
+            self.assertIn(".card-back {", css)
+
+        self.assertIn(".card-king-of-spades { background-position: -840px -300px; }", sprites.sprite_css())
+
+    def test_committed_css_is_current(self):
+        """cards.css was generated from the current layout"""
+        path = os.path.join(apps.get_app_config('cards').path, 'static', 'cards', sprites.CSS_NAME)
+
+        with open(path) as css_file:
+            self.assertIn(css_file.read(), [sprites.sprite_css(), sprites.separate_css()])
+
+    def build_dirs(self):
+        """Temporary SPRITES_ROOT and STATIC_ROOT, with the finders made again to see them"""
+        sprites_root, static_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sprites_root)
+        self.addCleanup(shutil.rmtree, static_root)
+
+        finders.get_finder.cache_clear()
+        self.addCleanup(finders.get_finder.cache_clear)
+        return sprites_root, static_root
+
+    def test_collectstatic_builds_sprites(self):
+        """collectstatic builds the card CSS into SPRITES_ROOT and collects it, leaving the app alone"""
+        sprites_root, static_root = self.build_dirs()
+        committed = os.path.join(apps.get_app_config('cards').path, 'static', 'cards', sprites.CSS_NAME)
+        modified = os.path.getmtime(committed)
+
+        with self.settings(SPRITES_ROOT=sprites_root, STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, no_sprite=True, verbosity=0, stdout=StringIO())
+
+            self.assertEqual(finders.find('cards/' + sprites.CSS_NAME),
+                             os.path.join(sprites_root, 'cards', sprites.CSS_NAME))
+
+        self.assertTrue(os.path.exists(os.path.join(static_root, 'cards', sprites.CSS_NAME)))
+        self.assertEqual(os.path.getmtime(committed), modified)
+
+    @skipIf(PIL is not None, "Pillow installed")
+    def test_collectstatic_without_pillow(self):
+        """Without Pillow collectstatic warns and collects the per-image CSS"""
+        sprites_root, static_root = self.build_dirs()
+        err = StringIO()
+
+        with self.settings(SPRITES_ROOT=sprites_root, STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO(), stderr=err)
+
+        self.assertIn("Pillow", err.getvalue())
+
+        with open(os.path.join(sprites_root, 'cards', sprites.CSS_NAME)) as css_file:
+            self.assertEqual(css_file.read(), sprites.separate_css())
+
+    def test_nothing_built(self):
+        """Before anything is built the committed cards.css is used"""
+        sprites_root, static_root = self.build_dirs()
+
+        with self.settings(SPRITES_ROOT=os.path.join(sprites_root, 'missing')):
+            self.assertEqual(finders.find('cards/' + sprites.CSS_NAME),
+                             os.path.join(apps.get_app_config('cards').path, 'static', 'cards', sprites.CSS_NAME))
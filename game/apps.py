@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class GameConfig(AppConfig):
     name = 'game'
+
+    def ready(self):
+        from pofu.sqlite import configure
+        connection_created.connect(configure)
@@ -0,0 +1,120 @@
+"""
+Bots that can take a seat in a game
+
+A bot's turn is picked by one of the strategies in game/strategies.py, the same
+ones the simulator plays. choose() gives every strategy the same time budget,
+GAME_BOT_TIME seconds, which Monte Carlo spends playing out the rest of the
+round, across the process pool servers start with start_pool().
+
+Bots take their turns on a thread of their own (BotTurns) once the move that
+handed them the turn has committed, so their thinking never holds a player's
+transaction or the SQLite write lock.
+"""
+import logging
+import queue
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import strategies
+from .strategies import STRATEGIES, legal_moves
+
+
+logger = logging.getLogger('pofu.bots')
+
+# Bots play as users named "<strategy>-bot-<seat>", people can't register names like these
+USERNAME = "%s-bot-%d"
+RESERVED_USERNAME = re.compile(r'-bot-\d', re.IGNORECASE)
+
+
+def reserved_username(username):
+    """
+    Whether a username looks like a bot's and can't be registered
+    """
+    return RESERVED_USERNAME.search(username) is not None
+
+
+def choose(strategy, table, rng=None, budget=None):
+    """
+    Picks a bot's move
+
+    Parameters:
+        strategy - Name of the strategy in STRATEGIES
+        table - strategies.Table the bot sees
+        rng - random.Random, seeded to make a choice reproducible
+        budget - Seconds to decide in, defaults to GAME_BOT_TIME
+
+    Returns:
+        strategies.Move to play, None if the hand has nothing to play
+    """
+    moves = legal_moves(table.hand, table.card_face)
+    if not moves:
+        return None
+
+    if budget is None:
+        budget = getattr(settings, 'GAME_BOT_TIME', 0.2)
+
+    return STRATEGIES[strategy]().choose(table, moves, rng or random.Random(), time.time() + budget)
+
+
+def start_pool():
+    """
+    Starts the GAME_BOT_PROCESSES processes Monte Carlo rollouts are spread over, called as a server starts
+    """
+    return strategies.start_pool(getattr(settings, 'GAME_BOT_PROCESSES', 0))
+
+
+class BotTurns(object):
+    """
+    Plays bots' turns one after another on a single thread
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, game_id):
+        """
+        Has the bot whose turn it is in the game play once the current transaction commits
+        """
+        transaction.on_commit(lambda: self.put(game_id))
+
+    def put(self, game_id):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pofu-bots', daemon=True)
+                self._thread.start()
+
+        self._queue.put(game_id)
+
+    def wait(self):
+        """
+        Blocks until every scheduled turn, and any turns they scheduled, has been played
+        """
+        self._queue.join()
+
+    def _run(self):
+        # Imported here as the models use this module
+        from .models import Game
+
+        while True:
+            game_id = self._queue.get()
+
+            try:
+                close_old_connections()
+                game = Game.objects.filter(pk=game_id).first()
+
+                if game is not None:
+                    game.play_bot_turn()
+            except Exception:
+                logger.exception("Playing a bot's turn in game %s failed", game_id)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+turns = BotTurns()
@@ -0,0 +1,89 @@
+"""
+Optimistic concurrency for moves that change whose turn it is
+
+A move reads the game without locking it and writes it inside a transaction which
+moves the turn on with a compare-and-swap on Game.version (see Game.compare_and_swap).
+If another request changed the game in between the swap updates nothing, the move
+is rolled back and retried on fresh state, up to GAME_CONFLICT_RETRIES times.
+Polls never write so they are never held up.
+
+Each attempt goes through pofu.sqlite.write, so with the SQLite write queue on
+moves are run one at a time by the writer thread and rarely conflict at all.
+"""
+import logging
+import threading
+
+from django.conf import settings
+
+from pofu.sqlite import write
+
+
+logger = logging.getLogger('pofu.conflicts')
+
+
+class GameConflict(Exception):
+    """
+    The game changed between reading it and claiming it
+    """
+
+
+class ConflictStats(object):
+    """
+    Counts of optimistic moves, the conflicts they hit and those that gave up
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.moves = 0
+        self.conflicts = 0
+        self.failures = 0
+
+    def record(self, conflicts, succeeded):
+        with self._lock:
+            self.moves += 1
+            self.conflicts += conflicts
+            self.failures += not succeeded
+
+    def stats(self):
+        with self._lock:
+            return {'moves': self.moves,
+                    'conflicts': self.conflicts,
+                    'failures': self.failures}
+
+    def clear(self):
+        with self._lock:
+            self.moves = 0
+            self.conflicts = 0
+            self.failures = 0
+
+
+conflicts = ConflictStats()
+
+
+def retry_on_conflict(move, reload):
+    """
+    Runs move() until it completes without a GameConflict
+
+    Parameters:
+        move - Callable applying the move, raises GameConflict if its claim fails
+        reload - Callable refreshing the state the move reads, called before each retry
+
+    Returns:
+        True if the move completed, False if every attempt conflicted
+    """
+    retries = getattr(settings, 'GAME_CONFLICT_RETRIES', 5)
+
+    for attempt in range(retries + 1):
+        if attempt:
+            reload()
+
+        try:
+            write(move)
+        except GameConflict:
+            continue
+
+        conflicts.record(attempt, True)
+        return True
+
+    conflicts.record(retries + 1, False)
+    logger.warning("Gave up after %d conflicting attempts", retries + 1)
+    return False
@@ -0,0 +1,612 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+
+from cards.models import Hand
+from cards.registry import registry, BACK
+from cards import cardset
+from pofu.sqlite import queued
+from .models import Game, GameEvent, Player, Action
+from .notifier import notifier
+from .snippets import snippets
+from .state import game_view, player_view
+from . import polling, rules
+
+logger = logging.getLogger('pofu.engine')
+
+def parse_card(card_string):
+    card_details = card_string.split()
+    return cardset.bit(card_details[0], card_details[1])
+
+
+class ActionState(object):
+    """
+    In-memory copy of an Action
+
+    Fields:
+        pk - Primary key of the Action row, None until flushed
+        face_up - Whether the cards were played face up
+        cards - cardset mask of the cards played
+    """
+    def __init__(self, face_up, cards, pk=None):
+        self.pk = pk
+        self.face_up = face_up
+        self.cards = cards
+
+    def score(self):
+        return rules.hand_score(cardset.count(self.cards), rules.cards_value(self.cards))
+
+    def points(self):
+        return rules.hand_points(cardset.count(self.cards), rules.cards_value(self.cards))
+
+
+class PlayerState(object):
+    """
+    In-memory copy of a Player along with their Hand and Action
+
+    Provides the same methods as Player that the snippet templates use so the
+    templates can be rendered from either
+    """
+    def __init__(self, game, player, cards, selected, action):
+        self.game = game
+        self.pk = player.pk
+        self.user = player.user
+        self.hand_id = player.hand.pk
+        self.points = player.points
+        self.position = player.position
+        self.turn = player.turn
+        self.error = player.error
+        self.face_up = player.face_up
+        self.ready = player.ready
+
+        self.cards = cards
+        self.selected = selected
+        self.action = action
+
+        self.dirty = False
+        self.cards_dirty = False
+        self.action_dirty = False
+
+    def __str__(self):
+        return str(self.game) + " - " + self.user.username
+
+    def reset(self, position, turn):
+        self.points = 0
+        self.turn = turn
+        self.error = ""
+        self.ready = True
+        self.position = position
+        self.dirty = True
+
+    def cards_left(self):
+        return cardset.count(self.cards | self.selected)
+
+    def held(self):
+        return self.cards, self.selected
+
+    def cards_in_hand(self):
+        return registry.shorts(self.cards)
+
+    def selected_cards(self):
+        return registry.shorts(self.selected)
+
+    def last_action(self):
+        if self.action is None:
+            return []
+
+        return registry.shorts(self.action.cards)
+
+    def played_cards(self):
+        if self.action is None:
+            return []
+
+        if self.action.face_up:
+            return self.last_action()
+
+        return [BACK] * cardset.count(self.action.cards)
+
+    def has_error(self):
+        return len(self.error) > 0
+
+
+class GameState(object):
+    """
+    In-memory copy of a Game which applies moves without touching the DB
+
+    Moves mirror the methods on Game and Player. Changes are only written back
+    to the DB by flush(), which is called by GameStore in batches.
+    """
+    def __init__(self, game):
+        self.pk = game.pk
+        self.status = game.status
+        self.host_id = game.host_id
+        self.order = list(game.positions)
+        self.turn = game.turn
+        self.card_face = game.card_face
+        self.version = game.version
+        self.players = []
+        self.events = []
+
+        self.dirty = False
+        self.moves = 0
+        self.flushed = time.time()
+
+    def __str__(self):
+        return "Game " + str(self.pk)
+
+    @classmethod
+    def load(cls, pk):
+        """
+        Loads a game and everything needed to play it
+
+        Raises:
+            Game.DoesNotExist
+        """
+        game = Game.objects.get(pk=pk)
+        state = cls(game)
+
+        for player in game.player_set.order_by('pk').select_related('user', 'hand', 'action'):
+            action = None
+            if player.action is not None:
+                action = ActionState(player.action.face_up, player.action.cards, pk=player.action.pk)
+
+            state.players.append(PlayerState(state, player, player.hand.cards, player.hand.selected, action))
+
+        return state
+
+    def player_for_user(self, user):
+        for player in self.players:
+            if player.user.pk == user.pk:
+                return player
+
+        raise Player.DoesNotExist
+
+    def player_at(self, position):
+        for player in self.players:
+            if player.position == position:
+                return player
+
+        raise Player.DoesNotExist
+
+    def active_position(self):
+        if self.turn < len(self.order):
+            return self.order[self.turn]
+
+        return None
+
+    def is_round_end(self):
+        return self.turn >= len(self.players)
+
+    def poll(self, user, version=None):
+        """
+        Same as Game.poll but rendered from memory
+        """
+        if version is not None and str(version) == str(self.version):
+            return {'version': self.version}
+
+        player = self.player_for_user(user)
+        player_html = snippets.render(self.pk, self.version, player, 'self')
+
+        other_html = [(p.user.username, snippets.render(self.pk, self.version, p, 'other'))
+                      for p in self.players if p is not player]
+
+        return {'version': self.version,
+                'self': player_html,
+                'players': other_html,
+                'interval': self.poll_interval(player)}
+
+    def poll_interval(self, player):
+        return polling.poll_interval(self.status, self.is_round_end(), self.order, self.turn, player.position)
+
+    def state(self, user, version=None):
+        """
+        Same as Game.state but from memory
+        """
+        if version is not None and str(version) == str(self.version):
+            return {'version': self.version}
+
+        return game_view(self, self.player_for_user(user), self.players)
+
+    def snippet_html(self, player):
+        return {'self': render_to_string('game/player_snippet.html', {'player': player})}
+
+    def player_state(self, player):
+        return player_view(player)
+
+    def record(self, kind, position=None, cards=0, value=0):
+        """
+        Queues a move for the event log, GameStore.changed advances the version once the move is applied
+        """
+        self.events.append(GameEvent(game_id=self.pk, version=self.version + 1, kind=kind,
+                                     position=position, cards=cards, value=value))
+
+    def start(self, seed=None):
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+
+        self.record(GameEvent.START, value=seed)
+
+        positions = list(range(len(self.players)))
+        random.Random(seed).shuffle(positions)
+
+        for i, player in enumerate(self.players):
+            player.reset(position=positions[i], turn=positions[i] == 0)
+            player.cards = 0
+            player.selected = 0
+            player.action = None
+            player.cards_dirty = True
+            player.action_dirty = True
+
+        for player, cards in zip(self.players, cardset.deal(len(self.players), random.Random(seed))):
+            player.cards = cards
+
+        self.order = rules.turn_order(len(self.players))
+        self.turn = 0
+        self.start_round()
+
+    def start_round(self):
+        if not all(player.ready for player in self.players):
+            return
+
+        self.card_face = 2
+        self.turn = 0
+
+    def next_turn(self):
+        self.turn += 1
+
+        if self.is_round_end():
+            self.end_round()
+            return
+
+        # Set face-up based on first player so other players in the round must follow play
+        if self.card_face == 2:
+            self.card_face = int(self.player_at(self.order[0]).action.face_up)
+
+        player = self.player_at(self.order[self.turn])
+        player.turn = True
+        player.dirty = True
+
+    def end_round(self):
+        scores = []
+
+        for player in self.players:
+            if not player.action.face_up:
+                player.action.face_up = True
+                player.action_dirty = True
+
+            player.ready = False
+            player.dirty = True
+
+            scores.append(player.action.score() + rules.score_bonus(player.position == self.order[0],
+                                                                    self.card_face))
+
+        winner = self.players[rules.round_winner(scores)]
+        points = sum(player.action.points() for player in self.players)
+        winner.points += points
+        winner.turn = True
+
+        # The round end is a change of its own a version after the play that ended it, as in Game.end_round
+        self.version += 1
+        self.record(GameEvent.ROUND_END, winner.position, value=points)
+
+        self.order = rules.turn_order(len(self.players), winner.position)
+        self.card_face = 2
+
+    def select(self, player, card_string):
+        card = parse_card(card_string)
+
+        if player.cards & card:
+            player.cards &= ~card
+            player.selected |= card
+            player.dirty = player.cards_dirty = True
+
+        self.record(GameEvent.SELECT, player.position, player.selected)
+
+    def deselect(self, player, card_string):
+        card = parse_card(card_string)
+
+        if player.selected & card:
+            player.selected &= ~card
+            player.cards |= card
+            player.dirty = player.cards_dirty = True
+
+        self.record(GameEvent.SELECT, player.position, player.selected)
+
+    def set_selection(self, player, card_strings):
+        try:
+            selected = cardset.parse(card_strings)
+        except ValueError:
+            player.error = "Unknown card"
+            return
+
+        held = player.cards | player.selected
+
+        if selected & ~held:
+            player.error = "Can only select cards in your hand"
+            return
+
+        player.cards = held & ~selected
+        player.selected = selected
+        player.dirty = player.cards_dirty = True
+        self.record(GameEvent.SELECT, player.position, selected)
+
+    def select_face(self, player, face):
+        player.face_up = face == "up"
+        player.dirty = True
+        self.record(GameEvent.FACE, player.position, value=player.face_up)
+
+    def set_ready(self, player):
+        player.ready = True
+        player.dirty = True
+        self.record(GameEvent.READY, player.position)
+        self.start_round()
+
+    def submit_action(self, player, face):
+        self.play_cards(player, player.selected, face)
+
+    def play(self, player, card_strings, face):
+        try:
+            cards = cardset.parse(card_strings)
+        except ValueError:
+            player.error = "Unknown card"
+            return
+
+        self.play_cards(player, cards, face)
+
+    def play_cards(self, player, cards, face):
+        if not player.turn or self.is_round_end():
+            return
+
+        held = player.cards | player.selected
+
+        if cards & ~held:
+            player.error = "Can only play cards in your hand"
+            return
+
+        face_up = face == "up" if face is not None else bool(self.card_face)
+
+        player.error = rules.validate(cards)
+        player.dirty = True
+
+        if not player.has_error():
+            player.action = ActionState(face_up, cards)
+            player.cards = held & ~cards
+            player.selected = 0
+            player.turn = False
+            player.cards_dirty = player.action_dirty = True
+            self.record(GameEvent.PLAY, player.position, cards, face_up)
+
+            self.next_turn()
+
+    def flush_due(self):
+        return (self.moves >= getattr(settings, 'GAME_ENGINE_FLUSH_MOVES', 20) or
+                time.time() - self.flushed >= getattr(settings, 'GAME_ENGINE_FLUSH_INTERVAL', 5) or
+                self.is_round_end())
+
+    def flush_overdue(self):
+        return self.dirty and time.time() - self.flushed >= getattr(settings, 'GAME_ENGINE_FLUSH_INTERVAL', 5)
+
+    @queued
+    def flush(self):
+        """
+        Writes all changes since the last flush back to the DB in one transaction
+        """
+        if not self.dirty:
+            return
+
+        with transaction.atomic():
+            Game.objects.filter(pk=self.pk).update(order=rules.pack_order(self.order),
+                                                   turn=self.turn,
+                                                   active_position=self.active_position(),
+                                                   card_face=self.card_face,
+                                                   version=self.version)
+
+            for player in self.players:
+                if player.action_dirty:
+                    self.flush_action(player.action)
+
+                if player.cards_dirty:
+                    Hand.objects.filter(pk=player.hand_id).update(cards=player.cards, selected=player.selected)
+
+                if player.dirty or player.action_dirty:
+                    Player.objects.filter(pk=player.pk).update(
+                        points=player.points,
+                        position=player.position,
+                        turn=player.turn,
+                        error=player.error,
+                        face_up=player.face_up,
+                        ready=player.ready,
+                        action=player.action.pk if player.action is not None else None)
+
+                player.dirty = player.cards_dirty = player.action_dirty = False
+
+            GameEvent.objects.bulk_create(self.events)
+
+        self.events = []
+        self.dirty = False
+        self.moves = 0
+        self.flushed = time.time()
+
+    def flush_action(self, action):
+        if action is None:
+            return
+
+        if action.pk is not None:
+            Action.objects.filter(pk=action.pk).update(face_up=action.face_up)
+            return
+
+        row = Action(face_up=action.face_up, cards=action.cards)
+        row.save()
+        action.pk = row.pk
+
+
+class GameStore(object):
+    """
+    Process wide cache of GameStates with write-behind persistence
+
+    Moves are applied to the cached state and flushed to the DB once
+    GAME_ENGINE_FLUSH_MOVES moves have built up or the round has ended. A
+    background thread flushes any game left with changes for
+    GAME_ENGINE_FLUSH_INTERVAL seconds, so games that go quiet are still written.
+    Only safe while a single process serves each game, enable with GAME_ENGINE = True.
+
+    Each game has its own lock so loading, rendering or flushing one game never
+    holds up another, the store's lock only guards the dictionaries.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._states = {}
+        self._flusher = None
+
+    def lock(self, pk):
+        with self._lock:
+            return self._locks.setdefault(pk, threading.RLock())
+
+    @contextmanager
+    def locked(self, pk):
+        """
+        The game's state with its lock held, loaded first if it isn't cached
+        """
+        pk = int(pk)
+
+        with self.lock(pk):
+            state = self._states.get(pk)
+
+            if state is None:
+                state = GameState.load(pk)
+
+                with self._lock:
+                    self._states[pk] = state
+
+                self.start_flusher()
+
+            yield state
+
+    def get(self, pk):
+        with self.locked(pk) as state:
+            return state
+
+    def poll(self, pk, user, version=None):
+        with self.locked(pk) as state:
+            return state.poll(user, version)
+
+    def state(self, pk, user, version=None):
+        with self.locked(pk) as state:
+            return state.state(user, version)
+
+    def snippet_html(self, pk, user):
+        with self.locked(pk) as state:
+            return state.snippet_html(state.player_for_user(user))
+
+    def player_state(self, pk, user):
+        with self.locked(pk) as state:
+            return state.player_state(state.player_for_user(user))
+
+    def start(self, pk, seed=None):
+        with self.locked(pk) as state:
+            state.start(seed)
+            self.changed(state)
+
+    def apply(self, pk, user, move, *args, compact=False):
+        """
+        Applies a move for the user's player
+
+        Parameters:
+            pk - Primary key of the game
+            user - User making the move
+            move - Name of the GameState method to call, e.g. 'select'
+            args - Extra arguments passed to the move
+            compact - Return the player's state instead of their snippet
+
+        Returns:
+            Snippet html, or state if compact, of the user's player after the move
+        """
+        with self.locked(pk) as state:
+            player = state.player_for_user(user)
+            getattr(state, move)(player, *args)
+            self.changed(state)
+
+            if compact:
+                return state.player_state(player)
+
+            return state.snippet_html(player)
+
+    def changed(self, state):
+        state.version += 1
+        state.moves += 1
+        state.dirty = True
+
+        if state.flush_due():
+            state.flush()
+
+        notifier.notify(state.pk)
+
+    def cached(self):
+        with self._lock:
+            return list(self._states.keys())
+
+    def flush_game(self, pk):
+        """
+        Flushes one game if it is cached, leaving every other game to its own flush
+        """
+        pk = int(pk)
+
+        with self.lock(pk):
+            state = self._states.get(pk)
+
+            if state is not None:
+                state.flush()
+
+    def flush(self, overdue_only=False):
+        """
+        Flushes every cached game, or only those with changes older than GAME_ENGINE_FLUSH_INTERVAL
+        """
+        for pk in self.cached():
+            with self.lock(pk):
+                state = self._states.get(pk)
+
+                if state is not None and (not overdue_only or state.flush_overdue()):
+                    state.flush()
+
+    def start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+
+            self._flusher = threading.Thread(target=self.run_flusher, name='game-flusher', daemon=True)
+
+        self._flusher.start()
+
+    def run_flusher(self):
+        """
+        Flushes overdue games about once a second for the life of the process
+        """
+        while True:
+            time.sleep(min(getattr(settings, 'GAME_ENGINE_FLUSH_INTERVAL', 5), 1))
+
+            try:
+                self.flush(overdue_only=True)
+            except Exception:
+                logger.exception("Flushing games failed")
+            finally:
+                connection.close()
+
+    def evict(self, pk):
+        with self.lock(int(pk)):
+            with self._lock:
+                state = self._states.pop(int(pk), None)
+
+            if state is not None:
+                state.flush()
+
+
+games = GameStore()
+atexit.register(games.flush)
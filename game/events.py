@@ -0,0 +1,169 @@
+"""
+Rebuilding games from their event log
+
+Every move is appended to GameEvent as it is made (see Game.record), so the
+state of a game at any version can be rebuilt by replaying its events through
+the in-memory engine's GameState. Replays start from the latest GameSnapshot at
+or before the version asked for, and a replay up to the current version that had
+to apply GAME_SNAPSHOT_EVERY or more events saves a new snapshot, so the tail
+stays short however long the game runs.
+"""
+import json
+
+from django.conf import settings
+
+from .engine import ActionState, GameState
+from .models import GameEvent, GameSnapshot
+
+
+PLAYER_FIELDS = ('points', 'position', 'turn', 'ready', 'face_up', 'cards', 'selected')
+
+
+def clear(state):
+    """
+    Resets a GameState to a game which hasn't been started
+    """
+    state.order = []
+    state.turn = 0
+    state.card_face = 2
+    state.version = 0
+
+    for player in state.players:
+        player.points = player.position = player.cards = player.selected = 0
+        player.turn = player.ready = player.face_up = False
+        player.error = ""
+        player.action = None
+
+
+def dump(state):
+    """
+    JSON for a GameSnapshot of a GameState
+    """
+    return json.dumps({
+        'order': state.order,
+        'turn': state.turn,
+        'card_face': state.card_face,
+        'players': [dict([(field, getattr(player, field)) for field in PLAYER_FIELDS],
+                         pk=player.pk,
+                         action=[player.action.face_up, player.action.cards] if player.action else None)
+                    for player in state.players],
+    })
+
+
+def restore(state, snapshot):
+    """
+    Sets a GameState to the state saved in a GameSnapshot
+    """
+    data = json.loads(snapshot.state)
+
+    state.order = data['order']
+    state.turn = data['turn']
+    state.card_face = data['card_face']
+    state.version = snapshot.version
+
+    players = dict((player['pk'], player) for player in data['players'])
+
+    for player in state.players:
+        saved = players[player.pk]
+
+        for field in PLAYER_FIELDS:
+            setattr(player, field, saved[field])
+
+        player.error = ""
+        player.action = ActionState(*saved['action']) if saved['action'] else None
+
+
+def apply(state, event):
+    """
+    Makes the move an event recorded on a GameState
+    """
+    if event.kind == GameEvent.START:
+        state.start(event.value)
+
+    elif event.kind == GameEvent.SELECT:
+        player = state.player_at(event.position)
+        held = player.cards | player.selected
+        player.cards = held & ~event.cards
+        player.selected = event.cards
+
+    elif event.kind == GameEvent.FACE:
+        state.select_face(state.player_at(event.position), "up" if event.value else "down")
+
+    elif event.kind == GameEvent.READY:
+        state.set_ready(state.player_at(event.position))
+
+    elif event.kind == GameEvent.PLAY:
+        state.play_cards(state.player_at(event.position), event.cards, "up" if event.value else "down")
+
+    # Round ends are worked out again by the play that ended the round, the event is only a record
+
+    state.version = event.version
+
+
+def replay(pk, version=None):
+    """
+    Rebuilds a game from its events
+
+    The GameState returned is only a view of the past, it must never be flushed
+
+    Parameters:
+        pk - Primary key of the game
+        version - Version to rebuild the game at, None for the latest
+
+    Returns:
+        GameState as it was once every event up to the version had been applied
+    """
+    state = GameState.load(pk)
+
+    snapshots = GameSnapshot.objects.filter(game_id=pk)
+    events = GameEvent.objects.filter(game_id=pk)
+
+    if version is not None:
+        snapshots = snapshots.filter(version__lte=version)
+        events = events.filter(version__lte=version)
+
+    snapshot = snapshots.order_by('-version').first()
+
+    if snapshot is not None:
+        restore(state, snapshot)
+        events = events.filter(version__gt=snapshot.version)
+    else:
+        clear(state)
+
+    applied = 0
+    for event in events.order_by('pk'):
+        apply(state, event)
+        applied += 1
+
+    if version is None and applied and applied >= getattr(settings, 'GAME_SNAPSHOT_EVERY', 100):
+        GameSnapshot.objects.create(game_id=pk, version=state.version, state=dump(state))
+
+    state.events = []
+    state.dirty = False
+    return state
+
+
+def catch_up(pk, position, since):
+    """
+    Events since a version as the player at position is allowed to see them, for a reconnecting client
+
+    Selections and face down plays of other players have their cards hidden, as does the seed of the deal
+
+    Returns:
+        List of [version, kind, position, cards, value] in the order they happened
+    """
+    events = []
+
+    for event in GameEvent.objects.filter(game_id=pk, version__gt=since).order_by('pk'):
+        cards, value = event.cards, event.value
+
+        if event.kind == GameEvent.START:
+            value = 0
+
+        elif event.position != position and (event.kind == GameEvent.SELECT or
+                                              (event.kind == GameEvent.PLAY and not event.value)):
+            cards = 0
+
+        events.append([event.version, event.kind, event.position, cards, value])
+
+    return events
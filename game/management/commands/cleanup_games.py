@@ -0,0 +1,92 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.core import serializers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cards.models import Hand
+from game.models import Action, Game, GameEvent, GameSnapshot, Player
+
+
+class Command(BaseCommand):
+    help = ("Deletes Actions no player refers to any more and archives finished and cancelled games "
+            "to a gzipped fixture per game before removing them. Works in small transactions so it "
+            "can run while games are being played")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows deleted per transaction")
+        parser.add_argument('--archive-dir', default=None,
+                            help="Where archived games are written, defaults to GAME_ARCHIVE_DIR")
+        parser.add_argument('--dry-run', action='store_true', help="Only report, don't change anything")
+
+    def handle(self, *args, **options):
+        actions = self.collect_actions(options['batch_size'], options['dry_run'])
+
+        archive_dir = options['archive_dir'] or getattr(settings, 'GAME_ARCHIVE_DIR', 'archive')
+        archived = self.archive_games(archive_dir, options['dry_run'])
+
+        self.stdout.write("%d actions %s, %d games %s" % (
+            actions, "to delete" if options['dry_run'] else "deleted",
+            archived, "to archive" if options['dry_run'] else "archived"))
+
+    def collect_actions(self, batch_size, dry_run):
+        """
+        Deletes unreferenced Actions in batches, every round leaves each player's last one behind
+        """
+        orphans = Action.objects.filter(player__isnull=True)
+
+        if dry_run:
+            return orphans.count()
+
+        deleted = 0
+
+        while True:
+            with transaction.atomic():
+                pks = list(orphans.values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    return deleted
+
+                # Checked again in the DELETE in case one was taken up since it was read
+                deleted += orphans.filter(pk__in=pks).delete()[0]
+
+    def archive_games(self, archive_dir, dry_run):
+        """
+        Writes each finished or cancelled game to <archive_dir>/game-<pk>.json.gz then deletes it
+
+        The files are fixtures so a game can be brought back with loaddata
+        """
+        games = Game.objects.filter(status__in=['F', 'C']).order_by('pk')
+
+        if dry_run:
+            return games.count()
+
+        if not os.path.isdir(archive_dir):
+            os.makedirs(archive_dir)
+
+        archived = 0
+
+        for pk in games.values_list('pk', flat=True):
+            with transaction.atomic():
+                game = Game.objects.select_for_update().get(pk=pk)
+                players = list(Player.objects.filter(game=game))
+                actions = list(Action.objects.filter(player__game=game))
+
+                # Dependencies first so loaddata can put them back in order
+                rows = (actions + [game] + players + list(Hand.objects.filter(player__game=game)) +
+                        list(GameEvent.objects.filter(game=game).order_by('pk')) +
+                        list(GameSnapshot.objects.filter(game=game)))
+
+                path = os.path.join(archive_dir, 'game-%d.json.gz' % pk)
+                with gzip.open(path + '.tmp', 'wt') as archive:
+                    serializers.serialize('json', rows, stream=archive)
+                os.rename(path + '.tmp', path)
+
+                game.delete()
+                Action.objects.filter(pk__in=[action.pk for action in actions]).delete()
+
+            archived += 1
+            self.stdout.write("Archived Game %d to %s" % (pk, path))
+
+        return archived
@@ -0,0 +1,203 @@
+import re
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from game.models import Game, GamesManager, Setup, Invitation
+
+
+HAND_CARD = re.compile(r'id="h (\S+) (\S)"')
+SELECTED_CARD = re.compile(r'id="s (\S+) (\S)"')
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+class Recorder(object):
+    """
+    Collects latencies, errors and query counts per endpoint from all worker threads
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, latency, queries, error):
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            self.queries[endpoint] += queries
+
+            if error:
+                self.errors[endpoint] += 1
+
+
+class SimulatedPlayer(object):
+    """
+    Plays one seat of a game through the real URL routes, deciding what to do
+    from the html it gets back the same way a person using game.js would
+    """
+    def __init__(self, game, user, recorder, think):
+        self.game = game
+        self.user = user
+        self.recorder = recorder
+        self.think = think
+        self.version = None
+        self.html = ""
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, endpoint, data=None):
+        url = reverse('game:' + endpoint, kwargs={'pk': self.game.pk})
+        start = time.time()
+        error = False
+        response = None
+
+        try:
+            response = self.client.post(url, data or {})
+            error = response.status_code != 200
+        except Exception:
+            error = True
+
+        self.recorder.record(endpoint, time.time() - start, len(connection.queries_log), error)
+
+        if error:
+            return {}
+
+        return response.json()
+
+    def update(self, response):
+        if 'version' in response:
+            self.version = response['version']
+
+        if 'self' in response:
+            self.html = response['self']
+
+    def step(self):
+        """
+        Makes the next move the html shows is available, otherwise polls
+        """
+        if 'id="submit-ready"' in self.html:
+            self.update(self.request('ready'))
+
+        elif 'id="submit-action"' in self.html and SELECTED_CARD.search(self.html):
+            self.update(self.request('submit', {'face': 'up'}))
+
+        elif 'id="submit-action"' in self.html and HAND_CARD.search(self.html):
+            rank, suit = HAND_CARD.search(self.html).groups()
+            self.update(self.request('select', {'card': rank + " " + suit}))
+
+            if 'id="card-face-form"' in self.html:
+                self.update(self.request('face', {'face': 'up'}))
+
+        else:
+            data = {} if self.version is None else {'version': self.version}
+            self.update(self.request('poll', data))
+
+            if self.think:
+                time.sleep(self.think)
+
+    def play(self, requests):
+        connection.force_debug_cursor = True
+
+        try:
+            for _ in range(requests):
+                self.step()
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = "Plays many concurrent games through the game URLs and reports throughput and latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help="Number of users to create")
+        parser.add_argument('--games', type=int, default=4, help="Number of games to create")
+        parser.add_argument('--players', type=int, default=2, help="Players per game (2-8)")
+        parser.add_argument('--requests', type=int, default=100, help="Requests made by each simulated player")
+        parser.add_argument('--workers', type=int, default=8, help="Size of the thread pool")
+        parser.add_argument('--think', type=float, default=0, help="Seconds to wait after each poll")
+        parser.add_argument('--keep', action='store_true', help="Keep the users and games created")
+
+    def handle(self, *args, **options):
+        if options['users'] < options['players']:
+            self.stderr.write("Need at least as many users as players per game")
+            return
+
+        prefix = "loadtest-%d-" % int(time.time())
+        users = [User.objects.create_user(prefix + str(i)) for i in range(options['users'])]
+
+        try:
+            with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+                self.run(users, options)
+        finally:
+            if not options['keep']:
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, users, options):
+        recorder = Recorder()
+        seats = []
+
+        for g in range(options['games']):
+            seated = [users[(g * options['players'] + i) % len(users)] for i in range(options['players'])]
+            game = self.create_game(seated)
+
+            host = Client()
+            host.force_login(seated[0])
+            host.post(reverse('game:start', kwargs={'pk': game.pk}))
+
+            seats.extend(SimulatedPlayer(game, user, recorder, options['think']) for user in seated)
+
+        start = time.time()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [pool.submit(seat.play, options['requests']) for seat in seats]
+
+        for future in futures:
+            future.result()
+
+        self.report(recorder, time.time() - start)
+
+    def create_game(self, users):
+        setup = Setup(host=users[0], num_players=len(users), message="Load test")
+        setup.save()
+
+        for user in users:
+            Invitation(setup=setup, user=user).save()
+
+        GamesManager.create_game(setup)
+        return Game.objects.filter(host=users[0]).latest('pk')
+
+    def report(self, recorder, elapsed):
+        total = sum(len(latencies) for latencies in recorder.latencies.values())
+        queries = sum(recorder.queries.values())
+
+        self.stdout.write("%d requests in %.2fs: %.1f requests/sec, %d queries" % (
+            total, elapsed, total / elapsed if elapsed else 0, queries))
+        self.stdout.write("%-8s %8s %8s %8s %8s %8s %10s" % ("endpoint", "count", "errors", "p50 ms", "p95 ms",
+                                                              "p99 ms", "queries"))
+
+        for endpoint in sorted(recorder.latencies):
+            latencies = sorted(recorder.latencies[endpoint])
+            self.stdout.write("%-8s %8d %8d %8.1f %8.1f %8.1f %10d" % (
+                endpoint, len(latencies), recorder.errors[endpoint],
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000,
+                recorder.queries[endpoint]))
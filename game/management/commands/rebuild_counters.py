@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from cards.models import Hand
+from game.models import Game
+
+
+class Command(BaseCommand):
+    help = "Checks the denormalized game fields against the tables they are derived from and rebuilds any that differ"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report, don't fix anything")
+
+    def handle(self, *args, **options):
+        fixed = 0
+
+        with transaction.atomic():
+            for game in Game.objects.annotate(players=models.Count('player')):
+                fields = {}
+
+                if game.player_count != game.players:
+                    fields['player_count'] = game.players
+
+                positions = game.positions
+                active_position = positions[game.turn] if game.turn < len(positions) else None
+
+                if game.active_position != active_position:
+                    fields['active_position'] = active_position
+
+                if not fields:
+                    continue
+
+                fixed += 1
+                self.stdout.write("%s: %s" % (game, ", ".join("%s %s -> %s" % (name, getattr(game, name), value)
+                                                               for name, value in sorted(fields.items()))))
+
+                if not options['dry_run']:
+                    Game.objects.filter(pk=game.pk).update(**fields)
+
+        # A card can't be both in hand and selected, these can only be reported
+        overlapping = Hand.objects.extra(where=['cards & selected != 0'])
+        for hand in overlapping:
+            self.stdout.write("%s has cards both in hand and selected" % hand)
+
+        self.stdout.write("%d games %s, %d hands overlapping" % (
+            fixed, "to fix" if options['dry_run'] else "fixed", len(overlapping)))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Plays batches of games between bot strategies without the DB and reports the results per seat"
+
+    def add_arguments(self, parser):
+        parser.add_argument('strategies', nargs='+',
+                            help="Strategy for each seat: random, greedy, lowest or beat (2-8 seats)")
+        parser.add_argument('--games', type=int, default=10000, help="Number of games to play")
+        parser.add_argument('--batch', type=int, default=10000, help="Games played at once as one set of arrays")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for repeatable results")
+
+    def handle(self, *args, **options):
+        try:
+            from game.simulator import Simulator, STRATEGIES
+        except ImportError:
+            raise CommandError("The simulator needs numpy installed")
+
+        unknown = [name for name in options['strategies'] if name not in STRATEGIES]
+        if unknown:
+            raise CommandError("Unknown strategies %s, choose from %s" % (", ".join(unknown),
+                                                                          ", ".join(sorted(STRATEGIES))))
+
+        if not 2 <= len(options['strategies']) <= 8:
+            raise CommandError("Need between 2 and 8 seats")
+
+        simulator = Simulator(options['strategies'], seed=options['seed'])
+
+        start = time.time()
+        report = simulator.report(options['games'], batch=options['batch'])
+        elapsed = time.time() - start
+
+        self.stdout.write("%d games in %.2fs: %.0f games/sec" % (
+            options['games'], elapsed, options['games'] / elapsed if elapsed else 0))
+        self.stdout.write("%-4s %-8s %8s %8s %8s %6s %6s %6s %6s %6s" % (
+            "seat", "strategy", "rounds", "games", "mean", "p5", "p25", "p50", "p75", "p95"))
+
+        for seat, result in enumerate(report):
+            percentiles = result['points_percentiles']
+            self.stdout.write("%-4d %-8s %7.1f%% %7.1f%% %8.1f %6.0f %6.0f %6.0f %6.0f %6.0f" % (
+                seat, result['strategy'],
+                result['round_win_rate'] * 100,
+                result['game_win_rate'] * 100,
+                result['mean_points'],
+                percentiles[5], percentiles[25], percentiles[50], percentiles[75], percentiles[95]))
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError, DEFAULT_DB_ALIAS
+from django.test.utils import override_settings
+
+from cards import cardset
+from game.models import Game, Player
+from pofu import sqlite
+
+
+MODES = ('default', 'wal', 'queue')
+
+
+class Command(BaseCommand):
+    help = ("Compares move throughput of real games on a scratch SQLite file with the default settings, "
+            "the production pragmas and the production pragmas with the write queue")
+
+    def add_arguments(self, parser):
+        parser.add_argument('modes', nargs='*', default=MODES, help="Modes to run: default, wal and/or queue")
+        parser.add_argument('--threads', type=int, default=8, help="Number of games played at once, one per thread")
+        parser.add_argument('--moves', type=int, default=200, help="Moves made in each game")
+        parser.add_argument('--reads', type=int, default=4, help="Polls of the game before each move")
+        parser.add_argument('--players', type=int, default=4, help="Number of players in each game")
+
+    def handle(self, *args, **options):
+        unknown = [mode for mode in options['modes'] if mode not in MODES]
+        if unknown:
+            raise CommandError("Unknown modes %s, choose from %s" % (", ".join(unknown), ", ".join(MODES)))
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            self.stdout.write("%-8s %10s %8s %8s %10s" % ("mode", "moves/sec", "moves", "locked", "batch"))
+
+            for mode in options['modes']:
+                self.report(mode, *self.run(mode, os.path.join(directory, mode + '.sqlite3'), options))
+        finally:
+            shutil.rmtree(directory)
+
+    def databases(self, mode, name):
+        """
+        The default and read DATABASES entries a mode points at the scratch file, as SQLITE_PRODUCTION sets them
+        """
+        default = dict(connections.databases[DEFAULT_DB_ALIAS], NAME=name, PRAGMAS=None, TEST={})
+
+        if mode == 'default':
+            return {DEFAULT_DB_ALIAS: default}
+
+        return {DEFAULT_DB_ALIAS: dict(default, PRAGMAS=settings.SQLITE_PRAGMAS),
+                'read': dict(default, PRAGMAS=dict(settings.SQLITE_PRAGMAS, query_only=1))}
+
+    def in_thread(self, func, *args):
+        """
+        Runs func(*args) on a new thread, which opens its own connections to the scratch file
+        """
+        result = {}
+
+        def run():
+            try:
+                result['value'] = func(*args)
+            except Exception as e:
+                result['error'] = e
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        if 'error' in result:
+            raise result['error']
+
+        return result['value']
+
+    def setup(self, options):
+        call_command('migrate', verbosity=0, interactive=False)
+        pks = []
+
+        for i in range(options['threads']):
+            users = [User.objects.create(username="bench-%d-%d" % (i, seat)) for seat in range(options['players'])]
+            game = Game(host=users[0], player_count=len(users))
+            game.save()
+
+            for user in users:
+                Player(game=game, user=user).save()
+
+            game.start(seed=i)
+            pks.append(game.pk)
+
+        return pks
+
+    def move(self, pk, reads):
+        """
+        Polls the game as players waiting on it would, then makes the next move through the same
+        model methods the views use: the active player plays a card, a player gets ready
+        between rounds or the game is dealt again once the active player runs out of cards
+        """
+        game = Game.objects.get(pk=pk)
+        players = list(game.player_set.select_related('user', 'hand', 'action'))
+
+        for i in range(reads):
+            Game.objects.get(pk=pk).poll(players[i % len(players)].user)
+
+        for player in players:
+            player.game = game
+
+        if game.is_round_end():
+            next(player for player in players if not player.ready).set_ready()
+            return
+
+        player = next(player for player in players if player.position == game.active_position)
+
+        if player.hand.cards:
+            player.play(["%s %s" % cardset.cards(player.hand.cards)[0]], None)
+        else:
+            game.start()
+
+    def run(self, mode, name, options):
+        databases = self.databases(mode, name)
+        saved = dict((alias, connections.databases.get(alias)) for alias in databases)
+        lock = threading.Lock()
+        counts = {'moves': 0, 'locked': 0}
+
+        def player(pk):
+            try:
+                for i in range(options['moves']):
+                    try:
+                        self.move(pk, options['reads'])
+                    except OperationalError:
+                        with lock:
+                            counts['locked'] += 1
+                        continue
+
+                    with lock:
+                        counts['moves'] += 1
+            finally:
+                connections.close_all()
+
+        # Threads started from here on connect to the scratch file, the writer thread included
+        sqlite.writes.stop()
+        connections.databases.update(databases)
+
+        try:
+            pks = self.in_thread(self.setup, options)
+            threads = [threading.Thread(target=player, args=(pk,)) for pk in pks]
+            routers = ['pofu.sqlite.ReadRouter'] if 'read' in databases else []
+
+            with override_settings(SQLITE_WRITE_QUEUE=mode == 'queue', DATABASE_ROUTERS=routers):
+                batches, writes = sqlite.writes.batches, sqlite.writes.writes
+
+                start = time.time()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.time() - start
+
+                sqlite.writes.stop()
+                batches, writes = sqlite.writes.batches - batches, sqlite.writes.writes - writes
+        finally:
+            sqlite.writes.stop()
+
+            for alias, database in saved.items():
+                if database is None:
+                    del connections.databases[alias]
+                else:
+                    connections.databases[alias] = database
+
+        return counts['moves'], counts['locked'], elapsed, writes / float(batches) if batches else 0
+
+    def report(self, mode, moves, locked, elapsed, batch):
+        self.stdout.write("%-8s %10.0f %8d %8d %10s" % (
+            mode, moves / elapsed if elapsed else 0, moves, locked, "%.1f" % batch if batch else "-"))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from cards import cardset
+
+
+def actions_to_cardsets(apps, schema_editor):
+    Action = apps.get_model('game', 'Action')
+
+    for action in Action.objects.all():
+        action.cards_set = cardset.from_cards((card.rank, card.suit) for card in action.cards.all())
+        action.save()
+
+
+def cardsets_to_actions(apps, schema_editor):
+    Action = apps.get_model('game', 'Action')
+    Card = apps.get_model('cards', 'Card')
+
+    for action in Action.objects.all():
+        action.cards.set([Card.objects.get_or_create(rank=rank, suit=suit)[0]
+                          for rank, suit in cardset.cards(action.cards_set)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0012_hand_cardset'),
+        ('game', '0029_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='cards_set',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(actions_to_cardsets, cardsets_to_actions),
+        migrations.RemoveField(
+            model_name='action',
+            name='cards',
+        ),
+        migrations.RenameField(
+            model_name='action',
+            old_name='cards_set',
+            new_name='cards',
+        ),
+    ]
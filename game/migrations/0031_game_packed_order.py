@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from game import rules
+
+
+def pack_orders(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+
+    for game in Game.objects.all():
+        positions = [int(position) for position in game.order.split(',')] if game.order else []
+        game.packed_order = rules.pack_order(positions)
+        game.active_position = positions[game.turn] if game.turn < len(positions) else None
+        game.save()
+
+
+def unpack_orders(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+
+    for game in Game.objects.all():
+        game.order = ','.join(map(str, rules.unpack_order(game.packed_order)))
+        game.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0030_action_cardset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='packed_order',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='active_position',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_orders, unpack_orders),
+        migrations.RemoveField(
+            model_name='game',
+            name='order',
+        ),
+        migrations.RenameField(
+            model_name='game',
+            old_name='packed_order',
+            new_name='order',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_players(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+
+    for game in Game.objects.annotate(players=models.Count('player')):
+        game.player_count = game.players
+        game.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0031_game_packed_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='player_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_players, migrations.RunPython.noop),
+    ]
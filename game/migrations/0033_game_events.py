@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0032_game_player_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField()),
+                ('kind', models.CharField(choices=[('S', 'Start'), ('L', 'Select'), ('F', 'Face'), ('R', 'Ready'), ('P', 'Play'), ('E', 'Round end')], max_length=1)),
+                ('position', models.IntegerField(blank=True, null=True)),
+                ('cards', models.BigIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.Game')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GameSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField()),
+                ('state', models.TextField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.Game')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='gameevent',
+            index_together=set([('game', 'version')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='gamesnapshot',
+            index_together=set([('game', 'version')]),
+        ),
+    ]
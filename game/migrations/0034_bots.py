@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0033_game_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='has_bots',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='bot',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
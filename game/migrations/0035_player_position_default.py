@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Player.position has defaulted to 0 in the model since before the game was versioned,
+    the migrations never caught up
+    """
+
+    dependencies = [
+        ('game', '0034_bots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_bots(apps, schema_editor):
+    """
+    Marks the users bots were playing as, accounts with a password that were taken over are left alone
+    """
+    User = apps.get_model('auth', 'User')
+    Player = apps.get_model('game', 'Player')
+    Bot = apps.get_model('game', 'Bot')
+    name = re.compile(r'^(?P<strategy>.+)-bot-(?P<seat>\d+)$')
+
+    users = User.objects.filter(pk__in=Player.objects.exclude(bot="").values('user_id'), password__startswith='!')
+
+    for user in users:
+        match = name.match(user.username)
+
+        if match and not Bot.objects.filter(strategy=match.group('strategy'), seat=int(match.group('seat'))).exists():
+            Bot.objects.create(user=user, strategy=match.group('strategy'), seat=int(match.group('seat')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('game', '0035_player_position_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strategy', models.CharField(max_length=20)),
+                ('seat', models.IntegerField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='bot',
+            unique_together=set([('strategy', 'seat')]),
+        ),
+        migrations.RunPython(mark_bots, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,18 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.template.loader import render_to_string
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 import random
 
-from cards.models import Deck, Hand, Card
+from cards.models import Deck, Hand
+from cards.registry import registry, BACK
+from cards import cardset
+from pofu.sqlite import queued
+from .notifier import notifier
+from .concurrency import GameConflict, retry_on_conflict
+from .snippets import snippets
+from . import bots, polling, rules, state, strategies
 
 
 class GamesManager(models.Manager):
@@ -16,24 +23,55 @@ class GamesManager(models.Manager):
         return super(GamesManager, self).get_queryset().filter(models.Q(player__user_id=user.id))
 
     @staticmethod
-    def create_game(setup):
+    def create_game(setup, bot=None):
         """
         Creates a Game based on a Setup
 
         Parameters:
-            setup - Complete Setup Instance
+            setup - Setup Instance, complete unless bots are filling the empty seats
+            bot - Name of the strategies.STRATEGIES strategy of the bots to fill empty seats with
         """
-        game = Game(host=setup.host)
-        game.save()
+        invites = list(setup.invitation_set.all())
+        seats = [(invite.user, "") for invite in invites]
+
+        if bot is not None:
+            seats += [(GamesManager.bot_user(bot, i + 1), bot) for i in range(setup.num_players - len(invites))]
 
-        invites = setup.invitation_set.all()
+        game = Game(host=setup.host, player_count=len(seats), has_bots=bot is not None)
+        game.save()
 
-        for invite in invites:
-            player = Player(game=game, user=invite.user)
+        for user, strategy in seats:
+            player = Player(game=game, user=user, bot=strategy)
             player.save()
 
         setup.delete()
 
+    @staticmethod
+    def bot_user(strategy, seat):
+        """
+        User a bot plays as, shared by every game with a bot of that strategy in that seat
+
+        Bot users are only ever found through Bot so an account that happens to have the
+        name is never taken over, the bot gets a numbered name instead
+        """
+        bot = Bot.objects.select_related('user').filter(strategy=strategy, seat=seat).first()
+        if bot is not None:
+            return bot.user
+
+        name = username = bots.USERNAME % (strategy, seat)
+        taken = 1
+
+        while User.objects.filter(username=username).exists():
+            taken += 1
+            username = "%s-%d" % (name, taken)
+
+        user = User(username=username)
+        user.set_unusable_password()
+        user.save()
+
+        Bot.objects.create(user=user, strategy=strategy, seat=seat)
+        return user
+
 
 GAME_STATUS = (
     ('A', 'Active'),
@@ -50,9 +88,13 @@ class Game(models.Model):
         status - A: Active, F: Finished, C: Cancelled
         host - User hosting the game (grants privileges to this user)
 
-        order - List of player positions in order of turn, e.g. [2, 3, 0, 1]
-        turn - Holds the index of the current turn in the order. Current turn is player with position order[turn]
+        order - Player positions in order of turn packed by rules.pack_order, read through positions
+        turn - Holds the index of the current turn in the order. Current turn is player with position positions[turn]
+        active_position - Position of the player whose turn it is, None between rounds
+        player_count - Number of players, set when the game is created as players never change
         card_face - Face the lead card was played. 0: down, 1: up, 2: unset
+        has_bots - Whether any seat is played by a bot, so games without them never look for one
+        version - Incremented on every change to the game state so pollers can skip unchanged games
 
     Related Fields:
         player - Foreign Key from player to game
@@ -60,84 +102,198 @@ class Game(models.Model):
     status = models.CharField(max_length=1, default='A', choices=GAME_STATUS)
     host = models.ForeignKey(User)
 
-    order = models.CharField(max_length=40, blank=True)
+    order = models.BigIntegerField(default=0)
     turn = models.IntegerField(default=0)
+    active_position = models.IntegerField(null=True, blank=True)
+    player_count = models.IntegerField(default=0)
     card_face = models.IntegerField(default=2)
+    has_bots = models.BooleanField(default=False)
+    version = models.IntegerField(default=0)
 
     objects = GamesManager()
 
     def __str__(self):
         return "Game " + str(self.id)
 
-    def is_round_end(self):
-        return self.turn >= self.player_set.count()
+    def save(self, **kwargs):
+        # version is only advanced through touch() so a stale instance can never roll it back
+        if self.pk is not None and 'update_fields' not in kwargs and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'version']
+
+        super(Game, self).save(**kwargs)
 
-    def join_order(self, order, split=None):
+    @queued
+    def touch(self):
         """
-        Helper function for converting between lists and strings in order to store in DB
-        :param order: List of values
-        :param split: Index of start point (wraps around)
-        :return: string of list joined by ','
+        Marks the game state as changed by incrementing its version in the DB
+        and wakes any streams waiting on the game once the change is committed
         """
-        order0 = list(range(len(order)))
+        Game.objects.filter(pk=self.pk).update(version=models.F('version') + 1)
+        self.version += 1
 
-        if split is None:
-            self.order = ','.join(map(str, order0))
+        pk = self.pk
+        transaction.on_commit(lambda: notifier.notify(pk))
 
-        else:
-            order1 = order0[split:] + order0[:split]
-            self.order = ','.join(map(str, list(order1)))
+    def compare_and_swap(self, **fields):
+        """
+        Optimistic write which only applies if the game is still at the version this
+        instance read, advancing the version so any other writer working from the same
+        version fails instead of overwriting this change
 
-        self.save()
+        Parameters:
+            fields - Field values to write along with the new version
 
-    def poll(self, user):
+        Returns:
+            True if written, False if the game had already changed
+        """
+        updated = Game.objects.filter(pk=self.pk, version=self.version).update(
+            version=models.F('version') + 1, **fields)
+
+        if not updated:
+            return False
+
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+        self.version += 1
+
+        pk = self.pk
+        transaction.on_commit(lambda: notifier.notify(pk))
+        return True
+
+    @property
+    def positions(self):
+        """
+        Tuple of player positions in order of turn, e.g. (2, 3, 0, 1)
+        """
+        return rules.unpack_order(self.order)
+
+    @queued
+    def record(self, kind, position=None, cards=0, value=0):
+        """
+        Appends a move to the game's event log at the current version
+
+        The version is read by the INSERT itself as this instance may be behind when
+        other players' moves have touched the game since it was loaded
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {event} (game_id, version, kind, position, cards, value) "
+                           "SELECT id, version, %s, %s, %s, %s FROM {game} WHERE id = %s".format(
+                               event=GameEvent._meta.db_table, game=Game._meta.db_table),
+                           [kind, position, cards, int(value), self.pk])
+
+    def set_order(self, num_players, lead=0):
+        self.order = rules.pack_order(rules.turn_order(num_players, lead))
+
+    def is_round_end(self):
+        return self.turn >= self.player_count
+
+    def poll(self, user, version=None):
         """
         JS polls server every few seconds to check for updates to the game status
-        Could add step to game and only return html if step > what is passed through
-        Returned HTML currently only a few KB though
+        If the client has already seen the current version nothing is rendered,
+        otherwise snippets are shared through the snippet cache
 
         Parameters:
             user - User instance
+            version - Last version the client received (optional)
 
         Returns:
-            Dictionary containing html of all players
+            Dictionary containing the version, html of all players and milliseconds until the next poll,
+            or only the version if unchanged
         """
-        all_players = self.player_set.all()
+        if version is not None and str(version) == str(self.version):
+            return {'version': self.version}
 
-        player = all_players.get(user=user)
-        player_html = render_to_string('game/player_snippet.html', {'player': player})
+        all_players = list(self.player_set.select_related('user', 'hand', 'action'))
 
-        other_players = all_players.exclude(user=user)
-        other_html = [(p.user.username, render_to_string('game/other_player_snippet.html', {'player': p})) for p in
-                      other_players]
+        player = next((p for p in all_players if p.user_id == user.pk), None)
+        if player is None:
+            raise Player.DoesNotExist
+        player_html = snippets.render(self.pk, self.version, player, 'self')
 
-        return {'self': player_html,
-                'players': other_html}
+        other_html = [(p.user.username, snippets.render(self.pk, self.version, p, 'other')) for p in all_players
+                      if p is not player]
 
-    def start(self):
+        return {'version': self.version,
+                'self': player_html,
+                'players': other_html,
+                'interval': self.poll_interval(player)}
+
+    def poll_interval(self, player):
         """
-        Starts a new game
+        Milliseconds the player should wait before polling again, see game.polling
         """
-        all_players = self.player_set.all()
+        return polling.poll_interval(self.status, self.is_round_end(), self.positions, self.turn, player.position)
 
-        # Shuffle positions
-        positions = list(range(len(all_players)))
-        random.shuffle(positions)
+    def state(self, user, version=None):
+        """
+        Compact version of poll for clients that render the game themselves, see game.state
+
+        Parameters:
+            user - User instance
+            version - Last version the client received (optional)
+
+        Returns:
+            Dictionary of the game as the user sees it, or only the version if unchanged
+        """
+        if version is not None and str(version) == str(self.version):
+            return {'version': self.version}
 
-        for i, player in enumerate(all_players):
-            turn = positions[i] == 0
-            player.reset(position=positions[i], turn=turn)
+        all_players = list(self.player_set.select_related('user', 'hand', 'action'))
 
-        # Deal out cards
-        Deck().deal(all_players)
+        player = next((p for p in all_players if p.user_id == user.pk), None)
+        if player is None:
+            raise Player.DoesNotExist
 
-        # Store turn order used [0, 1, 2, 3, 4, 5]
-        self.join_order(all_players)
+        return state.game_view(self, player, all_players)
 
-        self.turn = 0
-        self.save()
+    @queued
+    def start(self, seed=None):
+        """
+        Starts a new game
+        Players are reset, dealt and ordered with a fixed number of queries however many are playing
+
+        Parameters:
+            seed - Seed for shuffling positions and the deck so a game can be reproduced
+        """
+        all_players = list(self.player_set.order_by('pk'))
 
-        self.start_round()
+        # Replaying the game from its events needs the seed to deal the same cards
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+
+        # Shuffle positions
+        positions = list(range(len(all_players)))
+        random.Random(seed).shuffle(positions)
+
+        with transaction.atomic():
+            self.player_set.update(
+                points=0,
+                error="",
+                ready=True,
+                position=models.Case(*[models.When(pk=player.pk, then=models.Value(position))
+                                       for player, position in zip(all_players, positions)],
+                                     output_field=models.IntegerField()),
+                turn=models.Case(*[models.When(pk=player.pk, then=models.Value(position == 0))
+                                   for player, position in zip(all_players, positions)],
+                                 output_field=models.BooleanField()))
+
+            # Deal out cards and clear the last round
+            Deck().deal(all_players, seed)
+            Action.objects.filter(player__game=self).update(cards=0)
+
+            # Store turn order used (0, 1, 2, 3, 4, 5), every player is ready so the round starts straight away
+            self.set_order(len(all_players))
+            self.card_face = 2
+            self.turn = 0
+            self.active_position = self.positions[0]
+            self.save()
+
+        self.touch()
+        self.record(GameEvent.START, value=seed)
+        self.play_bots()
 
     def start_round(self):
         """
@@ -150,33 +306,67 @@ class Game(models.Model):
         # Reset turns
         self.card_face = 2
         self.turn = 0
+        self.active_position = self.positions[0]
         self.save()
 
-    def next_turn(self):
+    def next_turn(self, action):
         """
         Decides whether to end the round or to update the currently active player
+
+        The turn is moved on with a compare-and-swap so this must run in a transaction,
+        GameConflict is raised if the game changed since it was read
+
+        Parameters:
+            action - Action just played
         """
-        self.turn += 1
-        self.save()
+        turn = self.turn + 1
+        positions = self.positions
+        fields = {'turn': turn,
+                  'active_position': positions[turn] if turn < len(positions) else None}
+
+        # Face of the lead's cards sets the face other players in the round must follow
+        if self.card_face == 2:
+            fields['card_face'] = int(action.face_up)
+
+        if not self.compare_and_swap(**fields):
+            raise GameConflict
+
+        self.record(GameEvent.PLAY, positions[turn - 1], action.cards, action.face_up)
 
         if self.is_round_end():
             self.end_round()
             return
 
-        # Set face-up based on first player so other players in the round must follow play
-        if self.card_face == 2:
-            self.card_face = int(self.player_set.get(position=0).action.face_up)
-            self.save()
-
         # Set next players turn to be active
-        self.player_set.get(position=self.order.split(',')[self.turn]).set_turn(True)
+        self.player_set.filter(position=self.active_position).update(turn=True)
+        self.play_bots()
 
-    def score_bonus(self, player):
-        # Bonus of 2 points if first player plays face up
-        if player.position == self.order.split(',')[0] and self.card_face == 1:
-            return 2
+    def play_bots(self):
+        """
+        Has the bot whose turn it is play once the current move commits, see bots.BotTurns
+        """
+        if not self.has_bots or self.active_position is None:
+            return
+
+        bots.turns.schedule(self.pk)
+
+    def play_bot_turn(self):
+        """
+        Plays the turn of the bot whose turn it is, whose next_turn schedules the next bot
+        so bots keep playing until it is a person's turn or the round is over
+        """
+        if not self.has_bots or self.active_position is None:
+            return
+
+        bot = self.player_set.select_related('hand', 'user').exclude(bot="").filter(
+            position=self.active_position, turn=True).first()
 
-        return 0
+        if bot is not None:
+            bot.game = self
+            bot.play_bot()
+
+    def score_bonus(self, player):
+        return rules.score_bonus(player.position == self.positions[0], self.card_face)
 
     def find_round_winner(self, players):
         """
@@ -209,9 +399,17 @@ class Game(models.Model):
         round_winner.won_round(points)
 
         # Alter order so round winner goes first
-        self.join_order(all_players, round_winner.position)
+        self.set_order(len(all_players), round_winner.position)
         self.card_face = 2
         self.save()
+        self.touch()
+        self.record(GameEvent.ROUND_END, round_winner.position, value=points)
+
+        # Bots are ready straight away, the last one to be ready starts the round if everyone else is
+        if self.has_bots:
+            for bot in self.player_set.exclude(bot=""):
+                bot.game = self
+                bot.set_ready()
 
 
 class Player(models.Model):
@@ -224,6 +422,7 @@ class Player(models.Model):
     error = models.CharField(max_length=100, default="")
     face_up = models.BooleanField(default=False)
     ready = models.BooleanField(default=False)
+    bot = models.CharField(max_length=20, blank=True, default="")
 
     def save(self, **kwargs):
         super(Player, self).save(**kwargs)
@@ -246,10 +445,14 @@ class Player(models.Model):
     def __str__(self):
         return str(self.game) + " - " + self.user.username
 
+    @queued
     def set_ready(self):
         self.ready = True
         self.save()
         self.game.start_round()
+        self.game.touch()
+        self.game.record(GameEvent.READY, self.position)
+        self.game.play_bots()
 
     def set_turn(self, turn):
         self.turn = turn
@@ -269,109 +472,341 @@ class Player(models.Model):
         self.save()
 
     def cards_left(self):
-        return self.hand.cards.count() + self.hand.selected.count()
+        return cardset.count(self.hand.cards | self.hand.selected)
+
+    def held(self):
+        """
+        cardset masks of the cards in hand and the cards selected
+        """
+        return self.hand.cards, self.hand.selected
 
     def cards_in_hand(self):
-        return [card.short() for card in self.hand.cards.all()]
+        return registry.shorts(self.hand.cards)
 
     def selected_cards(self):
-        return [card.short() for card in self.hand.selected.all()]
+        return registry.shorts(self.hand.selected)
 
     def last_action(self):
-        return [card.short() for card in self.action.cards.all()]
+        if self.action is None:
+            return []
+
+        return registry.shorts(self.action.cards)
 
     def has_error(self):
         return len(self.error) > 0
 
     def played_cards(self):
+        if self.action is None:
+            return []
+
         if self.action.face_up:
-            return [card.short() for card in self.action.cards.all()]
+            return registry.shorts(self.action.cards)
         else:
-            return [card.back() for card in self.action.cards.all()]
+            return [BACK] * cardset.count(self.action.cards)
 
     def snippet_html(self):
+        # Not cached, this follows a change by the player so it would always be a new version
         player_html = render_to_string('game/player_snippet.html', {'player': self})
         return {'self': player_html}
 
+    def state(self):
+        return state.player_view(self)
+
+    @queued
     def select_face(self, face):
         self.face_up = face == "up"
         self.save()
+        self.game.touch()
+        self.game.record(GameEvent.FACE, self.position, value=self.face_up)
 
+    @queued
     def select(self, card_string):
         card_details = card_string.split()
         card = {'rank': card_details[0], 'suit': card_details[1]}
 
         self.hand.select(card)
+        self.game.touch()
+        self.record_selection()
 
+    @queued
     def deselect(self, card_string):
         card_details = card_string.split()
         card = {'rank': card_details[0], 'suit': card_details[1]}
 
         self.hand.deselect(card)
+        self.game.touch()
+        self.record_selection()
+
+    @queued
+    def set_selection(self, card_strings):
+        """
+        Replaces the whole selection in one go, e.g. to select a pair with one request
+
+        Parameters:
+            card_strings - Every card that should be selected as "rank suit" strings
+        """
+        try:
+            selected = cardset.parse(card_strings)
+        except ValueError:
+            self.error = "Unknown card"
+            return
+
+        with transaction.atomic():
+            if not self.hand.set_selection(selected):
+                self.error = "Can only select cards in your hand"
+                return
+
+            self.game.touch()
+            self.record_selection()
+
+    def record_selection(self):
+        self.game.record(GameEvent.SELECT, self.position, self.hand.selected)
 
     def submit_action(self, face):
-        if not self.turn:
+        self.play_cards(None, face)
+
+    def play(self, card_strings, face):
+        """
+        Plays a whole turn at once, choosing the cards and face without selecting them first
+
+        Parameters:
+            card_strings - Cards to play as "rank suit" strings
+            face - "up" or "down", None to follow the round
+        """
+        try:
+            cards = cardset.parse(card_strings)
+        except ValueError:
+            self.error = "Unknown card"
             return
 
-        face_up = face == "up" if face is not None else bool(self.game.card_face)
+        self.play_cards(cards, face)
 
-        action = Action(face_up=face_up)
-        action.save()
-        action.cards.add(*self.hand.selected.all())
-        action.save()
+    def play_cards(self, cards, face):
+        """
+        Validates the play before writing anything, then records the Action, takes the cards
+        out of the hand and moves the game on in one transaction
 
-        self.error = action.validate()
+        next_turn moves the turn on with a compare-and-swap on the game version so two
+        plays read from the same state can't both go through, the loser is rolled back
+        and retried on fresh state
 
-        if not self.has_error():
-            self.action = action
-            self.hand.selected.clear()
-            self.turn = False   # Used to ensure DB commit is done in time before redisplay
-            self.save()
+        Parameters:
+            cards - cardset mask of the cards to play from the hand or the selection, None for the selection
+            face - "up" or "down", None to follow the round
+        """
+        def move():
+            # The round winner holds the turn between rounds but can't play until the next deal
+            if not self.turn or self.game.is_round_end():
+                return
 
-            self.game.next_turn()
+            played = self.hand.selected if cards is None else cards
+            held = self.hand.cards | self.hand.selected
 
-    def hand_score(self):
-        rank = self.action.cards.all()[0].rank
-        if rank == 'A':
-            rank = 1
-        elif rank == 'J':
-            rank = 11
-        elif rank == 'Q':
-            rank = 12
-        elif rank == 'K':
-            rank = 13
-
-        return self.action.cards.count() * 13 - 13 + int(rank)
+            if played & ~held:
+                self.error = "Can only play cards in your hand"
+                return
 
-    def hand_points(self):
-        rank = self.action.cards.all()[0].rank
+            self.error = rules.validate(played)
+            if self.has_error():
+                return
 
-        if rank in ['J', 'Q', 'K']:
-            return self.action.cards.count() * 2
+            face_up = face == "up" if face is not None else bool(self.game.card_face)
 
-        else:
-            return self.action.cards.count()
+            with transaction.atomic():
+                self.action = Action.objects.create(face_up=face_up, cards=played)
+
+                # Selected cards that weren't played go back into the hand
+                self.hand.cards = held & ~played
+                self.hand.selected = 0
+                Hand.objects.filter(pk=self.hand.pk).update(cards=self.hand.cards, selected=0)
+
+                self.turn = False   # Used to ensure DB commit is done in time before redisplay
+                self.save()
+
+                self.game.next_turn(self.action)
+
+        if not retry_on_conflict(move, self.reload):
+            self.error = "The game changed, please try again"
+
+    def table(self):
+        """
+        strategies.Table of what this player can see of the round
+        """
+        positions = self.game.positions
+        turn = self.game.turn
+        players = dict((player.position, player) for player in self.game.player_set.select_related('hand', 'action'))
+
+        played = []
+        seen = self.hand.cards | self.hand.selected
+
+        for position in positions[:turn]:
+            action = players[position].action
+            played.append((action.cards if action.face_up else 0, cardset.count(action.cards)))
+            seen |= action.cards if action.face_up else 0
+
+        # Every play before this round was turned face up when its round ended
+        plays = list(self.game.gameevent_set.filter(kind__in=[GameEvent.START, GameEvent.PLAY]).order_by('pk')
+                     .values_list('kind', 'cards'))
+        start = max([i for i, (kind, cards) in enumerate(plays) if kind == GameEvent.START] or [-1])
+
+        for kind, cards in plays[start + 1:len(plays) - turn]:
+            seen |= cards
+
+        return strategies.Table(hand=self.hand.cards | self.hand.selected,
+                                played=played,
+                                waiting=[players[position].cards_left() for position in positions[turn + 1:]],
+                                unknown=cardset.FULL & ~seen,
+                                card_face=self.game.card_face)
+
+    def play_bot(self):
+        """
+        Plays this bot's turn with the move its strategy picks
+        """
+        move = bots.choose(self.bot, self.table())
+
+        if move is not None:
+            self.play_cards(move.cards, "up" if move.face_up else "down")
+
+    def reload(self):
+        """
+        Refreshes the player, their hand and their game from the DB
+        """
+        self.refresh_from_db()
+        self.hand.refresh_from_db()
+        self.game.refresh_from_db()
+
+    def hand_score(self):
+        return rules.hand_score(cardset.count(self.action.cards), rules.cards_value(self.action.cards))
+
+    def hand_points(self):
+        return rules.hand_points(cardset.count(self.action.cards), rules.cards_value(self.action.cards))
 
 
 class Action(models.Model):
+    """
+    Cards played by a player in a round
+
+    Fields:
+        face_up - Whether the cards were played face up
+        cards - cardset mask of the cards played
+    """
     face_up = models.BooleanField(default=True)
-    cards = models.ManyToManyField(Card)
+    cards = models.BigIntegerField(default=0)
 
     def validate(self):
-        if self.cards.count() <= 0:
-            return "Need to selected at least 1 card to play"
+        return rules.validate(self.cards)
+
+
+class GameEvent(models.Model):
+    """
+    One move in a game's append-only history, game/events.py rebuilds a game from them
+
+    Fields:
+        version - Game version once the move was made
+        kind - S: Start, L: Select, F: Face, R: Ready, P: Play, E: Round end
+        position - Position of the player making the move, None for moves by the game
+        cards - cardset mask of the whole selection (L) or of the cards played (P)
+        value - Seed of the deal (S), whether face up (F, P) or points won by the player at position (E)
+    """
+    START = 'S'
+    SELECT = 'L'
+    FACE = 'F'
+    READY = 'R'
+    PLAY = 'P'
+    ROUND_END = 'E'
+
+    KINDS = (
+        (START, 'Start'),
+        (SELECT, 'Select'),
+        (FACE, 'Face'),
+        (READY, 'Ready'),
+        (PLAY, 'Play'),
+        (ROUND_END, 'Round end'),
+    )
 
-        ranks = [c.rank for c in self.cards.all()]
-        if len(set(ranks)) != 1:
-            return "All cards must be of the same rank"
+    game = models.ForeignKey('game.Game')
+    version = models.IntegerField()
+    kind = models.CharField(max_length=1, choices=KINDS)
+    position = models.IntegerField(null=True, blank=True)
+    cards = models.BigIntegerField(default=0)
+    value = models.BigIntegerField(default=0)
 
-        return ""
+    class Meta:
+        index_together = [('game', 'version')]
+
+    def __str__(self):
+        return "%s v%d %s" % (self.game, self.version, self.get_kind_display())
+
+
+class GameSnapshot(models.Model):
+    """
+    State of a game at a version, stored as JSON so replays only need the events after it
+    """
+    game = models.ForeignKey('game.Game')
+    version = models.IntegerField()
+    state = models.TextField()
+
+    class Meta:
+        index_together = [('game', 'version')]
+
+    def __str__(self):
+        return "%s v%d snapshot" % (self.game, self.version)
+
+
+class Bot(models.Model):
+    """
+    Marks a user as a bot's, see GamesManager.bot_user
+
+    Fields:
+        strategy - Name of the strategies.STRATEGIES strategy the bot plays
+        seat - Seat of the bots filling a setup it takes, so games can have several bots of a strategy
+    """
+    user = models.OneToOneField(User)
+    strategy = models.CharField(max_length=20)
+    seat = models.IntegerField()
+
+    class Meta:
+        unique_together = [('strategy', 'seat')]
+
+    def __str__(self):
+        return self.user.username
 
 
 class SetupManager(models.Manager):
+    def with_counts(self):
+        """
+        Setups with their host and number of players joined loaded in the same query
+        """
+        return super(SetupManager, self).get_queryset().select_related('host').annotate(
+            num_joined=models.Count('invitation'))
+
     def setups_for_user(self, user):
-        return super(SetupManager, self).get_queryset().filter(
-            models.Q(invitation__user_id=user.id))
+        # Subquery rather than a join so the annotated count isn't limited to the user's invitation
+        return self.with_counts().filter(pk__in=Invitation.objects.filter(user_id=user.id).values('setup_id'))
+
+    def lobby(self, user, before=None, limit=20):
+        """
+        Page of setups the user could join, newest first
+
+        Parameters:
+            user - User looking for a game, their own setups are left out
+            before - Setup pk to continue after, the cursor returned for the previous page
+            limit - Setups per page
+
+        Returns:
+            (setups, cursor) where cursor is None on the last page
+        """
+        setups = self.with_counts().exclude(host=user).order_by('-pk')
+
+        if before is not None:
+            setups = setups.filter(pk__lt=before)
+
+        setups = list(setups[:limit + 1])
+
+        if len(setups) > limit:
+            return setups[:limit], setups[limit - 1].pk
+
+        return setups, None
 
 
 class Setup(models.Model):
@@ -386,13 +821,17 @@ class Setup(models.Model):
     objects = SetupManager()
 
     def joined(self):
+        # Setups from SetupManager.with_counts already know how many have joined
+        if hasattr(self, 'num_joined'):
+            return self.num_joined
+
         return self.invitation_set.count()
 
     def complete(self):
         return self.joined() == self.num_players
 
-    def create_game(self):
-        GamesManager.create_game(setup=self)
+    def create_game(self, bot=None):
+        GamesManager.create_game(setup=self, bot=bot)
 
     def __str__(self):
         return "Setup " + str(self.id)
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+
+class GameNotifier(object):
+    """
+    GameNotifier lets threads in this process wait for changes to a game
+
+    Each game has a sequence number which is bumped by notify(). Waiters read the
+    sequence before checking the DB and then wait for it to move on, so a change
+    that lands between the check and the wait is never missed.
+
+    Only covers the current process; waiters should still re-check the DB after
+    timing out so changes made by other processes are picked up.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sequences = {}
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """
+        Calls listener(game_id) after every notify, from the thread that notified
+        """
+        with self._condition:
+            self._listeners.append(listener)
+
+    def sequence(self, game_id):
+        with self._condition:
+            return self._sequences.get(game_id, 0)
+
+    def unsubscribe(self, listener):
+        with self._condition:
+            self._listeners.remove(listener)
+
+    def notify(self, game_id):
+        with self._condition:
+            self._sequences[game_id] = self._sequences.get(game_id, 0) + 1
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            listener(game_id)
+
+    def wait(self, game_id, sequence, timeout=None):
+        """
+        Blocks until the game's sequence differs from the one passed in
+
+        Parameters:
+            game_id - Primary key of the game
+            sequence - Sequence number previously returned by sequence()
+            timeout - Maximum seconds to wait
+
+        Returns:
+            True if the game changed, False if the wait timed out
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._sequences.get(game_id, 0) != sequence, timeout)
+
+
+class AsyncGameNotifier(object):
+    """
+    Lets coroutines on an asyncio loop wait for changes to a game without holding a thread
+
+    Follows the sequences of a GameNotifier, so anything that notifies that from
+    any thread wakes the coroutines waiting here.
+    """
+    def __init__(self, notifier, loop):
+        self._notifier = notifier
+        self._loop = loop
+        self._waiters = {}
+        notifier.subscribe(self._notified)
+
+    def _notified(self, game_id):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake, game_id)
+
+    def close(self):
+        self._notifier.unsubscribe(self._notified)
+
+    def _wake(self, game_id):
+        for waiter in self._waiters.pop(game_id, ()):
+            if not waiter.done():
+                waiter.set_result(True)
+
+    def sequence(self, game_id):
+        return self._notifier.sequence(game_id)
+
+    async def wait(self, game_id, sequence, timeout=None):
+        """
+        Same as GameNotifier.wait but yields to the loop while waiting, must be called on the loop
+        """
+        if self._notifier.sequence(game_id) != sequence:
+            return True
+
+        # A notify after the check above is queued on the loop so it can't run before this is registered
+        waiter = self._loop.create_future()
+        self._waiters.setdefault(game_id, set()).add(waiter)
+
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(game_id)
+
+            if waiters is not None:
+                waiters.discard(waiter)
+
+                if not waiters:
+                    del self._waiters[game_id]
+
+
+notifier = GameNotifier()
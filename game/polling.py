@@ -0,0 +1,45 @@
+"""
+How long a client should wait before polling a game again
+
+Polls are only worth making often when a change is close: on the viewer's turn
+or the turn before it. Between rounds the game waits on every player clicking
+ready and finished or cancelled games never change, so clients are told to back
+off. Each case's delay in milliseconds comes from the GAME_POLL_INTERVALS setting.
+"""
+from django.conf import settings
+
+
+def poll_case(status, round_end, order, turn, position):
+    """
+    Which of the GAME_POLL_INTERVALS cases a viewer is in
+
+    Parameters:
+        status - Game status, A: Active, F: Finished, C: Cancelled
+        round_end - Whether the round is over and waiting on players being ready
+        order - Player positions in order of turn
+        turn - Index of the current turn in order
+        position - Viewer's position
+    """
+    if status != 'A':
+        return 'over'
+
+    if round_end:
+        return 'ready'
+
+    if position in order:
+        ahead = list(order).index(position) - turn
+
+        if ahead == 0:
+            return 'turn'
+
+        if ahead == 1:
+            return 'next'
+
+    return 'waiting'
+
+
+def poll_interval(status, round_end, order, turn, position):
+    """
+    Milliseconds the viewer should wait before polling again, see poll_case
+    """
+    return getattr(settings, 'GAME_POLL_INTERVALS')[poll_case(status, round_end, order, turn, position)]
@@ -0,0 +1,117 @@
+"""
+Rules of POFU as plain functions so they can be shared between the models,
+the in-memory engine and anything else that needs to play the game without the DB
+
+Scoring functions only use arithmetic and comparisons so they work the same
+on plain ints and on NumPy arrays (see game/simulator.py)
+"""
+from functools import lru_cache
+
+from cards import cardset
+from cards.cardset import RANK_VALUES
+
+FACE_BONUS = 2
+PICTURE_VALUE = 10
+
+
+def rank_value(rank):
+    return RANK_VALUES[rank]
+
+
+def hand_score(count, value):
+    """
+    Score used to decide the round winner, more cards always beats a higher rank
+
+    Parameters:
+        count - Number of cards played
+        value - Numeric value of the rank played (A: 1 ... K: 13)
+    """
+    return count * 13 - 13 + value
+
+
+def hand_points(count, value):
+    """
+    Points the played cards are worth to the round winner, J/Q/K are worth double
+    """
+    return count * (1 + (value > PICTURE_VALUE))
+
+
+def score_bonus(is_lead, card_face):
+    """
+    Bonus of 2 points if the lead player played face up
+    """
+    return FACE_BONUS * (is_lead & (card_face == 1))
+
+
+def cards_value(cards):
+    """
+    Numeric value of the rank of a non-empty cardset mask of same-rank cards
+    """
+    return rank_value(cardset.lowest_rank(cards))
+
+
+def validate(cards):
+    """
+    Checks the cards being played make a legal action
+
+    Parameters:
+        cards - cardset mask of the cards played
+
+    Returns:
+        Error message or "" if the action is valid
+    """
+    if cards == 0:
+        return "Need to selected at least 1 card to play"
+
+    if not cardset.same_rank(cards):
+        return "All cards must be of the same rank"
+
+    return ""
+
+
+def turn_order(num_players, lead=0):
+    """
+    Positions in order of play starting from the lead position (wraps around)
+    """
+    positions = list(range(num_players))
+    return positions[lead:] + positions[:lead]
+
+
+def pack_order(order):
+    """
+    Turn order as one integer, 4 bits per position with the first to play in the lowest bits
+    Positions are stored + 1 so the order ends at the first 0
+    """
+    packed = 0
+    for i, position in enumerate(order):
+        packed |= (position + 1) << (4 * i)
+
+    return packed
+
+
+@lru_cache(maxsize=None)
+def unpack_order(packed):
+    """
+    Tuple of positions stored by pack_order, cached as there are only a few rotations per game size
+    """
+    order = []
+    while packed:
+        order.append((packed & 0xF) - 1)
+        packed >>= 4
+
+    return tuple(order)
+
+
+def round_winner(scores):
+    """
+    Index of the winning score, a score has to beat the current best so ties go to the earlier entry
+    """
+    best_score = 0
+    best = None
+
+    for i, score in enumerate(scores):
+        if score > best_score:
+            best_score = score
+            best = i
+
+    return best
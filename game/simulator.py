@@ -0,0 +1,140 @@
+"""
+Headless simulator which plays batches of POFU games as NumPy arrays
+
+Uses the card layout from cards.cardset, the scoring rules from game.rules and the
+strategies from game.strategies, the same definitions the server and its bots use,
+and needs no Django setup.
+
+Suits never affect scoring so hands are held as counts per rank. The server has
+no end of game, it stalls once a player has no cards left to play, so a simulated
+game ends at the first round a player starts without cards.
+"""
+import numpy as np
+
+from cards import cardset
+from . import rules, strategies
+from .strategies import NUM_RANKS, NUM_SUITS, VALUES
+
+
+# Strategies that can play a seat of a batch of games, the bots play the same ones
+STRATEGIES = dict((name, strategy) for name, strategy in strategies.STRATEGIES.items() if strategy.batched)
+
+
+def deal(games, num_players, rng):
+    """
+    Deals a shuffled deck per game round robin, as cardset.deal does
+
+    Returns:
+        (games, players, ranks) array of the number of cards of each rank held
+    """
+    deck = np.argsort(rng.random((games, cardset.DECK_SIZE)), axis=1)
+    hands = np.zeros((games, num_players, NUM_RANKS), dtype=int)
+    rows = np.arange(games)[:, None]
+
+    for seat in range(num_players):
+        np.add.at(hands[:, seat], (rows, deck[:, seat::num_players] // NUM_SUITS), 1)
+
+    return hands
+
+
+class Simulator(object):
+    """
+    Plays batches of games between a fixed set of strategies, one per seat
+
+    Seats are in the same order the server iterates players in, so ties for a
+    round go to the earlier seat as they do in rules.round_winner
+    """
+    def __init__(self, strategies, seed=None):
+        self.strategies = [STRATEGIES[name]() if isinstance(name, str) else name for name in strategies]
+        self.rng = np.random.default_rng(seed)
+
+    def run(self, games, max_rounds=cardset.DECK_SIZE):
+        """
+        Plays a batch of games to the end
+
+        Returns:
+            Dictionary of (games, seats) arrays: points, rounds_won and the (games,) array rounds
+        """
+        n = len(self.strategies)
+        rng = self.rng
+        every = np.arange(games)
+
+        hands = deal(games, n, rng)
+        positions = np.argsort(rng.random((games, n)), axis=1)
+        seat_at = np.argsort(positions, axis=1)
+        orders = np.array([rules.turn_order(n, lead) for lead in range(n)])
+        lead = np.zeros(games, dtype=int)
+
+        points = np.zeros((games, n), dtype=int)
+        rounds_won = np.zeros((games, n), dtype=int)
+        rounds = np.zeros(games, dtype=int)
+        active = np.ones(games, dtype=bool)
+
+        for _ in range(max_rounds):
+            active &= (hands.sum(axis=2) > 0).all(axis=1)
+            if not active.any():
+                break
+
+            scores = np.full((games, n), -1)
+            played_points = np.zeros((games, n), dtype=int)
+            card_face = np.full(games, 2)
+            visible = np.full(games, -1)
+
+            for turn in range(n):
+                seats = seat_at[every, orders[lead, turn]]
+
+                for seat, strategy in enumerate(self.strategies):
+                    playing = np.nonzero(active & (seats == seat))[0]
+                    if not len(playing):
+                        continue
+
+                    ranks, counts, face_up = strategy.choose_batch(hands[playing, seat], visible[playing],
+                                                                   turn == 0, rng)
+                    hands[playing, seat, ranks] -= counts
+
+                    # Everyone after the lead plays the same face as the lead
+                    if turn == 0:
+                        card_face[playing] = face_up.astype(int)
+
+                    score = (rules.hand_score(counts, VALUES[ranks]) +
+                             rules.score_bonus(turn == 0, card_face[playing]))
+                    scores[playing, seat] = score
+                    played_points[playing, seat] = rules.hand_points(counts, VALUES[ranks])
+                    visible[playing] = np.where(card_face[playing] == 1, np.maximum(visible[playing], score), -1)
+
+            winners = scores.argmax(axis=1)
+            won = every[active]
+
+            points[won, winners[won]] += played_points[won].sum(axis=1)
+            rounds_won[won, winners[won]] += 1
+            lead[won] = positions[won, winners[won]]
+            rounds[won] += 1
+
+        return {'points': points,
+                'rounds_won': rounds_won,
+                'rounds': rounds}
+
+    def report(self, games, batch=10000):
+        """
+        Plays games in batches and summarises the results per seat
+
+        Returns:
+            List with a dictionary per seat of its strategy, share of rounds won,
+            share of games won (ties shared), mean points and points percentiles
+        """
+        results = [self.run(min(batch, games - start)) for start in range(0, games, batch)]
+
+        points = np.concatenate([result['points'] for result in results])
+        rounds_won = np.concatenate([result['rounds_won'] for result in results])
+        rounds = np.concatenate([result['rounds'] for result in results])
+
+        leaders = points == points.max(axis=1)[:, None]
+        game_wins = (leaders / leaders.sum(axis=1)[:, None]).sum(axis=0)
+
+        return [{'strategy': strategy.name,
+                 'round_win_rate': rounds_won[:, seat].sum() / max(rounds.sum(), 1),
+                 'game_win_rate': game_wins[seat] / len(points),
+                 'mean_points': points[:, seat].mean(),
+                 'points_percentiles': dict(zip((5, 25, 50, 75, 95),
+                                                np.percentile(points[:, seat], (5, 25, 50, 75, 95))))}
+                for seat, strategy in enumerate(self.strategies)]
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+
+TEMPLATES = {
+    'self': 'game/player_snippet.html',
+    'other': 'game/other_player_snippet.html',
+}
+
+
+class SnippetCache(object):
+    """
+    Bounded LRU cache of rendered player snippets
+
+    Snippets are keyed by (game, player, game version, role) so a snippet never
+    needs invalidating, a change to the game moves readers on to a new key and
+    the old entries age out. Role is 'self' for the player's own view or 'other'
+    for how they look to their opponents, which is shared by every opponent.
+
+    Holds at most GAME_SNIPPET_CACHE_SIZE entries.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snippets = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, game_id, version, player, role):
+        """
+        Returns the rendered snippet for the player, only rendering it on a miss
+
+        Parameters:
+            game_id - Primary key of the game
+            version - Version of the game read before the player was loaded
+            player - Player (or PlayerState) to render
+            role - 'self' or 'other'
+        """
+        key = (game_id, player.pk, version, role)
+
+        with self._lock:
+            if key in self._snippets:
+                self._snippets.move_to_end(key)
+                self.hits += 1
+                return self._snippets[key]
+
+            self.misses += 1
+
+        html = render_to_string(TEMPLATES[role], {'player': player})
+
+        with self._lock:
+            self._snippets[key] = html
+
+            while len(self._snippets) > getattr(settings, 'GAME_SNIPPET_CACHE_SIZE', 1000):
+                self._snippets.popitem(last=False)
+
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._snippets)}
+
+    def clear(self):
+        with self._lock:
+            self._snippets.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+snippets = SnippetCache()
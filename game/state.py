@@ -0,0 +1,70 @@
+"""
+Compact JSON view of a game for clients that render it themselves
+
+Cards are sent as their cardset index, display.html gives the page the rank, suit
+and CSS class of each index once. Face down plays are only sent as a count so
+nobody is sent cards they can't see. Works from Players or the engine's
+PlayerStates alike.
+"""
+from cards import cardset
+
+
+def own(player):
+    """
+    What the player sees of themselves
+    """
+    cards, selected = player.held()
+    action = player.action
+
+    return {'name': player.user.username,
+            'points': player.points,
+            'position': player.position,
+            'turn': player.turn,
+            'ready': player.ready,
+            'face_up': player.face_up,
+            'error': player.error,
+            'hand': cardset.indexes(cards),
+            'selected': cardset.indexes(selected),
+            'action': cardset.indexes(action.cards) if action is not None else [],
+            'action_face_up': action is not None and action.face_up}
+
+
+def other(player):
+    """
+    What everyone else sees of the player
+    """
+    action = player.action
+    face_up = action is not None and action.face_up
+
+    return {'name': player.user.username,
+            'points': player.points,
+            'turn': player.turn,
+            'cards_left': player.cards_left(),
+            'played': cardset.indexes(action.cards) if face_up else [],
+            'down': cardset.count(action.cards) if action is not None and not face_up else 0}
+
+
+def player_view(player):
+    """
+    The player's own view after one of their moves, what snippet_html is to polls
+    """
+    return {'card_face': player.game.card_face,
+            'round_end': player.game.is_round_end(),
+            'self': own(player)}
+
+
+def game_view(game, player, players):
+    """
+    The whole game as seen by player
+
+    Parameters:
+        game - Game or GameState
+        player - Player viewing the game
+        players - Every player in the game, including the viewer
+    """
+    view = player_view(player)
+    view.update({'version': game.version,
+                 'status': game.status,
+                 'players': [other(p) for p in players if p is not player],
+                 'interval': game.poll_interval(player)})
+    return view
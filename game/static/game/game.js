@@ -1,6 +1,19 @@
+var gameVersion = null;
+var gameEtag = null;
+
+// Milliseconds until the next poll, the server sends a new one in X-Poll-Interval whenever the game changes
+var pollInterval = 3000;
+
 $(document).ready(function(){
-    console.log("Starting Poll");
-    setTimeout(doPoll, 3000);
+    if(window.EventSource)
+    {
+        doStream();
+    }
+    else
+    {
+        console.log("Starting Poll");
+        setTimeout(doPoll, pollInterval);
+    }
 });
 
 $("#start-game").on('click', function(){
@@ -14,36 +27,47 @@ $("#start-game").on('click', function(){
     $.ajax({
         headers: {"X-CSRFToken": getCookie('csrftoken')},
         type: 'POST',
-        url: '/game/start/' + $("#game-id").html() + '/',
+        url: '/game/start/' + $("#game-id").html() + '/?format=state',
         data: {},
         success: function(resp) {
-             $("#player-self").html(resp['self']);
-
-            for(var i = 0; i < resp['players'].length; i++)
-            {
-                player = resp['players'][i];
-                $("#player-"+player[0]).html(player[1]);
-            }
+            showGame(resp);
 
             $("#start-game").attr('disabled', false);
         }
     });
 });
 
-$(document).on('click', '.card-in-hand', function(){
-    card = this.id.substring(2);
-
-    console.log("Card " + card + " clicked");
+function cardIds(selector){
+    return $(selector).map(function(){ return this.id.substring(2); }).get();
+}
 
+// Sends the whole selection in one request, shift-click picks every held card of that rank
+function setSelection(cards){
     $.ajax({
         headers: {"X-CSRFToken": getCookie('csrftoken')},
         type: 'POST',
-        url: '/game/update/' + $("#game-id").html() + '/select/',
-        data: {"card": card},
+        url: '/game/update/' + $("#game-id").html() + '/selection/?format=state',
+        data: {"cards": cards},
+        traditional: true,
         success: function(resp) {
-             $("#player-self").html(resp['self']);
+             showGame(resp);
         }
     });
+}
+
+$(document).on('click', '.card-in-hand', function(e){
+    card = this.id.substring(2);
+    picked = [card];
+
+    console.log("Card " + card + " clicked");
+
+    if(e.shiftKey)
+    {
+        rank = card.split(" ")[0];
+        picked = cardIds('.card-in-hand').filter(function(held){ return held.split(" ")[0] === rank; });
+    }
+
+    setSelection(cardIds('.selected-card').concat(picked));
 });
 
 $(document).on('click', '.selected-card', function(){
@@ -51,15 +75,7 @@ $(document).on('click', '.selected-card', function(){
 
     console.log("Card " + card + " clicked");
 
-    $.ajax({
-        headers: {"X-CSRFToken": getCookie('csrftoken')},
-        type: 'POST',
-        url: '/game/update/' + $("#game-id").html() + '/deselect/',
-        data: {"card": card},
-        success: function(resp) {
-             $("#player-self").html(resp['self']);
-        }
-    });
+    setSelection(cardIds('.selected-card').filter(function(selected){ return selected !== card; }));
 });
 
 $(document).on('change', 'input[name=card-face]', function () {
@@ -68,10 +84,10 @@ $(document).on('change', 'input[name=card-face]', function () {
      $.ajax({
         headers: {"X-CSRFToken": getCookie('csrftoken')},
         type: 'POST',
-        url: '/game/update/' + $("#game-id").html() + '/face/',
+        url: '/game/update/' + $("#game-id").html() + '/face/?format=state',
         data: {"face": face},
         success: function(resp) {
-             $("#player-self").html(resp['self']);
+             showGame(resp);
         }
     });
 });
@@ -81,13 +97,15 @@ $(document).on('click', '#submit-action', function(){
 
      face = $('input[name=card-face]:checked', '#card-face-form').val();
 
+     // Plays the selected cards as one move and gets the whole game back
      $.ajax({
         headers: {"X-CSRFToken": getCookie('csrftoken')},
         type: 'POST',
-        url: '/game/update/' + $("#game-id").html() + '/submit/',
-        data: {"face": face},
+        url: '/game/update/' + $("#game-id").html() + '/play/?format=state',
+        data: {"cards": cardIds('.selected-card'), "face": face},
+        traditional: true,
         success: function(resp) {
-             $("#player-self").html(resp['self']);
+             showGame(resp);
 
              $('#submit-action').attr('disabled', false);
         }
@@ -100,10 +118,10 @@ $(document).on('click', '#submit-ready', function(){
      $.ajax({
         headers: {"X-CSRFToken": getCookie('csrftoken')},
         type: 'POST',
-        url: '/game/update/' + $("#game-id").html() + '/ready/',
+        url: '/game/update/' + $("#game-id").html() + '/ready/?format=state',
         data: {},
         success: function(resp) {
-             $("#player-self").html(resp['self']);
+             showGame(resp);
              $('#submit-ready').attr('disabled', false);
         }
     });
@@ -111,27 +129,208 @@ $(document).on('click', '#submit-ready', function(){
 
 
 
+// Builds the same html as the snippet templates from the game state, cards are indexes into the
+// [rank, suit, css class] table the page was given
+function escapeHtml(text){
+    return $('<div>').text(text).html();
+}
+
+function cardFace(cssClass){
+    return '<span class="card-face ' + cssClass + '"></span>';
+}
+
+function playingCards(indexes, className, prefix){
+    var cards = $("#table").data('cards');
+    var html = '';
+
+    for(var i = 0; i < indexes.length; i++)
+    {
+        var card = cards[indexes[i]];
+        var face = cardFace(card[2]);
+
+        if(className)
+        {
+            var id = prefix ? ' id="' + prefix + ' ' + card[0] + ' ' + card[1] + '"' : '';
+            face = '<div class="' + className + '"' + id + '>' + face + '</div>';
+        }
+
+        html += '<div class="playing-card">' + face + '</div>';
+    }
+
+    return html;
+}
+
+function turnTick(){
+    return '<img src="' + $("#table").data('tick') + '" width="25px" height="25px">';
+}
+
+function renderSelf(resp){
+    var player = resp['self'];
+    var roundEnd = resp['round_end'];
+
+    var html = '<div class="col-md-6">' +
+        '<h5 class="panel-header">' + escapeHtml(player['name']) + '</h5>' +
+        'Points: ' + player['points'] + '<br>' +
+        'Cards Left: ' + (player['hand'].length + player['selected'].length) + ' <br>' +
+        'Position: ' + player['position'] +
+        '<div class="row"><div class="player-cards">' + playingCards(player['hand'], 'card-in-hand', 'h') +
+        '</div></div></div>';
+
+    html += '<div class="col-md-5 col-md-push-1"><div class="container" id="selected-cards"><div class="row">';
+
+    if(!roundEnd && player['turn'])
+    {
+        html += '<div class="text-center">' + turnTick() + '<b>Your Turn</b></div>';
+    }
+    else if(roundEnd && player['ready'])
+    {
+        html += 'Waiting for other players to be ready...';
+    }
+
+    html += '</div><div class="row"><div class="col-md-7">' +
+        '<div class="player-cards">' + playingCards(player['selected'], 'selected-card', 's') + '</div>';
+
+    if(resp['card_face'] === 2 && player['turn'] && !roundEnd)
+    {
+        var up = player['face_up'] ? ' checked="checked"' : '';
+        var down = player['face_up'] ? '' : ' checked="checked"';
+
+        html += '<div class="row"><div id="card-face"><form id="card-face-form">' +
+            '<input type="radio" name="card-face" value="up"' + up + '>Face Up<br>' +
+            '<input type="radio" name="card-face" value="down"' + down + '>Face Down<br>' +
+            '</form></div></div>';
+    }
+
+    if(player['error'])
+    {
+        html += '<div id="action-error"><p>' + escapeHtml(player['error']) + '</p></div>';
+    }
+
+    if(!player['ready'])
+    {
+        html += '<div class="row"><a class="btn btn-success" role="button" id="submit-ready">Ready</a></div>';
+    }
+
+    if(player['turn'] && !roundEnd)
+    {
+        html += '<div class="row"><a class="btn btn-success" role="button" id="submit-action">Submit Action</a></div>';
+    }
+
+    html += '</div>';
+
+    if(player['action'].length)
+    {
+        html += '<div class="col-md-5">';
+
+        if(!roundEnd)
+        {
+            html += '<h5 class="panel-header">Last submitted action:</h5>' +
+                (player['action_face_up'] ? 'Played Face Up' : 'Played Face Down');
+        }
+
+        html += '<div class="player-cards">' + playingCards(player['action']) + '</div></div>';
+    }
+
+    $("#player-self").html(html + '</div></div></div>');
+}
+
+function renderOther(player){
+    var back = '<div class="playing-card"><div class="selected-card">' + cardFace($("#table").data('back')) +
+        '</div></div>';
+
+    var html = '<div class="well col-sm-4">' +
+        '<h5 class="panel-header">' + escapeHtml(player['name']) + '</h5>' +
+        (player['turn'] ? '<div class="text-right">' + turnTick() + '</div>' : '') +
+        'Points: ' + player['points'] + '<br>' +
+        'Cards Left: ' + player['cards_left'] +
+        '<div class="player-cards">' + playingCards(player['played'], 'selected-card') +
+        new Array(player['down'] + 1).join(back) + '</div></div>';
+
+    $("#player-" + player['name']).html(html);
+}
+
+function showGame(resp){
+    // Responses to the player's own moves only carry their view, not the version
+    if('version' in resp)
+    {
+        gameVersion = resp['version'];
+    }
+
+    // Unchanged games only return the version
+    if(!('self' in resp))
+    {
+        return;
+    }
+
+    renderSelf(resp);
+
+    if('players' in resp)
+    {
+        for(var i = 0; i < resp['players'].length; i++)
+        {
+            renderOther(resp['players'][i]);
+        }
+    }
+}
+
+function doStream(){
+    console.log("Starting Stream");
+
+    var source = new EventSource('/game/stream/' + $("#game-id").html() + "/?format=state");
+
+    source.onmessage = function(e) {
+        showGame(JSON.parse(e.data));
+    };
+
+    // Browser retries dropped streams itself, only fall back to polling if it gives up
+    source.onerror = function() {
+        if(source.readyState === EventSource.CLOSED)
+        {
+            console.log("Stream closed, falling back to polling");
+            setTimeout(doPoll, pollInterval);
+        }
+    };
+}
+
+// Polls send the ETag of the last game received, the server answers 304 with no body until it changes
 function doPoll(){
+    var data = {"format": "state"};
+    var headers = {};
+
+    if(gameVersion !== null)
+    {
+        data['version'] = gameVersion;
+    }
+
+    if(gameEtag !== null)
+    {
+        headers['If-None-Match'] = gameEtag;
+    }
+
     $.ajax({
-        headers: {"X-CSRFToken": getCookie('csrftoken')},
-        type: 'POST',
+        headers: headers,
+        type: 'GET',
         url: '/game/poll/' + $("#game-id").html() + "/",
-        data: {},
-        success: function(resp) {
+        data: data,
+        success: function(resp, status, xhr) {
             console.log("Polling for new updates...")
 
-             $("#player-self").html(resp['self']);
+            if(xhr.status !== 304)
+            {
+                gameEtag = xhr.getResponseHeader('ETag');
+                showGame(resp);
+            }
 
-            for(var i = 0; i < resp['players'].length; i++)
+            var interval = parseInt(xhr.getResponseHeader('X-Poll-Interval'), 10);
+            if(!isNaN(interval))
             {
-                player = resp['players'][i];
-                $("#player-"+player[0]).html(player[1]);
+                pollInterval = interval;
             }
 
-            setTimeout(doPoll, 5000);
+            setTimeout(doPoll, pollInterval);
         },
         error: function(){
-            setTimeout(doPoll, 5000);
+            setTimeout(doPoll, Math.max(pollInterval, 5000));
         }
     });
 }
@@ -0,0 +1,383 @@
+"""
+Strategies for playing a seat, shared by the bots (game/bots.py) and the simulator (game/simulator.py)
+
+Moves are worked out with the same rules the server enforces. A bot plays one
+turn at a time on cardset masks: legal_moves lists every play a hand can make
+and choose() picks one. The simulator plays a seat of a whole batch of games at
+once on NumPy arrays of cards held per rank through choose_batch(), strategies
+that only make sense one turn at a time, like Monte Carlo, leave it out.
+
+NumPy is only needed by choose_batch(), bots work without it.
+
+Monte Carlo rollouts are spread over a pool of processes started once by
+start_pool, without one they run in the calling thread.
+"""
+import multiprocessing
+import random
+import time
+from collections import namedtuple
+
+from cards import cardset
+from . import rules
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+Move = namedtuple('Move', ['cards', 'face_up'])
+
+
+class Table(namedtuple('Table', ['hand', 'played', 'waiting', 'unknown', 'card_face'])):
+    """
+    Everything a bot can see when it is its turn
+
+    Fields:
+        hand - cardset mask of the bot's cards, selected or not
+        played - (cards, count) for each player that has played this round in turn order,
+                 cards is 0 if they played face down
+        waiting - Number of cards held by each player still to play after the bot, in turn order
+        unknown - cardset mask of every card the bot can't see: the other hands and face down plays
+        card_face - Face the lead played, 2 if the bot is the lead
+    """
+    __slots__ = ()
+
+
+def legal_moves(hand, card_face=2):
+    """
+    Every play a hand can make, each set of cards passing rules.validate with each face it could be played
+
+    Only the lead chooses the face, everyone after follows card_face
+
+    Parameters:
+        hand - cardset mask of the cards held
+        card_face - Face the lead played, 2 if leading
+    """
+    faces = (True, False) if card_face == 2 else (bool(card_face),)
+    moves = []
+
+    for rank in cardset.RANK_CODES:
+        held = hand & cardset.rank_mask(rank)
+        cards = held
+
+        # Walks every non-empty subset of the cards held of the rank
+        while cards:
+            if not rules.validate(cards):
+                moves.extend(Move(cards, face_up) for face_up in faces)
+
+            cards = (cards - 1) & held
+
+    return moves
+
+
+def score(cards):
+    return rules.hand_score(cardset.count(cards), rules.cards_value(cards))
+
+
+def points(cards):
+    return rules.hand_points(cardset.count(cards), rules.cards_value(cards))
+
+
+def rank_index(cards):
+    return cardset.RANK_INDEX[cardset.lowest_rank(cards)]
+
+
+def best_group(hand):
+    """
+    Highest scoring play of a hand, every card of one rank, 0 if the hand is empty
+    """
+    best = 0
+
+    for rank in cardset.RANK_CODES:
+        cards = hand & cardset.rank_mask(rank)
+
+        if cards and (not best or score(cards) > score(best)):
+            best = cards
+
+    return best
+
+
+def visible_score(table):
+    """
+    Best score the bot can see already played this round, -1 if it leads or the round is face down
+    """
+    scores = [score(cards) + rules.score_bonus(i == 0, table.card_face)
+              for i, (cards, count) in enumerate(table.played) if cards]
+
+    return max(scores) if scores else -1
+
+
+NUM_RANKS = len(cardset.RANK_CODES)
+NUM_SUITS = len(cardset.SUIT_CODES)
+VALUES = np.array([rules.rank_value(rank) for rank in cardset.RANK_CODES]) if np is not None else None
+
+
+def option_scores(hands):
+    """
+    Score of playing every held card of each rank, -1 for ranks not held
+
+    Parameters:
+        hands - (games, ranks) array of the number of cards held of each rank
+    """
+    return np.where(hands > 0, rules.hand_score(hands, VALUES), -1)
+
+
+def lowest_held(hands):
+    return (hands > 0).argmax(axis=1)
+
+
+class Strategy(object):
+    """
+    Decides what a seat plays
+
+    choose() plays a bot's turn. It is given the Table, the legal moves, a random.Random and
+    the time.time() it has to decide by, and returns one of the moves
+
+    choose_batch() plays a seat of a batch of simulated games, only when batched is set. It is given:
+        hands - (games, ranks) counts held by the seat
+        visible - (games,) best score already on the table, -1 if nothing can be seen
+        lead - True if the seat is first to play this round
+        rng - numpy Generator
+
+    and returns (ranks, counts, face_up) arrays, face_up is only used when leading
+    """
+    name = None
+    batched = True
+
+    def choose(self, table, moves, rng, deadline):
+        raise NotImplementedError
+
+    def choose_batch(self, hands, visible, lead, rng):
+        raise NotImplementedError
+
+
+class RandomStrategy(Strategy):
+    """
+    Any legal move, in a batch a random number of cards of a random rank held with a random face
+    """
+    name = 'random'
+
+    def choose(self, table, moves, rng, deadline):
+        return rng.choice(moves)
+
+    def choose_batch(self, hands, visible, lead, rng):
+        ranks = ((hands > 0) * rng.random(hands.shape)).argmax(axis=1)
+        held = hands[np.arange(len(hands)), ranks]
+        counts = 1 + (rng.random(len(hands)) * held).astype(int)
+        return ranks, counts, rng.random(len(hands)) < 0.5
+
+
+class GreedyStrategy(Strategy):
+    """
+    Always plays the highest scoring group held, face up for the bonus
+    """
+    name = 'greedy'
+
+    def choose(self, table, moves, rng, deadline):
+        return max(moves, key=lambda move: (score(move.cards), move.face_up))
+
+    def choose_batch(self, hands, visible, lead, rng):
+        ranks = option_scores(hands).argmax(axis=1)
+        counts = hands[np.arange(len(hands)), ranks]
+        return ranks, counts, np.ones(len(hands), dtype=bool)
+
+
+class LowestStrategy(Strategy):
+    """
+    Throws away the lowest single card, face down
+    """
+    name = 'lowest'
+
+    def choose(self, table, moves, rng, deadline):
+        return min((move for move in moves if cardset.count(move.cards) == 1),
+                   key=lambda move: (rank_index(move.cards), move.face_up))
+
+    def choose_batch(self, hands, visible, lead, rng):
+        return lowest_held(hands), np.ones(len(hands), dtype=int), np.zeros(len(hands), dtype=bool)
+
+
+class BeatStrategy(Strategy):
+    """
+    Plays the fewest, lowest cards that beat the best visible score, throws the
+    lowest card away if it can't win and plays greedily when nothing can be seen
+    """
+    name = 'beat'
+
+    def choose(self, table, moves, rng, deadline):
+        visible = visible_score(table)
+
+        if visible < 0:
+            return GreedyStrategy().choose(table, moves, rng, deadline)
+
+        for count in range(1, NUM_SUITS + 1):
+            beats = [move for move in moves if cardset.count(move.cards) == count and score(move.cards) > visible]
+
+            if beats:
+                return min(beats, key=lambda move: rank_index(move.cards))
+
+        return LowestStrategy().choose(table, moves, rng, deadline)
+
+    def choose_batch(self, hands, visible, lead, rng):
+        ranks, counts, face_up = GreedyStrategy().choose_batch(hands, visible, lead, rng)
+
+        seen = visible >= 0
+        ranks = np.where(seen, lowest_held(hands), ranks)
+        counts = np.where(seen, 1, counts)
+        found = np.zeros(len(hands), dtype=bool)
+
+        for count in range(1, NUM_SUITS + 1):
+            beats = (hands >= count) & (rules.hand_score(count, VALUES) > visible[:, None])
+            use = seen & ~found & beats.any(axis=1)
+            ranks = np.where(use, beats.argmax(axis=1), ranks)
+            counts = np.where(use, count, counts)
+            found |= use
+
+        return ranks, counts, face_up
+
+
+class MonteCarloStrategy(Strategy):
+    """
+    Plays out the rest of the round from each distinct move, dealing the cards it can't
+    see at random and having everyone else play greedily, until the deadline. Picks the
+    move gaining the most points on average against the other players
+    """
+    name = 'montecarlo'
+    batched = False
+
+    def choose(self, table, moves, rng, deadline):
+        # Suits never change the outcome so one move per rank, count and face is enough
+        candidates = list(dict(((cardset.lowest_rank(move.cards), cardset.count(move.cards), move.face_up), move)
+                               for move in moves).values())
+
+        if len(candidates) == 1:
+            return candidates[0]
+
+        totals = rollouts(table, candidates, rng, deadline)
+        best = max(range(len(candidates)), key=lambda i: (totals[i], -cardset.count(candidates[i].cards)))
+        return candidates[best]
+
+
+STRATEGIES = {strategy.name: strategy for strategy in [RandomStrategy, GreedyStrategy, LowestStrategy,
+                                                       BeatStrategy, MonteCarloStrategy]}
+
+
+def take_group(pool, count, rng):
+    """
+    Takes count cards of one random rank out of a list of card indexes, for a face down play
+    """
+    ranks = {}
+    for i in pool:
+        ranks.setdefault(i // 4, []).append(i)
+
+    choices = [cards for cards in ranks.values() if len(cards) >= count]
+    if not choices:
+        return 0
+
+    taken = rng.choice(choices)[:count]
+    mask = 0
+    for i in taken:
+        pool.remove(i)
+        mask |= 1 << i
+
+    return mask
+
+
+def playout(table, move, unknown, rng):
+    """
+    Plays out one possible rest of the round after move
+
+    Returns:
+        Points won from the other players, or lost to them when the round is lost
+    """
+    pool = list(unknown)
+    rng.shuffle(pool)
+
+    actions = []
+    for cards, count in table.played:
+        actions.append(cards or take_group(pool, count, rng))
+
+    mine = len(actions)
+    actions.append(move.cards)
+    card_face = table.card_face if table.card_face != 2 else int(move.face_up)
+
+    for size in table.waiting:
+        hand = 0
+        for i in pool[:size]:
+            hand |= 1 << i
+        del pool[:size]
+
+        actions.append(best_group(hand))
+
+    scores = [score(cards) + rules.score_bonus(i == 0, card_face) if cards else 0
+              for i, cards in enumerate(actions)]
+    pot = sum(points(cards) for cards in actions if cards)
+
+    return (pot if rules.round_winner(scores) == mine else 0) - points(move.cards)
+
+
+_pool = None
+_processes = 0
+
+
+def start_pool(processes):
+    """
+    Starts the processes Monte Carlo rollouts are spread over, once when a server starts
+
+    Workers are spawned rather than forked so they never inherit the server's DB
+    connections or a lock some thread held at the time
+    """
+    global _pool, _processes
+
+    if _pool is None and processes:
+        _pool = multiprocessing.get_context('spawn').Pool(processes)
+        _processes = processes
+
+    return _pool
+
+
+def stop_pool():
+    global _pool, _processes
+
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool, _processes = None, 0
+
+
+def rollouts(table, candidates, rng, deadline):
+    """
+    Total playout results of each candidate, spread over the process pool if it has been started
+    """
+    if _pool is None:
+        return play_rollouts(table, candidates, rng, deadline)
+
+    results = [_pool.apply_async(rollout_batch, (table, candidates, rng.randrange(2 ** 32), deadline))
+               for i in range(_processes)]
+
+    return [sum(totals) for totals in zip(*[result.get() for result in results])]
+
+
+def rollout_batch(table, candidates, seed, deadline):
+    """
+    play_rollouts in a pool worker, seeded as a random.Random can't be shared between processes
+    """
+    return play_rollouts(table, candidates, random.Random(seed), deadline)
+
+
+def play_rollouts(table, candidates, rng, deadline):
+    """
+    Plays out every candidate move in turn until the deadline, at least once each
+
+    Returns:
+        Total result of each candidate
+    """
+    unknown = cardset.indexes(table.unknown)
+    totals = [0] * len(candidates)
+
+    while True:
+        for i, move in enumerate(candidates):
+            totals[i] += playout(table, move, unknown, rng)
+
+        if time.time() >= deadline:
+            return totals
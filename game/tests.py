@@ -1,10 +1,48 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, connections, transaction
+from django.core import serializers
+from django.core.management import call_command
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.test.client import Client
 
-from .models import Setup, Invitation, Game, Player
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from pofu.testing import QueryBudgetMixin
+from pofu.queries import fingerprint
+from pofu import asgi, sqlite
+from pofu.static import ManifestStaticFilesStorage
+from cards import cardset
+from cards.models import Hand
+from .models import Setup, Invitation, Game, GameEvent, GameSnapshot, Player, Action
 from .forms import SetupGameForm
+from .notifier import GameNotifier, AsyncGameNotifier
+from .snippets import SnippetCache, snippets
+from .engine import GameState, games
+from .concurrency import conflicts
+from .events import replay, catch_up
+from . import bots, polling, strategies
+from . import rules
+
+if np is not None:
+    from . import simulator
 
 
 def create_game(client):
@@ -15,6 +53,19 @@ def create_game(client):
     client.get(reverse('game:join_game', kwargs={'pk': 1}))
 
 
+def create_players_game(num_players):
+    """Creates a Game directly for num_players new users"""
+    users = [User.objects.create_user('player%d' % i) for i in range(num_players)]
+    setup = Setup(host=users[0], num_players=num_players)
+    setup.save()
+
+    for user in users:
+        Invitation(setup=setup, user=user).save()
+
+    setup.create_game()
+    return Game.objects.get(host=users[0])
+
+
 class GameViewsTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -90,6 +141,24 @@ class GameViewsTestCase(TestCase):
         self.assertEqual(games[0].host, self.user)
         self.assertEqual(games[0].joined(), 1)
 
+    def test_join_lobby_pages(self):
+        """The lobby is a fixed number of queries however many setups are open and pages by cursor"""
+        hosts = [User.objects.create_user('host%d' % i) for i in range(5)]
+        for host in hosts:
+            Setup.objects.create(host=host, num_players=3, message="Lobby")
+            Invitation.objects.create(setup=Setup.objects.latest('pk'), user=host)
+
+        with self.settings(GAME_LOBBY_PAGE_SIZE=3), self.assertNumQueries(3):
+            response = self.client.get(reverse('game:join'))
+            self.assertEqual([game.host for game in response.context['games']], hosts[:1:-1])
+            self.assertEqual([game.joined() for game in response.context['games']], [1, 1, 1])
+
+        with self.settings(GAME_LOBBY_PAGE_SIZE=3):
+            response = self.client.get(reverse('game:join'), {'before': response.context['cursor']})
+
+        self.assertEqual([game.host for game in response.context['games']], hosts[1::-1])
+        self.assertIsNone(response.context['cursor'])
+
     def test_not_last_person_to_join_setup(self):
         """Test joined games display on users home page"""
         self.client.post(reverse('game:setup'), {'num_players': 3, 'message': "Test Game"})
@@ -141,3 +210,1387 @@ class GameViewsTestCase(TestCase):
         """Joining game that doesn't exist throws 404"""
         response = self.client.get(reverse('game:join_game', kwargs={'pk': 1}))
         self.assertTrue(response.status_code, 404)
+
+
+class GamePlayTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user('test', 'test@pofu.net', 'testpass')
+        self.player = User.objects.create_user('test2', 'test2@pofu.net', 'test2pass')
+        create_game(self.client)
+        snippets.clear()
+
+        self.game = Game.objects.get()
+        self.game.start()
+
+    def poll(self, version=None):
+        data = {} if version is None else {'version': version}
+        return self.client.post(reverse('game:poll', kwargs={'pk': self.game.pk}), data).json()
+
+    def play_turn(self, face="up"):
+        """Current player submits the first card in their hand"""
+        game = Game.objects.get()
+        player = game.player_set.get(position=game.active_position)
+        rank, suit = cardset.cards(player.hand.cards)[0]
+        player.select(rank + " " + suit)
+        player.submit_action(face)
+        return player
+
+    def test_round_scores_winner(self):
+        """Round winner gets the points and leads the next round"""
+        lead = self.play_turn("up")
+
+        game = Game.objects.get()
+        self.assertEqual(game.card_face, 1)
+        self.assertEqual(game.score_bonus(lead), 2)
+        scores = {lead.pk: lead.hand_score() + 2}
+
+        other = self.play_turn()
+        scores[other.pk] = other.hand_score()
+
+        game = Game.objects.get()
+        self.assertTrue(game.is_round_end())
+
+        players = list(game.player_set.all())
+        winner = players[rules.round_winner([scores[p.pk] for p in players])]
+
+        self.assertEqual(winner.points, sum(p.hand_points() for p in players))
+        self.assertTrue(winner.turn)
+        self.assertEqual(game.positions[0], winner.position)
+        self.assertIsNone(game.active_position)
+
+        # Winner can't play again before the next deal
+        version = game.version
+        winner.play(["%s %s" % cardset.cards(winner.hand.cards)[0]], "up")
+        self.assertEqual(Game.objects.get().version, version)
+
+    def test_poll_returns_version_and_html(self):
+        """Polling without a version returns the rendered game"""
+        response = self.poll()
+        self.assertEqual(response['version'], Game.objects.get().version)
+        self.assertTrue('self' in response)
+        self.assertEqual(len(response['players']), 1)
+
+    def test_poll_unchanged_version(self):
+        """Polling with the current version skips rendering"""
+        version = self.poll()['version']
+        self.assertEqual(self.poll(version), {'version': version})
+
+        game = Game.objects.get()
+        with self.assertNumQueries(0):
+            game.poll(self.player, version)
+
+    def test_mutations_bump_version(self):
+        """Selecting a card changes the version seen by pollers"""
+        version = self.poll()['version']
+        player = Player.objects.get(user=self.player)
+        rank, suit = cardset.cards(player.hand.cards)[0]
+        player.select(rank + " " + suit)
+
+        response = self.poll(version)
+        self.assertEqual(response['version'], version + 1)
+        self.assertTrue('self' in response)
+
+    def test_state_hides_face_down_cards(self):
+        """State sends the viewer's hand as indexes and only a count of face down plays"""
+        lead = self.play_turn("down")
+        game = Game.objects.get()
+        url = reverse('game:poll', kwargs={'pk': self.game.pk}) + '?format=state'
+
+        response = self.client.post(url).json()
+        me = Player.objects.get(user=self.player)
+        self.assertEqual(response['version'], game.version)
+        self.assertEqual(response['card_face'], 0)
+        self.assertEqual(response['self']['hand'], cardset.indexes(me.hand.cards))
+
+        if lead.user_id == self.player.pk:
+            self.assertEqual(response['self']['action'], cardset.indexes(lead.action.cards))
+            self.assertFalse(response['self']['action_face_up'])
+        else:
+            self.assertEqual(response['players'], [{'name': 'test', 'points': 0, 'turn': False,
+                                                     'cards_left': lead.cards_left(), 'played': [], 'down': 1}])
+
+        self.assertEqual(self.client.post(url, {'version': game.version}).json(), {'version': game.version})
+
+    def test_poll_not_modified(self):
+        """A GET sending the ETag of the current version gets a 304, which lapses once the game changes"""
+        url = reverse('game:poll', kwargs={'pk': self.game.pk})
+        response = self.client.get(url, {'format': 'state'})
+        etag = response['ETag']
+
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+        response = self.client.get(url, {'format': 'state'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # POSTs are never conditional
+        self.assertEqual(self.client.post(url + '?format=state', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.play_turn()
+        response = self.client.get(url, {'format': 'state'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(GAME_POLL_INTERVALS={'turn': 500, 'next': 1000, 'waiting': 7000, 'ready': 10000,
+                                            'over': 60000})
+    def test_poll_interval(self):
+        """Polls tell the client how long to wait from the game and the configured policy"""
+        url = reverse('game:poll', kwargs={'pk': self.game.pk})
+        game = Game.objects.get()
+        me = game.player_set.get(user=self.player)
+        expected = 500 if game.active_position == me.position else 1000
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Poll-Interval'], str(expected))
+        self.assertEqual(response.json()['interval'], expected)
+
+        # A 304 has no body, the client keeps the interval it has
+        self.assertFalse(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).has_header('X-Poll-Interval'))
+
+        Game.objects.update(status='F')
+        self.assertEqual(self.client.get(url, {'format': 'state'})['X-Poll-Interval'], '60000')
+
+    def test_display_and_updates_not_modified(self):
+        """The display page and the player's snippet are conditional on the version too"""
+        for name in ['game:display', 'game:select', 'game:ready']:
+            url = reverse(name, kwargs={'pk': self.game.pk})
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            # A deploy changing the static files makes cached pages stale however the game stands
+            with mock.patch('game.views.manifest_token', return_value='0123456789ab'):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_update_returns_state(self):
+        """Moves asked for ?format=state return the player's state instead of html"""
+        rank, suit = cardset.cards(Player.objects.get(user=self.player).hand.cards)[0]
+        response = self.client.post(reverse('game:select', kwargs={'pk': self.game.pk}) + '?format=state',
+                                    {'card': rank + " " + suit}).json()
+
+        self.assertEqual(response['self']['selected'], [cardset.index(rank, suit)])
+        self.assertEqual(response['round_end'], False)
+        self.assertFalse('players' in response)
+
+    @override_settings(GAME_STREAM_KEEPALIVE=0.01, GAME_STREAM_DURATION=0.05)
+    def test_stream_sends_changes(self):
+        """Stream sends the game once then only keepalives while unchanged"""
+        response = self.client.get(reverse('game:stream', kwargs={'pk': self.game.pk}))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = list(response.streaming_content)
+        self.assertTrue(events[0].startswith(b'id: ' + str(Game.objects.get().version).encode()))
+        self.assertTrue(b'"self"' in events[0])
+        self.assertTrue(all(event == b': keepalive\n\n' for event in events[1:]))
+
+    @override_settings(GAME_STREAM_KEEPALIVE=0.01, GAME_STREAM_DURATION=0.05)
+    def test_stream_resumes_from_last_event_id(self):
+        """Reconnecting with the current version sends nothing new"""
+        response = self.client.get(reverse('game:stream', kwargs={'pk': self.game.pk}),
+                                   HTTP_LAST_EVENT_ID=str(Game.objects.get().version))
+        self.assertFalse(any(b'data:' in event for event in response.streaming_content))
+
+    def test_invalid_submit_leaves_no_action(self):
+        """Submitting an invalid selection doesn't create an Action"""
+        game = Game.objects.get()
+        player = game.player_set.get(position=0)
+        player.submit_action("up")
+
+        self.assertEqual(player.error, "Need to selected at least 1 card to play")
+        self.assertFalse(Action.objects.exists())
+
+    def test_active_position_follows_turn(self):
+        """The active position always points at the player whose turn it is"""
+        game = Game.objects.get()
+        self.assertEqual(game.active_position, game.positions[0])
+
+        player = self.play_turn()
+        game = Game.objects.get()
+        self.assertEqual(game.active_position, game.positions[1])
+        self.assertTrue(game.player_set.get(position=game.active_position).turn)
+        self.assertFalse(Player.objects.get(pk=player.pk).turn)
+
+    def test_round_end_reads_player_count(self):
+        """Checking for the end of a round doesn't query"""
+        game = Game.objects.get()
+        self.assertEqual(game.player_count, 2)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(game.is_round_end())
+
+    def test_rebuild_counters(self):
+        """rebuild_counters puts back counters that drifted from the tables"""
+        game = Game.objects.get()
+        Game.objects.filter(pk=game.pk).update(player_count=5, active_position=None)
+
+        out = StringIO()
+        call_command('rebuild_counters', dry_run=True, stdout=out)
+        self.assertTrue("1 games to fix" in out.getvalue())
+        self.assertEqual(Game.objects.get().player_count, 5)
+
+        call_command('rebuild_counters', stdout=out)
+        rebuilt = Game.objects.get()
+        self.assertEqual(rebuilt.player_count, 2)
+        self.assertEqual(rebuilt.active_position, game.active_position)
+
+        out = StringIO()
+        call_command('rebuild_counters', stdout=out)
+        self.assertTrue("0 games fixed, 0 hands overlapping" in out.getvalue())
+
+    def test_selection_sets_every_card(self):
+        """The selection endpoint replaces the whole selection in one request"""
+        player = Game.objects.get().player_set.get(user=self.player)
+        held = cardset.cards(player.hand.cards)
+        url = reverse('game:selection', kwargs={'pk': self.game.pk})
+
+        self.client.post(url, {'cards': [rank + " " + suit for rank, suit in held[:2]]})
+        hand = Player.objects.get(pk=player.pk).hand
+        self.assertEqual(cardset.cards(hand.selected), held[:2])
+        self.assertEqual(cardset.count(hand.cards), len(held) - 2)
+
+        self.client.post(url, {'cards': [held[1][0] + " " + held[1][1]]})
+        hand = Player.objects.get(pk=player.pk).hand
+        self.assertEqual(cardset.cards(hand.selected), held[1:2])
+        self.assertEqual(cardset.count(hand.cards), len(held) - 1)
+
+    def test_selection_rejects_cards_not_held(self):
+        """Selecting a card not in hand changes nothing"""
+        player = Game.objects.get().player_set.get(user=self.player)
+        rank, suit = cardset.cards(cardset.FULL & ~player.hand.cards)[0]
+        version = Game.objects.get().version
+
+        response = self.client.post(reverse('game:selection', kwargs={'pk': self.game.pk}),
+                                    {'cards': [rank + " " + suit, "Z Q"]}).json()
+
+        self.assertTrue("Unknown card" in response['self'])
+        self.assertEqual(Player.objects.get(pk=player.pk).hand.cards, player.hand.cards)
+        self.assertEqual(Game.objects.get().version, version)
+
+        player.set_selection([rank + " " + suit])
+        self.assertEqual(player.error, "Can only select cards in your hand")
+        self.assertEqual(Player.objects.get(pk=player.pk).hand.selected, 0)
+
+    def current_player(self):
+        game = Game.objects.get()
+        return game.player_set.get(position=game.active_position)
+
+    def test_play_is_one_request(self):
+        """Playing cards directly from the hand records the action and moves the turn on"""
+        player = self.current_player()
+        self.client.login(username=player.user.username, password=player.user.username + "pass")
+        rank, suit = cardset.cards(player.hand.cards)[0]
+
+        response = self.client.post(reverse('game:play', kwargs={'pk': self.game.pk}),
+                                    {'cards': [rank + " " + suit], 'face': 'up'}).json()
+
+        player = Player.objects.get(pk=player.pk)
+        self.assertEqual(cardset.cards(player.action.cards), [(rank, suit)])
+        self.assertFalse(player.turn)
+        self.assertEqual(player.cards_left(), 25)
+        self.assertEqual(Game.objects.get().card_face, 1)
+        self.assertEqual(response['version'], Game.objects.get().version)
+        self.assertEqual(len(response['players']), 1)
+
+    def test_invalid_play_writes_nothing(self):
+        """Playing mixed ranks or cards not held leaves no rows behind"""
+        player = self.current_player()
+        self.client.login(username=player.user.username, password=player.user.username + "pass")
+        held = cardset.cards(player.hand.cards)
+        mixed = [rank + " " + suit for rank, suit in held if rank != held[0][0]][:1] + [held[0][0] + " " + held[0][1]]
+        not_held = ["%s %s" % cardset.cards(cardset.FULL & ~player.hand.cards)[0]]
+        version = Game.objects.get().version
+        url = reverse('game:play', kwargs={'pk': self.game.pk})
+
+        response = self.client.post(url, {'cards': mixed, 'face': 'up'}).json()
+        self.assertTrue("All cards must be of the same rank" in response['self'])
+
+        response = self.client.post(url, {'cards': not_held, 'face': 'up'}).json()
+        self.assertTrue("Can only play cards in your hand" in response['self'])
+
+        self.assertFalse(Action.objects.exists())
+        self.assertEqual(Player.objects.get(pk=player.pk).hand.cards, player.hand.cards)
+        self.assertEqual(Game.objects.get().version, version)
+
+    def test_seeded_deal_is_reproducible(self):
+        """Starting with the same seed deals the same hands and positions"""
+        def deal():
+            self.game.start(seed=42)
+            return [(p.position, p.hand.cards) for p in Player.objects.order_by('pk').select_related('hand')]
+
+        first = deal()
+        self.assertEqual(deal(), first)
+        self.assertEqual(sum(cardset.count(cards) for _, cards in first), 52)
+        self.assertEqual(sorted(position for position, _ in first), [0, 1])
+
+    def test_start_queries_do_not_grow_with_players(self):
+        """Starting a game takes the same number of queries for 2 or 8 players"""
+        big_game = create_players_game(8)
+
+        with CaptureQueriesContext(connection) as small:
+            self.game.start()
+
+        with CaptureQueriesContext(connection) as big:
+            big_game.start()
+
+        self.assertEqual(len(small), len(big))
+        self.assertEqual(Player.objects.filter(game=big_game, turn=True).count(), 1)
+        self.assertEqual(sum(cardset.count(p.hand.cards) for p in big_game.player_set.all()), 52)
+
+    def test_poll_shares_opponent_snippets(self):
+        """Each snippet is rendered once per version however many times it is polled"""
+        self.poll()
+        self.poll()
+        self.assertEqual(snippets.stats(), {'hits': 2, 'misses': 2, 'size': 2})
+
+        game = create_players_game(3)
+        viewers = [player.user for player in game.player_set.all()]
+        for viewer in viewers:
+            game.poll(viewer)
+
+        # Each player's own snippet plus one shared opponent snippet each
+        self.assertEqual(snippets.stats(), {'hits': 5, 'misses': 8, 'size': 8})
+
+    def test_stale_instance_cannot_roll_back_version(self):
+        """Saving an old Game instance keeps the newer version"""
+        stale = Game.objects.get()
+        self.game.touch()
+        stale.save()
+        self.assertEqual(Game.objects.get().version, stale.version + 1)
+
+
+@override_settings(GAME_ENGINE=True, GAME_ENGINE_FLUSH_INTERVAL=3600)
+class GameEngineTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user('test', 'test@pofu.net', 'testpass')
+        self.player = User.objects.create_user('test2', 'test2@pofu.net', 'test2pass')
+        create_game(self.client)
+        snippets.clear()
+        self.client.login(username='test', password='testpass')
+
+        self.game = Game.objects.get()
+        self.client.post(reverse('game:start', kwargs={'pk': self.game.pk}))
+
+    def tearDown(self):
+        games.evict(self.game.pk)
+
+    def play_turn(self):
+        """Current player submits the first card in their hand"""
+        state = games.get(self.game.pk)
+        player = state.player_at(state.order[state.turn])
+        rank, suit = cardset.cards(player.cards)[0]
+        games.apply(self.game.pk, player.user, 'select', rank + " " + suit)
+        games.apply(self.game.pk, player.user, 'submit_action', "up")
+
+    def test_round_end_versions_match_db(self):
+        """A round end is recorded a version after the play that ended it, as when played through the DB"""
+        self.play_turn()
+        self.play_turn()
+
+        play, round_end = GameEvent.objects.filter(game=self.game).order_by('-pk')[:2][::-1]
+        self.assertEqual((play.kind, round_end.kind), (GameEvent.PLAY, GameEvent.ROUND_END))
+        self.assertEqual(round_end.version, play.version + 1)
+        self.assertEqual(Game.objects.get().version, round_end.version)
+
+    def test_start_deals_in_memory(self):
+        """Starting a game deals every card without waiting for a flush"""
+        state = games.get(self.game.pk)
+        self.assertEqual(sum(player.cards_left() for player in state.players), 52)
+        self.assertEqual(state.order, [0, 1])
+
+    def test_poll_served_from_memory(self):
+        """Polling a loaded game does not touch the DB"""
+        with self.assertNumQueries(0):
+            response = games.poll(self.game.pk, self.user)
+
+        self.assertEqual(len(response['players']), 1)
+
+        response = self.client.post(reverse('game:poll', kwargs={'pk': self.game.pk}),
+                                    {'version': response['version']}).json()
+        self.assertFalse('self' in response)
+
+    def test_state_served_from_memory(self):
+        """The engine gives the same state as the DB once flushed"""
+        with self.assertNumQueries(0):
+            response = games.state(self.game.pk, self.user)
+
+        games.flush()
+        self.assertEqual(response, Game.objects.get().state(self.user))
+
+    def test_quiet_games_flushed_when_overdue(self):
+        """Changes are written once GAME_ENGINE_FLUSH_INTERVAL passes even if no more moves come"""
+        state = games.get(self.game.pk)
+        player = state.player_at(state.order[state.turn])
+        rank, suit = cardset.cards(player.cards)[0]
+        games.apply(self.game.pk, player.user, 'select', rank + " " + suit)
+
+        # Held so the background flusher can't flush in between
+        with games.lock(self.game.pk):
+            games.flush(overdue_only=True)
+            self.assertEqual(Hand.objects.get(pk=player.hand_id).selected, 0)
+
+            state.flushed -= 3600
+            games.flush(overdue_only=True)
+            self.assertEqual(Hand.objects.get(pk=player.hand_id).selected, cardset.bit(rank, suit))
+
+    def test_display_tagged_with_live_version(self):
+        """The display page follows the engine's version rather than the DB's, which lags until a flush"""
+        url = reverse('game:display', kwargs={'pk': self.game.pk})
+        etag = self.client.get(url)['ETag']
+
+        state = games.get(self.game.pk)
+        player = state.player_at(state.order[state.turn])
+        rank, suit = cardset.cards(player.cards)[0]
+        games.apply(self.game.pk, player.user, 'select', rank + " " + suit)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.context['game'].version, games.get(self.game.pk).version)
+
+    def test_history_flushes_only_its_game(self):
+        """Catching up on one game writes that game back and leaves the rest cached"""
+        other = create_players_game(2)
+        other.start()
+        self.addCleanup(games.evict, other.pk)
+
+        selected = {}
+        for pk in [self.game.pk, other.pk]:
+            state = games.get(pk)
+            player = state.player_at(state.order[state.turn])
+            rank, suit = cardset.cards(player.cards)[0]
+            games.apply(pk, player.user, 'select', rank + " " + suit)
+            selected[pk] = player.hand_id
+
+        self.client.get(reverse('game:events', kwargs={'pk': self.game.pk}))
+        self.assertNotEqual(Hand.objects.get(pk=selected[self.game.pk]).selected, 0)
+        self.assertEqual(Hand.objects.get(pk=selected[other.pk]).selected, 0)
+
+    def test_games_locked_separately(self):
+        """A game busy in one thread doesn't hold up another"""
+        other = create_players_game(2)
+        other.start()
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with games.locked(self.game.pk):
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait(5)
+
+        try:
+            self.assertIn('self', games.poll(other.pk, other.player_set.first().user))
+            self.assertFalse(games.lock(self.game.pk).acquire(blocking=False))
+        finally:
+            release.set()
+            thread.join()
+            games.evict(other.pk)
+
+    def test_round_end_flushes_to_db(self):
+        """Finishing a round writes the state back to the tables"""
+        self.play_turn()
+        self.assertEqual(Player.objects.filter(action__isnull=False).count(), 0)
+
+        self.play_turn()
+        state = games.get(self.game.pk)
+        self.assertTrue(state.is_round_end())
+        self.assertFalse(state.dirty)
+
+        game = Game.objects.get()
+        self.assertEqual(game.version, state.version)
+        self.assertEqual(game.turn, 2)
+
+        for player in state.players:
+            row = Player.objects.get(pk=player.pk)
+            self.assertEqual(row.points, player.points)
+            self.assertFalse(row.ready)
+            self.assertEqual(row.cards_left(), 25)
+            self.assertEqual(cardset.count(row.action.cards), 1)
+            self.assertTrue(row.action.face_up)
+
+    def test_selection_in_memory(self):
+        """The batch selection applies to the in-memory hand"""
+        state = games.get(self.game.pk)
+        player = state.player_for_user(self.user)
+        held = cardset.cards(player.cards)
+
+        self.client.post(reverse('game:selection', kwargs={'pk': self.game.pk}),
+                         {'cards': [rank + " " + suit for rank, suit in held[:3]]})
+
+        self.assertEqual(cardset.cards(player.selected), held[:3])
+        self.assertEqual(player.cards_left(), len(held))
+
+    def test_reload_matches_memory(self):
+        """A flushed state reloads identically from the DB"""
+        self.play_turn()
+        state = games.get(self.game.pk)
+        state.flush()
+
+        loaded = GameState.load(self.game.pk)
+        self.assertEqual(loaded.order, state.order)
+        self.assertEqual(loaded.turn, state.turn)
+        self.assertEqual(loaded.card_face, state.card_face)
+
+        for player, other in zip(state.players, loaded.players):
+            self.assertEqual(player.cards, other.cards)
+            self.assertEqual(player.last_action(), other.last_action())
+            self.assertEqual(player.turn, other.turn)
+
+
+class RulesTestCase(SimpleTestCase):
+    def test_hand_score(self):
+        """More cards beat a higher rank"""
+        self.assertEqual(rules.hand_score(1, rules.rank_value('K')), 13)
+        self.assertEqual(rules.hand_score(2, rules.rank_value('A')), 14)
+
+    def test_hand_points(self):
+        """Picture cards are worth double"""
+        self.assertEqual(rules.hand_points(3, rules.rank_value('10')), 3)
+        self.assertEqual(rules.hand_points(3, rules.rank_value('J')), 6)
+
+    def test_validate(self):
+        """Actions need at least one card all of the same rank"""
+        self.assertNotEqual(rules.validate(0), "")
+        self.assertNotEqual(rules.validate(cardset.from_cards([('2', 'H'), ('3', 'H')])), "")
+        self.assertEqual(rules.validate(cardset.from_cards([('2', 'H'), ('2', 'S')])), "")
+
+    def test_pack_order(self):
+        """Turn orders round trip through a single integer"""
+        for num_players in range(2, 9):
+            for lead in range(num_players):
+                order = rules.turn_order(num_players, lead)
+                self.assertEqual(rules.unpack_order(rules.pack_order(order)), tuple(order))
+
+        self.assertEqual(rules.unpack_order(0), ())
+
+    def test_round_winner_ties_go_first(self):
+        """Ties go to the earlier player"""
+        self.assertEqual(rules.round_winner([5, 9, 9]), 1)
+        self.assertEqual(rules.turn_order(4, 2), [2, 3, 0, 1])
+
+
+class PollIntervalTestCase(SimpleTestCase):
+    def test_poll_case(self):
+        """Clients poll often near their turn and back off between rounds and once the game is over"""
+        order = (2, 3, 0, 1)
+
+        self.assertEqual(polling.poll_case('A', False, order, 1, 3), 'turn')
+        self.assertEqual(polling.poll_case('A', False, order, 1, 0), 'next')
+        self.assertEqual(polling.poll_case('A', False, order, 1, 1), 'waiting')
+        self.assertEqual(polling.poll_case('A', False, order, 1, 2), 'waiting')
+        self.assertEqual(polling.poll_case('A', True, order, 4, 3), 'ready')
+        self.assertEqual(polling.poll_case('C', False, order, 1, 3), 'over')
+
+    def test_intervals_from_settings(self):
+        """Each case waits as long as GAME_POLL_INTERVALS says"""
+        intervals = {'turn': 1, 'next': 2, 'waiting': 3, 'ready': 4, 'over': 120000}
+
+        with self.settings(GAME_POLL_INTERVALS=intervals):
+            self.assertEqual(polling.poll_interval('F', True, (0, 1), 2, 0), 120000)
+            self.assertEqual(polling.poll_interval('A', True, (0, 1), 2, 0), 4)
+            self.assertEqual(polling.poll_interval('A', False, (0, 1), 1, 0), 3)
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """
+    Upper bounds on the queries made by the game endpoints
+    Login alone costs 2 queries (session and user)
+    """
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user('test', 'test@pofu.net', 'testpass')
+        self.player = User.objects.create_user('test2', 'test2@pofu.net', 'test2pass')
+        create_game(self.client)
+        self.client.login(username='test', password='testpass')
+        snippets.clear()
+
+        self.game = Game.objects.get()
+        self.game.start(seed=1)
+        self.me = self.game.player_set.get(user=self.user)
+
+    def url(self, name):
+        return reverse(name, kwargs={'pk': self.game.pk})
+
+    def card(self):
+        rank, suit = cardset.cards(Player.objects.get(pk=self.me.pk).hand.cards)[0]
+        return rank + " " + suit
+
+    def test_poll_budget(self):
+        """Polling costs one query per table however many players there are"""
+        with self.assertMaxQueries(4):
+            self.client.post(self.url('game:poll'))
+
+    def test_state_budget(self):
+        """State reads the same rows as polling"""
+        with self.assertMaxQueries(4):
+            self.client.post(self.url('game:poll') + '?format=state')
+
+    def test_poll_not_modified_budget(self):
+        """A 304 is answered from the game alone"""
+        etag = self.client.get(self.url('game:poll'))['ETag']
+        with self.assertMaxQueries(3):
+            self.assertEqual(self.client.get(self.url('game:poll'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_poll_unchanged_budget(self):
+        """Polling an unchanged game only loads the game"""
+        version = Game.objects.get().version
+        with self.assertMaxQueries(3):
+            self.client.post(self.url('game:poll'), {'version': version})
+
+    def test_select_budget(self):
+        with self.assertMaxQueries(9):
+            self.client.post(self.url('game:select'), {'card': self.card()})
+
+    def test_selection_budget(self):
+        """Selecting several cards costs the same as selecting one"""
+        held = cardset.cards(self.me.hand.cards)
+
+        with self.assertMaxQueries(9):
+            self.client.post(self.url('game:selection'), {'cards': [rank + " " + suit for rank, suit in held[:3]]})
+
+    def test_submit_budget(self):
+        if not self.me.turn:
+            self.me = self.game.player_set.get(turn=True)
+            self.client.login(username='test2', password='test2pass')
+
+        self.client.post(self.url('game:select'), {'card': self.card()})
+
+        # Includes the savepoint pair of the transaction the play is written in and the event it appends
+        with self.assertMaxQueries(12):
+            self.client.post(self.url('game:submit'), {'face': 'up'})
+
+    def test_start_budget(self):
+        with self.assertMaxQueries(13):
+            self.client.post(self.url('game:start'))
+
+    @override_settings(DEBUG=True)
+    def test_query_headers_in_debug(self):
+        """Query stats are added to responses in debug mode"""
+        response = self.client.post(self.url('game:poll'))
+        self.assertEqual(response['X-Query-Count'], '4')
+        self.assertEqual(response['X-Query-Duplicates'], '0')
+        self.assertTrue('X-Query-Time' in response)
+
+    def test_nothing_recorded_when_unused(self):
+        """Outside DEBUG with the logger below INFO the SQL isn't captured at all"""
+        logger = logging.getLogger('pofu.queries')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.WARNING)
+
+        with mock.patch('pofu.queries.summarize') as summarize:
+            self.client.post(self.url('game:poll'))
+
+        self.assertFalse(summarize.called)
+
+    def test_fingerprint_ignores_literals(self):
+        """Queries differing only by literals share a fingerprint"""
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE a = 1 AND b = 'x' AND c IN (1, 2, 3)"),
+                         fingerprint("SELECT * FROM t WHERE a = 22 AND b = 'y''s' AND c IN (4)"))
+
+    def test_ready_budget(self):
+        with self.assertMaxQueries(9):
+            self.client.post(self.url('game:ready'))
+
+
+class LoadTestCommandTestCase(TransactionTestCase):
+    def test_loadtest_plays_games(self):
+        """loadtest drives games through the URLs, reports every endpoint and cleans up"""
+        out = StringIO()
+        call_command('loadtest', users=4, games=2, players=2, requests=15, workers=1, stdout=out)
+        report = out.getvalue()
+
+        for endpoint in ['poll', 'select', 'submit']:
+            self.assertTrue(re.search(r'^%s\s+\d+\s+0\s' % endpoint, report, re.MULTILINE), report)
+
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Game.objects.exists())
+
+
+@skipIf(np is None, "numpy not installed")
+class SimulatorTestCase(SimpleTestCase):
+    def test_rules_match_on_arrays(self):
+        """Scoring the simulator does on arrays gives the same results as the server"""
+        counts, values = [grid.ravel() for grid in np.meshgrid(np.arange(1, 5), np.arange(1, 14))]
+        pairs = list(zip(counts.tolist(), values.tolist()))
+
+        self.assertEqual(rules.hand_score(counts, values).tolist(), [rules.hand_score(c, v) for c, v in pairs])
+        self.assertEqual(rules.hand_points(counts, values).tolist(), [rules.hand_points(c, v) for c, v in pairs])
+
+        for is_lead in [True, False]:
+            self.assertEqual(rules.score_bonus(is_lead, np.array([1, 2])).tolist(),
+                             [rules.score_bonus(is_lead, 1), rules.score_bonus(is_lead, 2)])
+
+    def test_deal(self):
+        """Every game deals the whole deck, four of each rank"""
+        hands = simulator.deal(50, 3, np.random.default_rng(0))
+
+        self.assertEqual(hands.sum(axis=(1, 2)).tolist(), [52] * 50)
+        self.assertTrue((hands.sum(axis=1) == 4).all())
+        self.assertEqual(sorted(hands[0].sum(axis=1).tolist()), [17, 17, 18])
+
+    def test_run(self):
+        """Every round has one winner and the same seed plays the same games"""
+        result = simulator.Simulator(['greedy', 'beat', 'random'], seed=1).run(200)
+
+        self.assertEqual(result['rounds_won'].sum(axis=1).tolist(), result['rounds'].tolist())
+        self.assertTrue((result['rounds'] > 0).all())
+        self.assertTrue((result['rounds'] <= 17).all())
+        self.assertEqual(simulator.Simulator(['greedy', 'beat', 'random'], seed=1).run(200)['points'].tolist(),
+                         result['points'].tolist())
+
+    def test_simulate_command(self):
+        """simulate reports a line per seat"""
+        out = StringIO()
+        call_command('simulate', 'greedy', 'lowest', games=100, batch=30, seed=0, stdout=out)
+
+        self.assertTrue(re.search(r'^0\s+greedy\s', out.getvalue(), re.MULTILINE), out.getvalue())
+        self.assertTrue(re.search(r'^1\s+lowest\s', out.getvalue(), re.MULTILINE), out.getvalue())
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        self.game = create_players_game(3)
+        self.game.start(seed=2)
+        conflicts.clear()
+
+    def current_player(self):
+        game = Game.objects.get()
+        return game.player_set.select_related('game', 'hand', 'user').get(position=game.active_position)
+
+    def test_stale_play_is_retried(self):
+        """A play read before another play went through is retried on fresh state and does nothing"""
+        first = self.current_player()
+        stale = self.current_player()
+
+        first.play(["%s %s" % cardset.cards(first.hand.cards)[0]], "up")
+        stale.play(["%s %s" % cardset.cards(stale.hand.cards)[1]], "up")
+
+        self.assertEqual(Action.objects.count(), 1)
+        self.assertEqual(Game.objects.get().turn, 1)
+        self.assertFalse(stale.turn)
+        self.assertEqual(conflicts.stats(), {'moves': 2, 'conflicts': 1, 'failures': 0})
+
+    def test_parallel_plays(self):
+        """Many simultaneous plays of the same turn only move the game on once"""
+        player = self.current_player()
+        cards = cardset.cards(player.hand.cards)
+        url = reverse('game:play', kwargs={'pk': self.game.pk})
+        barrier = threading.Barrier(8)
+        statuses = []
+
+        def play(i):
+            client = Client()
+            client.force_login(player.user)
+            barrier.wait()
+
+            try:
+                statuses.append(client.post(url, {'cards': ["%s %s" % cards[i]], 'face': 'up'}).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=play, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(Action.objects.count(), 1)
+
+        game = Game.objects.get()
+        self.assertEqual(game.turn, 1)
+        self.assertEqual(game.player_set.filter(turn=True).count(), 1)
+        self.assertEqual(Player.objects.get(pk=player.pk).cards_left(), len(cards) - 1)
+
+
+class AsgiTestCase(TransactionTestCase):
+    def setUp(self):
+        self.game = create_players_game(2)
+        self.game.start(seed=2)
+        self.player = self.game.player_set.get(position=0)
+        self.client.force_login(self.player.user)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asgi._changes.pop(self.loop).close()
+        self.loop.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    def request(self, path, query=b'', after=None, headers=()):
+        """Sends a GET to the ASGI application, running after() on the loop while it is handled"""
+        session = self.client.cookies.get('sessionid')
+        cookie = 'sessionid=%s' % (session.value if session is not None else '')
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+                 'headers': [(b'cookie', cookie.encode())] + list(headers)}
+        messages = []
+        received = []
+
+        async def receive():
+            if received:
+                await asyncio.Future()
+
+            received.append(True)
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        asgi.changes()
+        if after is not None:
+            self.loop.call_later(0.05, after)
+
+        self.loop.run_until_complete(asgi.application(scope, receive, send))
+        self.headers = dict(messages[0]['headers'])
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_sync_views_served(self):
+        """Views without an async version are served through the WSGI application"""
+        status, body = self.request(reverse('game:display', kwargs={'pk': self.game.pk}))
+        self.assertEqual(status, 200)
+        self.assertIn(b'<html', body)
+
+    def test_poll_waits_for_change(self):
+        """A poll with the current version is held until the game changes"""
+        version = str(Game.objects.get().version).encode()
+        path = reverse('game:poll', kwargs={'pk': self.game.pk})
+
+        with override_settings(GAME_POLL_WAIT=0.01):
+            status, body = self.request(path, b'version=' + version)
+        self.assertEqual(status, 200)
+        self.assertNotIn(b'"self"', body)
+
+        with override_settings(GAME_POLL_WAIT=5):
+            status, body = self.request(path, b'version=' + version, after=self.game.touch)
+        self.assertEqual(status, 200)
+        self.assertIn(b'"self"', body)
+
+    def test_poll_not_modified(self):
+        """A poll held until it times out is a 304 for a client that sent the current ETag"""
+        version = str(Game.objects.get().version).encode()
+        path = reverse('game:poll', kwargs={'pk': self.game.pk})
+        etag = self.client.get(path)['ETag'].encode()
+
+        with override_settings(GAME_POLL_WAIT=0.01):
+            status, body = self.request(path, b'version=' + version, headers=[(b'if-none-match', etag)])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+
+    def test_poll_missing_game(self):
+        """Polling a game that doesn't exist is a 404"""
+        status, body = self.request(reverse('game:poll', kwargs={'pk': 99}))
+        self.assertEqual(status, 404)
+
+    def test_stream_sends_game(self):
+        """A stream starts with the current game as an event"""
+        with override_settings(GAME_STREAM_DURATION=0.01):
+            status, body = self.request(reverse('game:stream', kwargs={'pk': self.game.pk}))
+        self.assertEqual(status, 200)
+        self.assertEqual(self.headers[b'content-type'], b'text/event-stream')
+        self.assertTrue(body.startswith(b'id: %d\ndata: {' % Game.objects.get().version))
+
+    def test_poll_through_middleware(self):
+        """Long polls go through the middleware stack like any other request"""
+        path = reverse('game:poll', kwargs={'pk': self.game.pk})
+
+        with override_settings(GAME_POLL_WAIT=0.01):
+            status, body = self.request(path)
+        self.assertEqual(status, 200)
+        self.assertEqual(self.headers[b'X-Frame-Options'], b'SAMEORIGIN')
+
+        self.client.logout()
+        status, body = self.request(path)
+        self.assertEqual(status, 302)
+
+
+class SqliteTestCase(TransactionTestCase):
+    def tearDown(self):
+        sqlite.writes.stop()
+
+    def test_bench_runs_each_mode(self):
+        """sqlite_bench plays real games in each mode on scratch files and reports a line for each"""
+        out = StringIO()
+        call_command('sqlite_bench', '--threads=2', '--moves=5', '--reads=1', stdout=out)
+
+        lines = out.getvalue().splitlines()[1:]
+        self.assertEqual([line.split()[0] for line in lines], ['default', 'wal', 'queue'])
+        self.assertEqual([line.split()[2] for line in lines], ['10', '10', '10'])
+        self.assertFalse(User.objects.filter(username__startswith="bench-").exists())
+
+    def test_pragmas_applied_per_connection(self):
+        """Connections run the pragmas of their DATABASES entry when they open"""
+        default = connections['default']
+        tuned = type(default)(dict(default.settings_dict, PRAGMAS={'synchronous': 'off', 'cache_size': 123}))
+
+        with tuned.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], 123)
+
+        tuned.close()
+
+    def test_reads_in_transaction_stay_on_writer(self):
+        """Reads go to the read alias except inside a transaction"""
+        router = sqlite.ReadRouter()
+        self.assertEqual(router.db_for_read(Game), 'read')
+
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Game), 'default')
+
+    @override_settings(SQLITE_WRITE_QUEUE=True)
+    def test_moves_go_through_write_queue(self):
+        """With the write queue on plays are committed by the writer thread"""
+        game = create_players_game(2)
+        game.start(seed=2)
+        player = game.player_set.select_related('game', 'hand').get(position=0)
+        writes = sqlite.writes.writes
+
+        player.play(["%s %s" % cardset.cards(player.hand.cards)[0]], "up")
+
+        self.assertEqual(sqlite.writes.writes, writes + 1)
+        self.assertEqual(Action.objects.count(), 1)
+        self.assertEqual(Game.objects.get().turn, 1)
+
+    @override_settings(SQLITE_WRITE_QUEUE=True)
+    def test_game_changes_go_through_write_queue(self):
+        """Starting, selecting, choosing a face and getting ready are all committed by the writer thread"""
+        game = create_players_game(2)
+        writes = sqlite.writes.writes
+
+        game.start(seed=2)
+        player = game.player_set.select_related('game', 'hand').get(position=0)
+        card = "%s %s" % cardset.cards(player.hand.cards)[0]
+
+        player.select(card)
+        player.deselect(card)
+        player.set_selection([card])
+        player.select_face("down")
+        player.set_ready()
+
+        self.assertEqual(sqlite.writes.writes, writes + 6)
+        self.assertEqual(GameEvent.objects.filter(game=game).count(), 6)
+        self.assertEqual(Game.objects.get().version, 6)
+
+    def test_failed_write_only_undoes_itself(self):
+        """A queued write that raises is rolled back and reported without losing the rest of its batch"""
+        user = User.objects.create_user('test')
+        queue = sqlite.WriteQueue()
+
+        def fail():
+            User.objects.filter(pk=user.pk).update(first_name="lost")
+            raise ValueError("failed")
+
+        try:
+            failed = queue.submit(fail)
+            renamed = queue.submit(lambda: User.objects.filter(pk=user.pk).update(last_name="kept"))
+
+            self.assertRaises(ValueError, failed.result)
+            self.assertEqual(renamed.result(), 1)
+        finally:
+            queue.stop()
+
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.last_name), ("", "kept"))
+
+
+class EventLogTestCase(TestCase):
+    def setUp(self):
+        self.game = create_players_game(3)
+        self.game.start(seed=5)
+
+    def player(self, **kwargs):
+        return Player.objects.select_related('game', 'hand', 'action').get(game=self.game, **kwargs)
+
+    def play_round(self):
+        for turn in range(3):
+            player = self.player(turn=True)
+            player.select(" ".join(cardset.cards(player.hand.cards)[0]))
+            player.select_face("down")
+            player.submit_action(None)
+
+        for player in Player.objects.filter(game=self.game).select_related('game', 'hand'):
+            player.set_ready()
+
+    def assertMatchesGame(self, state, game, players):
+        self.assertEqual((state.version, list(state.order), state.turn, state.card_face),
+                         (game.version, list(game.positions), game.turn, game.card_face))
+
+        for replayed, player in zip(state.players, players):
+            self.assertEqual(
+                (replayed.points, replayed.position, replayed.turn, replayed.ready, replayed.face_up,
+                 replayed.cards, replayed.selected, replayed.action and replayed.action.cards),
+                (player.points, player.position, player.turn, player.ready, player.face_up,
+                 player.hand.cards, player.hand.selected, player.action and player.action.cards))
+
+    def current(self):
+        return Game.objects.get(pk=self.game.pk), list(self.game.player_set.order_by('pk').select_related(
+            'hand', 'action'))
+
+    def test_replay_rebuilds_game(self):
+        """Replaying the events gives the game as it is now and as it was at earlier versions"""
+        self.play_round()
+        middle = self.current()
+
+        self.play_round()
+        player = self.player(turn=True)
+        player.set_selection([" ".join(card) for card in cardset.cards(player.hand.cards)[:2]])
+
+        self.assertMatchesGame(replay(self.game.pk), *self.current())
+        self.assertMatchesGame(replay(self.game.pk, middle[0].version), *middle)
+
+    @override_settings(GAME_SNAPSHOT_EVERY=5)
+    def test_replay_saves_snapshots(self):
+        """A long replay saves a snapshot which later replays start from"""
+        self.play_round()
+        replay(self.game.pk)
+
+        snapshot = GameSnapshot.objects.get()
+        self.assertEqual(snapshot.version, Game.objects.get().version)
+
+        self.play_round()
+        self.assertMatchesGame(replay(self.game.pk), *self.current())
+        self.assertEqual(GameSnapshot.objects.count(), 2)
+
+    def test_round_end_version(self):
+        """A round end is recorded a version after the play that ended it"""
+        self.play_round()
+
+        round_end = GameEvent.objects.get(kind=GameEvent.ROUND_END)
+        play = GameEvent.objects.filter(kind=GameEvent.PLAY).order_by('-pk').first()
+        self.assertEqual(round_end.version, play.version + 1)
+
+    def test_catch_up_hides_other_players_cards(self):
+        """Catching up shows the player their own selections but not anyone else's or the seed"""
+        since = Game.objects.get().version
+        self.play_round()
+        me = self.player(position=0)
+
+        events = catch_up(self.game.pk, me.position, since)
+        self.assertEqual(len(events), GameEvent.objects.filter(version__gt=since).count())
+
+        for version, kind, position, cards, value in events:
+            if kind == GameEvent.SELECT or (kind == GameEvent.PLAY and not value):
+                self.assertEqual(cards != 0, position == me.position)
+
+        self.assertEqual(catch_up(self.game.pk, me.position, 0)[0][:2], [1, GameEvent.START])
+        self.assertEqual(catch_up(self.game.pk, me.position, 0)[0][4], 0)
+
+    def test_events_view(self):
+        """The events endpoint sends the events after the version asked for"""
+        self.play_round()
+        version = Game.objects.get().version
+        self.client.force_login(self.player(position=0).user)
+
+        response = self.client.get(reverse('game:events', kwargs={'pk': self.game.pk}), {'since': version - 1})
+        self.assertEqual(response.json(), {'version': version, 'events': [[version, GameEvent.READY, 2, 0, 0]]})
+
+        response = self.client.get(reverse('game:events', kwargs={'pk': self.game.pk}), {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CleanupGamesTestCase(TestCase):
+    def setUp(self):
+        self.game = create_players_game(2)
+        self.game.start(seed=1)
+        self.archive_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def cleanup(self, *args):
+        out = StringIO()
+        call_command('cleanup_games', '--archive-dir', self.archive_dir, '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_unreferenced_actions_deleted(self):
+        """Actions no player refers to are deleted in batches and the rest are kept"""
+        player = self.game.player_set.select_related('game', 'hand').get(turn=True)
+        player.play(["%s %s" % cardset.cards(player.hand.cards)[0]], "up")
+        for i in range(5):
+            Action.objects.create(cards=1)
+
+        self.assertIn("5 actions to delete", self.cleanup('--dry-run'))
+        self.assertEqual(Action.objects.count(), 6)
+
+        self.assertIn("5 actions deleted, 0 games archived", self.cleanup())
+        self.assertEqual(list(Action.objects.all()), [Player.objects.get(pk=player.pk).action])
+
+    def test_finished_games_archived(self):
+        """Finished games are written to a fixture and removed, loading it brings them back"""
+        player = self.game.player_set.select_related('game', 'hand').get(turn=True)
+        player.play(["%s %s" % cardset.cards(player.hand.cards)[0]], "up")
+        Game.objects.filter(pk=self.game.pk).update(status='F')
+        hands = list(Hand.objects.order_by('pk').values_list('cards', flat=True))
+
+        self.assertIn("0 actions deleted, 1 games archived", self.cleanup())
+        self.assertFalse(Game.objects.exists())
+        self.assertFalse(Action.objects.exists())
+        self.assertFalse(GameEvent.objects.exists())
+
+        with gzip.open(os.path.join(self.archive_dir, 'game-%d.json.gz' % self.game.pk), 'rt') as archive:
+            for row in serializers.deserialize('json', archive):
+                row.save()
+
+        self.assertEqual(Game.objects.get().status, 'F')
+        self.assertEqual(list(Hand.objects.order_by('pk').values_list('cards', flat=True)), hands)
+        self.assertEqual(Player.objects.get(pk=player.pk).action.cards, Action.objects.get().cards)
+        self.assertEqual(GameEvent.objects.count(), 2)
+
+
+@override_settings(GAME_BOT_TIME=0.02)
+class BotsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.client = Client()
+        self.host = User.objects.create_user('test', 'test@pofu.net', 'testpass')
+        self.client.login(username='test', password='testpass')
+        self.client.post(reverse('game:setup'), {'num_players': 3, 'message': "Bots"})
+
+    def fill(self, strategy):
+        self.client.get(reverse('game:bots', kwargs={'pk': Setup.objects.get().pk}), {'strategy': strategy})
+        return Game.objects.get()
+
+    def me(self):
+        bots.turns.wait()
+        return Player.objects.select_related('game', 'hand', 'action').get(user=self.host)
+
+    def test_legal_moves(self):
+        """Every subset of a rank is a move, with both faces only for the lead"""
+        hand = cardset.parse(["A H", "A D", "A S", "K C"])
+
+        self.assertEqual(len(strategies.legal_moves(hand)), 16)
+        self.assertEqual(len(strategies.legal_moves(hand, card_face=1)), 8)
+        self.assertTrue(all(move.face_up and not rules.validate(move.cards)
+                            for move in strategies.legal_moves(hand, card_face=1)))
+
+    def test_strategies_choose_legal_moves(self):
+        """Each strategy picks one of the legal moves, greedy the biggest group face up"""
+        hand = cardset.parse(["A H", "A D", "A S", "K C", "2 H"])
+        table = strategies.Table(hand=hand, played=[(0, 2)], waiting=[5], unknown=cardset.FULL & ~hand, card_face=2)
+        moves = strategies.legal_moves(hand, table.card_face)
+
+        self.assertEqual(bots.choose('greedy', table), strategies.Move(cardset.parse(["A H", "A D", "A S"]), True))
+
+        for strategy in strategies.STRATEGIES:
+            start = time.time()
+            self.assertIn(bots.choose(strategy, table), moves)
+            self.assertLess(time.time() - start, 1)
+
+    def test_rollouts_in_process_pool(self):
+        """Monte Carlo rollouts run across a pool of spawned processes once one is started"""
+        hand = cardset.parse(["5 H", "5 D", "K C"])
+        table = strategies.Table(hand=hand, played=[], waiting=[3, 3], unknown=cardset.FULL & ~hand, card_face=2)
+
+        with self.settings(GAME_BOT_PROCESSES=2):
+            pool = bots.start_pool()
+        self.addCleanup(strategies.stop_pool)
+
+        self.assertIsNotNone(pool)
+        self.assertIs(bots.start_pool(), pool)
+        self.assertIn(bots.choose('montecarlo', table, budget=0.05), strategies.legal_moves(hand))
+
+    def test_shared_strategies_follow_table(self):
+        """Beat plays the fewest, lowest cards beating what is face up and throws away its lowest card otherwise"""
+        hand = cardset.parse(["3 H", "5 H", "5 D", "K C"])
+        unknown = cardset.FULL & ~hand
+
+        table = strategies.Table(hand=hand, played=[(cardset.parse(["4 S"]), 1)], waiting=[], unknown=unknown,
+                                 card_face=1)
+        self.assertEqual(bots.choose('beat', table), strategies.Move(cardset.parse(["K C"]), True))
+
+        table = table._replace(played=[(cardset.parse(["Q S", "Q D"]), 2)])
+        self.assertEqual(bots.choose('beat', table), strategies.Move(cardset.parse(["3 H"]), True))
+
+        self.assertEqual(bots.choose('lowest', table._replace(card_face=2, played=[])),
+                         strategies.Move(cardset.parse(["3 H"]), False))
+
+    def test_bots_fill_seats_and_play(self):
+        """Bots fill the empty seats and take their turns as soon as the turn reaches them"""
+        game = self.fill('montecarlo')
+        self.assertEqual(game.player_count, 3)
+        self.assertEqual(game.player_set.exclude(bot="").count(), 2)
+
+        self.client.get(reverse('game:start', kwargs={'pk': game.pk}))
+
+        for i in range(6):
+            me = self.me()
+            self.assertTrue(me.turn or not me.ready)
+
+            # A human winning the round holds the turn until they are ready for the next deal
+            if not me.ready:
+                me.set_ready()
+            else:
+                me.play(["%s %s" % cardset.cards(me.hand.cards)[0]], "up")
+
+        bots.turns.wait()
+        self.assertEqual(GameEvent.objects.filter(kind=GameEvent.ROUND_END).count(), 3)
+
+        game = Game.objects.get()
+        state = replay(game.pk)
+        self.assertEqual((state.version, list(state.order), state.turn), (game.version, list(game.positions), game.turn))
+        self.assertEqual([player.cards for player in state.players],
+                         list(Hand.objects.order_by('player').values_list('cards', flat=True)))
+
+    def test_bots_play_after_commit(self):
+        """A bot handed the turn waits for the move that handed it over to commit before playing"""
+        game = self.fill('greedy')
+        self.client.get(reverse('game:start', kwargs={'pk': game.pk}))
+        me = self.me()
+
+        while not me.turn:
+            me.set_ready()
+            me = self.me()
+
+        plays = GameEvent.objects.filter(kind=GameEvent.PLAY).count()
+
+        with transaction.atomic():
+            me.play(["%s %s" % cardset.cards(me.hand.cards)[0]], "up")
+            time.sleep(0.05)
+            self.assertEqual(GameEvent.objects.filter(kind=GameEvent.PLAY).count(), plays + 1)
+
+        # Every bot after the player has played and the round is over
+        bots.turns.wait()
+        self.assertTrue(Game.objects.get().is_round_end())
+        self.assertEqual(GameEvent.objects.filter(kind=GameEvent.PLAY).count(), 3)
+
+    def test_bots_never_take_over_users(self):
+        """A person's account with a bot's name is left alone and the bot plays under another name"""
+        person = User.objects.create_user('greedy-bot-1', 'bot@pofu.net', 'botpass')
+        game = self.fill('greedy')
+
+        bot_users = dict((player.user.username, player.user)
+                         for player in game.player_set.exclude(bot="").select_related('user'))
+        self.assertEqual(sorted(bot_users), ['greedy-bot-1-2', 'greedy-bot-2'])
+        self.assertTrue(User.objects.get(pk=person.pk).check_password('botpass'))
+
+        # Later games find the same bot users through Bot rather than by name
+        self.assertEqual(Game.objects.bot_user('greedy', 1), bot_users['greedy-bot-1-2'])
+
+    @override_settings(GAME_ENGINE=True)
+    def test_no_bots_with_engine(self):
+        """Setups can't be filled with bots while the in-memory engine serves games"""
+        response = self.client.get(reverse('game:bots', kwargs={'pk': Setup.objects.get().pk}))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Game.objects.exists())
+        self.assertTrue(Setup.objects.exists())
+
+    def test_only_host_fills_with_bots(self):
+        """Only the host can fill their setup with bots"""
+        User.objects.create_user('test2', 'test2@pofu.net', 'test2pass')
+        self.client.login(username='test2', password='test2pass')
+
+        self.assertEqual(self.client.get(reverse('game:bots', kwargs={'pk': Setup.objects.get().pk})).status_code, 403)
+        self.assertFalse(Game.objects.exists())
+
+
+class StaticFilesTestCase(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        os.makedirs(os.path.join(self.root, 'cards'))
+        for name in ['cards/cards.css', 'cards/cards.0123456789ab.css']:
+            with open(os.path.join(self.root, name), 'w') as css_file:
+                css_file.write(".card-face {}")
+
+        with open(os.path.join(self.root, 'staticfiles.json'), 'w') as manifest:
+            json.dump({'paths': {'cards/cards.css': 'cards/cards.0123456789ab.css'}, 'version': '1.0'}, manifest)
+
+    def test_hashed_names_are_cached(self):
+        """Collected files with hashed names are cached for good, anything else is revalidated"""
+        with self.settings(STATIC_ROOT=self.root, DEBUG=True, STATIC_CACHE_SECONDS=600):
+            response = self.client.get('/static/cards/cards.0123456789ab.css')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=600, immutable')
+
+            response = self.client.get('/static/cards/cards.css')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+
+            self.assertEqual(self.client.get('/static/game/missing.css').status_code, 404)
+
+    def test_manifest_token(self):
+        """The manifest token changes when collectstatic renames any file"""
+        token = ManifestStaticFilesStorage(location=self.root).manifest_token()
+        self.assertEqual(token, ManifestStaticFilesStorage(location=self.root).manifest_token())
+
+        with open(os.path.join(self.root, 'staticfiles.json'), 'w') as manifest:
+            json.dump({'paths': {'cards/cards.css': 'cards/cards.ba9876543210.css'}, 'version': '1.0'}, manifest)
+
+        self.assertNotEqual(ManifestStaticFilesStorage(location=self.root).manifest_token(), token)
+
+    def test_not_served_in_production(self):
+        """Outside DEBUG static files are left to the front-end server"""
+        with self.settings(STATIC_ROOT=self.root, DEBUG=False):
+            self.assertEqual(self.client.get('/static/cards/cards.0123456789ab.css').status_code, 404)
+
+    def test_uncollected_names(self):
+        """Before collectstatic links are unhashed and DEBUG serves from the apps"""
+        self.assertEqual(ManifestStaticFilesStorage(location=tempfile.gettempdir()).url('cards/cards.css'),
+                         '/static/cards/cards.css')
+
+        with self.settings(STATIC_ROOT=tempfile.gettempdir(), DEBUG=True):
+            response = self.client.get('/static/cards/cards.css')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+
+
+class SnippetCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = SnippetCache()
+        user = User.objects.create_user('test', 'test@pofu.net', 'testpass')
+        self.player = Player(user=user)
+
+    @override_settings(GAME_SNIPPET_CACHE_SIZE=2)
+    def test_least_recently_used_evicted(self):
+        """Cache drops the least recently used snippet once full"""
+        self.cache.render(1, 1, self.player, 'other')
+        self.cache.render(1, 2, self.player, 'other')
+        self.cache.render(1, 1, self.player, 'other')
+        self.cache.render(1, 3, self.player, 'other')
+        self.cache.render(1, 1, self.player, 'other')
+        self.cache.render(1, 2, self.player, 'other')
+
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 4, 'size': 2})
+
+
+class GameNotifierTestCase(SimpleTestCase):
+    def test_wait_times_out_without_change(self):
+        """Waiting on an unchanged game times out"""
+        notifier = GameNotifier()
+        self.assertFalse(notifier.wait(1, notifier.sequence(1), 0.01))
+
+    def test_notify_wakes_waiter(self):
+        """Notifying a game wakes threads waiting on it"""
+        notifier = GameNotifier()
+        sequence = notifier.sequence(1)
+        threading.Timer(0.01, notifier.notify, args=[1]).start()
+        self.assertTrue(notifier.wait(1, sequence, 5))
+
+    def test_missed_notify_is_not_lost(self):
+        """A change before the wait starts returns immediately"""
+        notifier = GameNotifier()
+        sequence = notifier.sequence(1)
+        notifier.notify(1)
+        self.assertTrue(notifier.wait(1, sequence, 0))
+
+    def test_async_waiter_woken_from_thread(self):
+        """Notifying from another thread wakes coroutines waiting on the loop"""
+        notifier = GameNotifier()
+        loop = asyncio.new_event_loop()
+        changes = AsyncGameNotifier(notifier, loop)
+
+        try:
+            self.assertFalse(loop.run_until_complete(changes.wait(1, changes.sequence(1), 0.01)))
+
+            sequence = changes.sequence(1)
+            threading.Timer(0.01, notifier.notify, args=[1]).start()
+            self.assertTrue(loop.run_until_complete(changes.wait(1, sequence, 5)))
+        finally:
+            changes.close()
+            loop.close()
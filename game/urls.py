@@ -9,12 +9,17 @@ urlpatterns = [
     url(r'^join/(?P<pk>\d+)/$', views.join_game, name='join_game'),
     url(r'^delete/(?P<pk>\d+)/$', views.delete_game, name='delete'),
     url(r'^leave/(?P<pk>\d+)/$', views.leave_game, name='leave'),
+    url(r'^bots/(?P<pk>\d+)/$', views.fill_bots, name='bots'),
     url(r'^display/(?P<pk>\d+)/$', views.display, name='display'),
     url(r'^start/(?P<pk>\d+)/$', views.start, name='start'),
     url(r'^poll/(?P<pk>\d+)/$', views.poll, name='poll'),
+    url(r'^stream/(?P<pk>\d+)/$', views.stream, name='stream'),
+    url(r'^events/(?P<pk>\d+)/$', views.history, name='events'),
     url(r'^update/(?P<pk>\d+)/select/$', views.select, name='select'),
     url(r'^update/(?P<pk>\d+)/deselect/$', views.deselect, name='deselect'),
+    url(r'^update/(?P<pk>\d+)/selection/$', views.selection, name='selection'),
     url(r'^update/(?P<pk>\d+)/face/$', views.face, name='face'),
     url(r'^update/(?P<pk>\d+)/ready/$', views.ready, name='ready'),
     url(r'^update/(?P<pk>\d+)/submit/$', views.submit, name='submit'),
+    url(r'^update/(?P<pk>\d+)/play/$', views.play, name='play'),
 ]
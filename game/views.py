@@ -1,10 +1,161 @@
+import json
+import time
+
+from django.conf import settings
 from django.shortcuts import redirect, render, get_object_or_404
-from django.http import HttpResponseForbidden, HttpResponse, JsonResponse
+from django.http import (HttpResponseForbidden, HttpResponse, HttpResponseNotModified, JsonResponse,
+                         StreamingHttpResponse, Http404)
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 
+from cards.registry import registry, BACK
+from pofu.static import manifest_token
 from .models import Setup, Invitation, Game
 from .forms import SetupGameForm
+from .notifier import notifier
+from .engine import games
+from . import bots, events
+
+
+def engine_enabled():
+    return getattr(settings, 'GAME_ENGINE', False)
+
+
+def engine_game(pk):
+    try:
+        return games.get(pk)
+    except Game.DoesNotExist:
+        raise Http404
+
+
+def wants_state(request):
+    """
+    Whether the client renders the game itself from game.state, asked for with ?format=state,
+    rather than being sent rendered snippets
+    """
+    return request.GET.get('format') == 'state'
+
+
+def game_etag(request, version):
+    """
+    ETag of what the requesting user sees of a game at version, in the format they asked for
+
+    HTML links to static files so its ETags include the static manifest, a deploy changing them
+    doesn't leave browsers with pages pointing at files that are gone
+    """
+    if wants_state(request):
+        return quote_etag('%s-%s-state' % (version, request.user.pk))
+
+    return quote_etag('%s-%s-html-%s' % (version, request.user.pk, manifest_token()))
+
+
+def tag(request, version, response):
+    """
+    Marks the response to a GET as the user's view of version, browsers revalidate it every time
+    """
+    if request.method in ('GET', 'HEAD'):
+        response['ETag'] = game_etag(request, version)
+        patch_cache_control(response, private=True, no_cache=True)
+
+    return response
+
+
+def not_modified(request, version):
+    """
+    304 response if a GET's If-None-Match shows it already has version, otherwise None
+
+    Only needs the version so it is answered before players are loaded or anything is rendered
+    """
+    if request.method not in ('GET', 'HEAD') or 'HTTP_IF_NONE_MATCH' not in request.META:
+        return None
+
+    etags = parse_etags(request.META['HTTP_IF_NONE_MATCH'])
+    if '*' not in etags and game_etag(request, version) not in [quote_etag(etag) for etag in etags]:
+        return None
+
+    return tag(request, version, HttpResponseNotModified())
+
+
+def poll_response(request, response):
+    """
+    A poll's JsonResponse with its ETag and, when the game was sent, the milliseconds the client
+    should wait before polling again in X-Poll-Interval. Unchanged games keep the last interval
+    """
+    http_response = tag(request, response['version'], JsonResponse(response))
+
+    # Lets pofu.asgi hold the poll until the game changes
+    http_response.game_unchanged = 'self' not in response
+
+    if 'interval' in response:
+        http_response['X-Poll-Interval'] = response['interval']
+
+    return http_response
+
+
+def engine_update(request, pk, move, *args):
+    """
+    Applies a move through the in-memory engine, or just renders the player if not a POST
+    """
+    state = engine_game(pk)
+    compact = wants_state(request)
+
+    if request.method == 'POST':
+        return JsonResponse(games.apply(pk, request.user, move, *args, compact=compact))
+
+    version = state.version
+    response = not_modified(request, version)
+    if response is not None:
+        return response
+
+    if compact:
+        return tag(request, version, JsonResponse(games.player_state(pk, request.user)))
+
+    return tag(request, version, JsonResponse(games.snippet_html(pk, request.user)))
+
+
+def player_response(request, player):
+    """
+    The player's own view after a move, as state or html depending on the client
+    """
+    if wants_state(request):
+        response = JsonResponse(player.state())
+    else:
+        response = JsonResponse(player.snippet_html())
+
+    return tag(request, player.game.version, response)
+
+
+def get_player(game, user):
+    return game.player_set.select_related('user', 'hand', 'action').get(user=user)
+
+
+def load_game(pk):
+    """
+    The game's engine state if the engine is on otherwise the Game, either has the version
+    """
+    if engine_enabled():
+        return engine_game(pk)
+
+    return get_object_or_404(Game, pk=pk)
+
+
+def poll_game(pk, user, version=None, compact=False, game=None):
+    """
+    The game as the user sees it, compact state instead of rendered snippets if compact
+
+    Parameters:
+        game - Game already loaded by load_game, saves loading it again
+    """
+    if engine_enabled():
+        engine_game(pk)
+        return games.state(pk, user, version) if compact else games.poll(pk, user, version)
+
+    if game is None:
+        game = get_object_or_404(Game, pk=pk)
+
+    return game.state(user, version) if compact else game.poll(user, version)
 
 
 @login_required
@@ -40,11 +191,41 @@ def delete_game(request, pk):
     return redirect('users:home')
 
 
+@login_required
+def fill_bots(request, pk):
+    """
+    Starts the host's setup straight away with bots playing the seats nobody has joined
+    """
+    setup = get_object_or_404(Setup, pk=pk)
+
+    if setup.host != request.user:
+        raise PermissionDenied
+
+    # Bots only play through the DB models, the in-memory engine would leave them stuck on their turn
+    if engine_enabled():
+        return HttpResponseForbidden("Bots can't play while games are served from the in-memory engine")
+
+    strategy = request.GET.get('strategy', 'greedy')
+    if strategy not in bots.STRATEGIES:
+        raise Http404
+
+    setup.create_game(bot=strategy)
+    return redirect('users:home')
+
+
 @login_required
 def join(request):
-    games = Setup.objects.all()
-    games = games.exclude(host=request.user)
-    context = {'games': games}
+    """
+    Setups available to join a page at a time, ?before=<cursor> gives the next page
+    """
+    try:
+        before = int(request.GET['before']) if 'before' in request.GET else None
+    except ValueError:
+        raise Http404
+
+    games, cursor = Setup.objects.lobby(request.user, before, getattr(settings, 'GAME_LOBBY_PAGE_SIZE', 20))
+    context = {'games': games,
+               'cursor': cursor}
     return render(request, 'game/join_game.html', context)
 
 
@@ -52,7 +233,7 @@ def join(request):
 def join_game(request, pk):
     setup = get_object_or_404(Setup, pk=pk)
 
-    if request.user not in [inv.user for inv in setup.invitation_set.all()]:
+    if not setup.invitation_set.filter(user=request.user).exists():
         invite = Invitation(setup=setup, user=request.user)
         invite.save()
 
@@ -77,6 +258,14 @@ def leave_game(request, pk):
 
 @login_required
 def display(request, pk):
+    # The engine runs ahead of the DB between flushes, so the live version decides and the page is rendered flushed
+    response = not_modified(request, load_game(pk).version)
+    if response is not None:
+        return response
+
+    if engine_enabled():
+        games.flush_game(pk)
+
     game = get_object_or_404(Game, pk=pk)
     all_players = game.player_set.all()
 
@@ -85,88 +274,260 @@ def display(request, pk):
 
     context = {'game': game,
                'player': player,
-               'other_players': other_players}
-    return render(request, 'game/display.html', context)
+               'other_players': other_players,
+               'cards': json.dumps([[card.rank, card.suit, card.css_class] for card in registry]),
+               'card_back': BACK[2]}
+    return tag(request, game.version, render(request, 'game/display.html', context))
 
 
 @login_required
 def start(request, pk):
+    if engine_enabled():
+        if engine_game(pk).host_id != request.user.pk:
+            raise PermissionDenied
+
+        games.start(pk)
+        return JsonResponse(poll_game(pk, request.user, compact=wants_state(request)))
+
     game = get_object_or_404(Game, pk=pk)
 
-    if game.host != request.user:
+    if game.host_id != request.user.pk:
         raise PermissionDenied
 
     game.start()
-    response = game.poll(request.user)
+    response = game.state(request.user) if wants_state(request) else game.poll(request.user)
 
     return JsonResponse(response)
 
 
 @login_required
 def select(request, pk):
+    if engine_enabled():
+        return engine_update(request, pk, 'select', request.POST.get('card'))
+
     game = get_object_or_404(Game, pk=pk)
-    player = game.player_set.get(user=request.user)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    player = get_player(game, request.user)
 
     if request.method == 'POST':
         card = request.POST['card']
         player.select(card)
 
-    return JsonResponse(player.snippet_html())
+    return player_response(request, player)
 
 
 @login_required
 def deselect(request, pk):
+    if engine_enabled():
+        return engine_update(request, pk, 'deselect', request.POST.get('card'))
+
     game = get_object_or_404(Game, pk=pk)
-    player = game.player_set.get(user=request.user)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    player = get_player(game, request.user)
 
     if request.method == 'POST':
         card = request.POST['card']
         player.deselect(card)
 
-    return JsonResponse(player.snippet_html())
+    return player_response(request, player)
+
+
+@login_required
+def selection(request, pk):
+    """
+    Sets every selected card at once from the 'cards' list
+    """
+    if engine_enabled():
+        return engine_update(request, pk, 'set_selection', request.POST.getlist('cards'))
+
+    game = get_object_or_404(Game, pk=pk)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    player = get_player(game, request.user)
+
+    if request.method == 'POST':
+        player.set_selection(request.POST.getlist('cards'))
+
+    return player_response(request, player)
 
 
 @login_required
 def poll(request, pk):
+    """
+    The game as the user sees it, GETs sending the ETag they last received are answered with a 304
+    while the game is unchanged
+    """
+    game = load_game(pk)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    version = request.POST.get('version', request.GET.get('version'))
+    response = poll_game(pk, request.user, version, wants_state(request), game)
+
+    return poll_response(request, response)
+
+
+@login_required
+def stream(request, pk):
+    """
+    Server-Sent Events stream sending the poll payload whenever the game changes
+
+    Sends a keepalive comment when nothing changes within GAME_STREAM_KEEPALIVE seconds
+    and closes after GAME_STREAM_DURATION seconds, the browser reconnects with the
+    last version it received in the Last-Event-ID header
+    """
+    if engine_enabled():
+        engine_game(pk)
+    else:
+        get_object_or_404(Game, pk=pk)
+
+    user = request.user
+    compact = wants_state(request)
+    keepalive = getattr(settings, 'GAME_STREAM_KEEPALIVE', 15)
+    duration = getattr(settings, 'GAME_STREAM_DURATION', 300)
+
+    def events(version):
+        end = time.time() + duration
+
+        while time.time() < end:
+            sequence = notifier.sequence(int(pk))
+            response = poll_game(pk, user, version, compact)
+
+            if 'self' in response:
+                version = response['version']
+                yield 'id: {}\ndata: {}\n\n'.format(version, json.dumps(response))
+
+            elif not notifier.wait(int(pk), sequence, min(keepalive, max(end - time.time(), 0))):
+                yield ': keepalive\n\n'
+
+    response = StreamingHttpResponse(events(request.META.get('HTTP_LAST_EVENT_ID')),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@login_required
+def history(request, pk):
+    """
+    Events since the version in 'since', so a client that lost its connection can catch up on what it missed
+    """
+    if engine_enabled():
+        games.flush_game(pk)
+
     game = get_object_or_404(Game, pk=pk)
-    response = game.poll(request.user)
+    player = get_player(game, request.user)
 
-    return JsonResponse(response)
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return HttpResponse("since must be a version", status=400)
+
+    return JsonResponse({'version': game.version,
+                         'events': events.catch_up(game.pk, player.position, since)})
 
 
 @login_required
 def submit(request, pk):
+    if engine_enabled():
+        return engine_update(request, pk, 'submit_action', request.POST.get('face'))
+
     game = get_object_or_404(Game, pk=pk)
-    player = game.player_set.get(user=request.user)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    player = get_player(game, request.user)
 
     if request.method == 'POST':
         post = request.POST
         face = post['face'] if 'face' in post else None
         player.submit_action(face)
 
-    return JsonResponse(player.snippet_html())
+    return player_response(request, player)
+
+
+@login_required
+def play(request, pk):
+    """
+    Plays the 'cards' list face 'face' as a single move and returns the whole game
+    as poll does, nothing is written if the play isn't valid
+    """
+    compact = wants_state(request)
+
+    if request.method != 'POST':
+        return JsonResponse(poll_game(pk, request.user, compact=compact))
+
+    cards = request.POST.getlist('cards')
+    face = request.POST.get('face') or None
+
+    if engine_enabled():
+        engine_game(pk)
+        games.apply(pk, request.user, 'play', cards, face)
+        return JsonResponse(poll_game(pk, request.user, compact=compact))
+
+    game = get_object_or_404(Game, pk=pk)
+    player = get_player(game, request.user)
+    player.play(cards, face)
+
+    response = game.state(request.user) if compact else game.poll(request.user)
+
+    # Errors aren't saved so the player has to be rendered from this instance
+    if player.has_error():
+        response.update(player.state() if compact else player.snippet_html())
+
+    return JsonResponse(response)
 
 
 @login_required
 def face(request, pk):
+    if engine_enabled():
+        return engine_update(request, pk, 'select_face', request.POST.get('face'))
+
     game = get_object_or_404(Game, pk=pk)
-    player = game.player_set.get(user=request.user)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    player = get_player(game, request.user)
 
     if request.method == 'POST':
         post = request.POST
         face = post['face'] if 'face' in post else None
         player.select_face(face)
 
-    return JsonResponse(player.snippet_html())
+    return player_response(request, player)
 
 
 @login_required
 def ready(request, pk):
+    if engine_enabled():
+        return engine_update(request, pk, 'set_ready')
+
     game = get_object_or_404(Game, pk=pk)
-    player = game.player_set.get(user=request.user)
+
+    response = not_modified(request, game.version)
+    if response is not None:
+        return response
+
+    player = get_player(game, request.user)
 
     if request.method == 'POST':
         player.set_ready()
 
-    return JsonResponse(player.snippet_html())
+    return player_response(request, player)
 
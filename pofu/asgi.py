@@ -0,0 +1,387 @@
+"""
+ASGI config for pofu project.
+
+Django 1.9 predates ASGI so this is a small ASGI 3 application of its own. Game
+polls and streams wait for changes on the event loop through AsyncGameNotifier
+so idle clients don't hold a thread, the DB work for them still runs on the
+thread pool. Every other URL, including display and the mutation views, is handed
+to the WSGI application on the thread pool and works unchanged.
+
+Requests are routed by resolving the path against the URLconf. Each time a poll
+or stream asks Django for the game it goes through the full middleware stack and
+views.poll, so sessions, login, CSRF, security headers and query counting all
+apply; only the waiting between those requests happens on the event loop.
+
+Run it with any ASGI 3 server, e.g.
+
+    uvicorn pofu.asgi:application
+
+A poll that would be answered with nothing new, because it sent the version or
+ETag it already has, waits up to GAME_POLL_WAIT seconds for the game to change
+before answering. The thread pool has ASGI_THREADS threads.
+Waits are only woken early by changes made in the same process, other processes
+are picked up when the wait times out.
+"""
+import asyncio
+import functools
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pofu.settings")
+
+wsgi_application = get_wsgi_application()
+wsgi_application.load_middleware()
+
+# Everything below needs the apps loaded by get_wsgi_application
+from django.conf import settings  # noqa: E402
+from django.core import signals  # noqa: E402
+from django.core.handlers.wsgi import WSGIRequest, get_script_name  # noqa: E402
+from django.core.urlresolvers import Resolver404, resolve, reverse, set_script_prefix  # noqa: E402
+from django.db import close_old_connections  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+
+from game import bots, views  # noqa: E402
+from game.notifier import AsyncGameNotifier, notifier  # noqa: E402
+
+
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASGI_THREADS', 20))
+bots.start_pool()
+_changes = {}
+
+
+def changes():
+    """
+    AsyncGameNotifier for the running loop
+    """
+    loop = asyncio.get_event_loop()
+
+    if loop not in _changes:
+        _changes[loop] = AsyncGameNotifier(notifier, loop)
+
+    return _changes[loop]
+
+
+def run_sync(func, *args):
+    return asyncio.get_event_loop().run_in_executor(executor, functools.partial(func, *args))
+
+
+def _call_django(func, *args):
+    # Worker threads don't go through the request signals that normally tidy up connections
+    close_old_connections()
+
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def call_django(func, *args):
+    """
+    Runs func on the thread pool and waits for it without blocking the loop
+    """
+    return run_sync(_call_django, func, *args)
+
+
+def build_environ(scope, body):
+    """
+    WSGI environ for an ASGI http scope
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+
+        environ[name] = environ[name] + ',' + value if name in environ else value
+
+    return environ
+
+
+def get_response(environ):
+    """
+    Runs a request through the middleware and view as the WSGI handler does, without writing it out
+    """
+    set_script_prefix(get_script_name(environ))
+    signals.request_started.send(sender=wsgi_application.__class__, environ=environ)
+
+    response = wsgi_application.get_response(WSGIRequest(environ))
+
+    # Sends request_finished, as a WSGI server would once the response is written
+    response.close()
+    return response
+
+
+def unchanged(response):
+    """
+    Whether views.poll answered that the client already has the current game
+    """
+    return response.status_code == 304 or getattr(response, 'game_unchanged', False)
+
+
+def poll_environ(scope, pk, version):
+    """
+    environ for a GET of views.poll asking for what a stream has to send after version
+    """
+    environ = build_environ(dict(scope, method='GET'), b'')
+    environ['PATH_INFO'] = reverse('game:poll', kwargs={'pk': pk})
+    environ.pop('HTTP_IF_NONE_MATCH', None)
+
+    query = [(name, value) for name, value in parse_qsl(environ['QUERY_STRING']) if name != 'version']
+    if version is not None:
+        query.append(('version', version))
+
+    environ['QUERY_STRING'] = urlencode(query)
+    return environ
+
+
+def route(path):
+    """
+    View the path resolves to and its URL kwargs, (None, None) if it doesn't resolve
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None, None
+
+    return match.func, match.kwargs
+
+
+def response_headers(response):
+    headers = [(name.encode('latin1'), value.encode('latin1')) for name, value in response.items()]
+    return headers + [(b'set-cookie', cookie.output(header='').strip().encode('latin1'))
+                      for cookie in response.cookies.values()]
+
+
+async def send_response(send, response):
+    await send({'type': 'http.response.start', 'status': response.status_code,
+                'headers': response_headers(response)})
+    await send({'type': 'http.response.body', 'body': response.content})
+
+
+async def wait_for_change(game_id, sequence, timeout, disconnect):
+    """
+    Returns:
+        True if the game changed, False if the wait timed out, None if the client went away
+    """
+    waiter = asyncio.ensure_future(changes().wait(game_id, sequence, timeout))
+    await asyncio.wait([waiter, disconnect], return_when=asyncio.FIRST_COMPLETED)
+
+    if not waiter.done():
+        waiter.cancel()
+        return None
+
+    return waiter.result()
+
+
+async def poll(scope, body, send, disconnect, pk):
+    """
+    Long-polling version of views.poll, asks again each time the game changes while the answer is
+    that the client already has it
+    """
+    end = time.time() + getattr(settings, 'GAME_POLL_WAIT', 25)
+
+    while True:
+        sequence = changes().sequence(int(pk))
+        response = await call_django(get_response, build_environ(scope, body))
+
+        remaining = end - time.time()
+        if not unchanged(response) or remaining <= 0:
+            break
+
+        if await wait_for_change(int(pk), sequence, remaining, disconnect) is None:
+            return
+
+    await send_response(send, response)
+
+
+async def stream(scope, body, send, disconnect, pk):
+    """
+    Event loop version of views.stream, the same Server-Sent Events without a thread per client
+
+    Each event is a GET of views.poll, the first one's headers start the stream and if it isn't
+    a 200, e.g. a redirect to login, it is sent instead
+    """
+    version = dict(scope.get('headers', [])).get(b'last-event-id')
+    version = version.decode('latin1') if version is not None else None
+    keepalive = getattr(settings, 'GAME_STREAM_KEEPALIVE', 15)
+    end = time.time() + getattr(settings, 'GAME_STREAM_DURATION', 300)
+
+    sequence = changes().sequence(int(pk))
+    response = await call_django(get_response, poll_environ(scope, pk, version))
+
+    if response.status_code != 200:
+        await send_response(send, response)
+        return
+
+    skipped = (b'content-type', b'content-length', b'cache-control', b'etag', b'x-poll-interval')
+    headers = [(name, value) for name, value in response_headers(response) if name.lower() not in skipped]
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': headers + [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]})
+
+    while True:
+        if not unchanged(response):
+            version = str(json.loads(response.content.decode())['version'])
+            event = 'id: {}\ndata: {}\n\n'.format(version, response.content.decode())
+            await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+
+        else:
+            if time.time() >= end:
+                break
+
+            changed = await wait_for_change(int(pk), sequence, min(keepalive, max(end - time.time(), 0)), disconnect)
+            if changed is None:
+                return
+
+            if not changed:
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+
+        if time.time() >= end:
+            break
+
+        sequence = changes().sequence(int(pk))
+        response = await call_django(get_response, poll_environ(scope, pk, version))
+
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def _run_wsgi(environ):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+    result = wsgi_application(environ, start_response)
+
+    # Whole responses are read and closed on the thread that made them, only streams are passed on in chunks
+    if getattr(result, 'streaming', False):
+        return started, result
+
+    try:
+        return started, [b''.join(result)]
+    finally:
+        result.close()
+
+
+async def wsgi(scope, body, send):
+    """
+    Serves the request with the normal Django WSGI handler on the thread pool
+    """
+    started, result = await run_sync(_run_wsgi, build_environ(scope, body))
+    await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+
+    chunks = iter(result)
+
+    try:
+        while True:
+            chunk = await run_sync(next, chunks, None)
+            if chunk is None:
+                break
+
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(result, 'close'):
+            await run_sync(result.close)
+
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def read_body(receive):
+    body = b''
+
+    while True:
+        message = await receive()
+
+        if message['type'] == 'http.disconnect':
+            return None
+
+        body += message.get('body', b'')
+
+        if not message.get('more_body', False):
+            return body
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif message['type'] == 'lifespan.shutdown':
+            changes_for_loop = _changes.pop(asyncio.get_event_loop(), None)
+            if changes_for_loop is not None:
+                changes_for_loop.close()
+
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        raise ValueError("Only http is served, not %s" % scope['type'])
+
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    # Resolves when the client goes away, anything left to receive after the body is a disconnect
+    disconnect = asyncio.ensure_future(receive())
+    sent = {'started': False}
+
+    async def tracked_send(message):
+        sent['started'] = sent['started'] or message['type'] == 'http.response.start'
+        await send(message)
+
+    try:
+        view, kwargs = route(scope['path'])
+
+        if view is views.poll:
+            await poll(scope, body, tracked_send, disconnect, kwargs['pk'])
+
+        elif view is views.stream:
+            await stream(scope, body, tracked_send, disconnect, kwargs['pk'])
+
+        else:
+            await wsgi(scope, body, tracked_send)
+
+    except Exception:
+        if sent['started']:
+            raise
+
+        await send_response(send, HttpResponse(status=500))
+        raise
+
+    finally:
+        disconnect.cancel()
@@ -0,0 +1,91 @@
+"""
+Per request DB query instrumentation
+
+QueryCountMiddleware records the number of queries, the total DB time and any
+SQL run more than once (after replacing literals, so N+1 loops show up as one
+repeated fingerprint) for every request. Results are logged to the
+'pofu.queries' logger as JSON and, in DEBUG, added to the response headers.
+Capturing SQL costs time on every query so it is skipped when neither is wanted.
+"""
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('pofu.queries')
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def fingerprint(sql):
+    """
+    SQL with literal values replaced by ? so repeats of the same query match
+    """
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    return LISTS.sub('(?)', sql)
+
+
+def summarize(queries):
+    """
+    Parameters:
+        queries - List of {'sql': ..., 'time': ...} dicts as recorded by Django
+
+    Returns:
+        Dictionary of the query count, total time in ms and fingerprints run more than once
+    """
+    counts = {}
+    for query in queries:
+        key = fingerprint(query['sql'])
+        counts[key] = counts.get(key, 0) + 1
+
+    return {'count': len(queries),
+            'time': round(sum(float(query['time']) for query in queries) * 1000, 3),
+            'duplicates': {sql: count for sql, count in counts.items() if count > 1}}
+
+
+class QueryCountMiddleware(object):
+    """
+    Records the queries made while handling each request
+
+    Queries made while a StreamingHttpResponse is consumed are not counted. Nothing is
+    recorded when the results would go nowhere, outside DEBUG with 'pofu.queries' below INFO.
+    """
+    def process_request(self, request):
+        if not (settings.DEBUG or logger.isEnabledFor(logging.INFO)):
+            return
+
+        request._query_marks = {}
+
+        for connection in connections.all():
+            request._query_marks[connection.alias] = (connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+
+    def process_response(self, request, response):
+        marks = getattr(request, '_query_marks', None)
+        if marks is None:
+            return response
+
+        queries = []
+        for connection in connections.all():
+            if connection.alias not in marks:
+                continue
+
+            force_debug_cursor, start = marks[connection.alias]
+            queries.extend(list(connection.queries_log)[start:])
+            connection.force_debug_cursor = force_debug_cursor
+
+        stats = summarize(queries)
+        logger.info(json.dumps(dict(stats, path=request.path, method=request.method, status=response.status_code)))
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = stats['count']
+            response['X-Query-Time'] = stats['time']
+            response['X-Query-Duplicates'] = sum(stats['duplicates'].values())
+
+        return response
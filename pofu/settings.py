@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'pofu.queries.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +84,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file rather than in-memory so threaded tests get SQLite's normal locking
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -127,6 +132,50 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static")
 ]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# build_sprites writes the card sprite sheet and its CSS here, found ahead of the app's per-image cards.css
+SPRITES_ROOT = os.path.join(BASE_DIR, 'build', 'sprites')
+STATICFILES_FINDERS = [
+    'cards.finders.SpritesFinder',
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+]
+
+# collectstatic writes files under content hashed names which are cached for this many seconds
+STATICFILES_STORAGE = 'pofu.static.ManifestStaticFilesStorage'
+STATIC_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+# Level of the 'pofu.queries' logger, INFO logs the queries of every request as JSON (pofu/queries.py)
+QUERY_LOG_LEVEL = 'WARNING'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'pofu.queries': {
+            'handlers': ['console'],
+            'level': QUERY_LOG_LEVEL,
+        },
+        'pofu.conflicts': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'pofu.engine': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'pofu.bots': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
 
 LOGIN_URL = 'login'
 LOGOUT_URL = 'logout'
@@ -141,3 +190,65 @@ NOSE_ARGS = ['--with-spec',
              '--cover-html',
              '--cover-package=.',
              '--cover-html-dir=reports/cover']
+
+# Serve games from the in-memory engine (game/engine.py) with write-behind persistence
+# Only safe when a single process serves all requests, setups can't be filled with bots while it is on
+GAME_ENGINE = False
+GAME_ENGINE_FLUSH_MOVES = 20
+GAME_ENGINE_FLUSH_INTERVAL = 5
+
+# Maximum number of rendered player snippets kept by game.snippets.SnippetCache
+GAME_SNIPPET_CACHE_SIZE = 1000
+
+# Setups shown per page of the join lobby
+GAME_LOBBY_PAGE_SIZE = 20
+
+# Times a play is retried after losing a compare-and-swap on the game version (game/concurrency.py)
+GAME_CONFLICT_RETRIES = 5
+
+# Milliseconds clients are told to wait before polling again (game/polling.py): on their turn, when they
+# play next, while others play, between rounds until everyone is ready and once the game is over
+GAME_POLL_INTERVALS = {
+    'turn': 1000,
+    'next': 1000,
+    'waiting': 3000,
+    'ready': 10000,
+    'over': 60000,
+}
+
+# Seconds a poll to pofu.asgi waits for the game to change before answering with nothing new
+GAME_POLL_WAIT = 25
+# Threads pofu.asgi runs the sync Django code on
+ASGI_THREADS = 20
+
+# SQLite production profile (pofu/sqlite.py): WAL and tuned pragmas on every connection,
+# reads on their own connections and every game change committed in batches by a single writer thread
+SQLITE_PRODUCTION = False
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'temp_store': 'memory',
+    'mmap_size': 134217728,
+}
+SQLITE_WRITE_QUEUE = SQLITE_PRODUCTION
+SQLITE_WRITE_BATCH = 50
+
+if SQLITE_PRODUCTION:
+    DATABASES['default']['PRAGMAS'] = SQLITE_PRAGMAS
+    DATABASES['read'] = dict(DATABASES['default'],
+                             PRAGMAS=dict(SQLITE_PRAGMAS, query_only=1),
+                             TEST={'MIRROR': 'default'})
+    DATABASE_ROUTERS = ['pofu.sqlite.ReadRouter']
+
+# A replay of a game's events (game/events.py) that applies this many events saves a snapshot
+GAME_SNAPSHOT_EVERY = 100
+
+# Where cleanup_games writes finished and cancelled games before removing them
+GAME_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+
+# Seconds a bot (game/bots.py) has to pick its move and the processes servers start for Monte Carlo
+# rollouts (0 plays them out in the bots' thread)
+GAME_BOT_TIME = 0.2
+GAME_BOT_PROCESSES = 2
@@ -0,0 +1,187 @@
+"""
+SQLite production profile
+
+SQLite allows one writer at a time, so with the default rollback journal every
+request writing a move blocks the readers too and busy writers fail with
+"database is locked". With SQLITE_PRODUCTION on in settings:
+
+  - Each connection runs the PRAGMAS of its DATABASES entry when it opens
+    (see configure), the default alias uses WAL so readers never wait on the
+    writer, synchronous=NORMAL so commits don't fsync and a busy timeout
+    instead of failing straight away.
+  - ReadRouter sends reads to the 'read' alias, separate query_only connections
+    to the same file, except inside a transaction where they have to see its writes.
+  - Every change to a game goes through a WriteQueue (see write and queued), a
+    single thread that owns the write connection and commits a batch of queued
+    changes in one transaction, so writers queue in the process instead of
+    contending for the file lock.
+"""
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+
+def configure(sender, connection, **kwargs):
+    """
+    connection_created receiver running the PRAGMAS setting of the connection's DATABASES entry
+    """
+    pragmas = connection.settings_dict.get('PRAGMAS')
+
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in sorted(pragmas.items()):
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+class ReadRouter(object):
+    """
+    Sends reads outside a transaction to the read alias, everything else to default
+    """
+    read_alias = 'read'
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        return self.read_alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class WriteQueue(object):
+    """
+    Runs queued writes one after another on a single thread
+
+    Up to batch_size queued writes share a transaction, each inside its own
+    savepoint so one raising only undoes its own changes. The caller gets the
+    result or the exception once the whole batch has committed.
+    """
+    _stop = object()
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, batch_size=None):
+        self.using = using
+        self.batch_size = batch_size or getattr(settings, 'SQLITE_WRITE_BATCH', 50)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, func, *args):
+        """
+        Returns:
+            Future for the result of func(*args) once it is committed
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pofu-writer', daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+    def stop(self):
+        """
+        Finishes the queued writes and stops the thread, the next submit starts a new one
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+
+            self._queue.put(self._stop)
+            self._thread.join()
+            self._thread = None
+
+    def _take(self):
+        batch = [self._queue.get()]
+
+        while len(batch) < self.batch_size and batch[-1] is not self._stop:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._take()
+                stopping = batch[-1] is self._stop
+                jobs = [job for job in batch if job is not self._stop]
+
+                if jobs:
+                    self._write(jobs)
+
+                if stopping:
+                    return
+        finally:
+            connections[self.using].close()
+
+    def _write(self, jobs):
+        results = []
+
+        try:
+            with transaction.atomic(using=self.using):
+                for future, func, args in jobs:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            results.append((future, func(*args), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+
+        except Exception as e:
+            results = [(future, None, e) for future, func, args in jobs]
+
+        self.batches += 1
+        self.writes += len(jobs)
+
+        for future, result, exception in results:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+
+writes = WriteQueue()
+
+
+def write(func, *args):
+    """
+    Runs func(*args) through the write queue when SQLITE_WRITE_QUEUE is on, otherwise directly
+
+    Writes already inside a transaction always run directly, the queue's connection
+    couldn't see what the transaction has written and would wait on its lock.
+    """
+    if not getattr(settings, 'SQLITE_WRITE_QUEUE', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return func(*args)
+
+    return writes.run(func, *args)
+
+
+def queued(method):
+    """
+    Decorator running every call of method through write, for the methods that change a game
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        return write(functools.partial(method, *args, **kwargs))
+
+    return wrapper
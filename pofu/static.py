@@ -0,0 +1,79 @@
+"""
+Static files with content hashed names and long-lived cache headers
+
+collectstatic copies every file into STATIC_ROOT under a name with a hash of
+its content, and {% static %} links to those names, so a file that changes gets
+a new URL. Hashed names can then be cached by browsers for STATIC_CACHE_SECONDS
+without ever being checked again.
+
+Django only serves static files itself in DEBUG. In production the front-end
+server in front of the app serves STATIC_ROOT at STATIC_URL with the same
+headers, see the README for an nginx example.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.staticfiles import storage, views
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import Http404
+from django.views.static import serve as serve_file
+
+
+class ManifestStaticFilesStorage(storage.ManifestStaticFilesStorage):
+    """
+    Django's ManifestStaticFilesStorage except names missing from the manifest are linked
+    unhashed, Django 1.9 raises for them which breaks every page until collectstatic has run
+    """
+    def stored_name(self, name):
+        try:
+            return super(ManifestStaticFilesStorage, self).stored_name(name)
+        except ValueError:
+            return name
+
+    def hashed_names(self):
+        if not hasattr(self, '_hashed_names'):
+            self._hashed_names = frozenset(self.hashed_files.values())
+
+        return self._hashed_names
+
+    def manifest_token(self):
+        """
+        Short hash of the manifest, changes whenever collectstatic gives any file a new name
+        """
+        if not hasattr(self, '_manifest_token'):
+            manifest = json.dumps(sorted(self.hashed_files.items()))
+            self._manifest_token = hashlib.md5(manifest.encode()).hexdigest()[:12]
+
+        return self._manifest_token
+
+
+def manifest_token():
+    """
+    Token for the static files pages link to, for ETags of pages that would go stale on a deploy
+    """
+    return getattr(staticfiles_storage, 'manifest_token', str)()
+
+
+def serve(request, path):
+    """
+    Serves the collected files in STATIC_ROOT, or the app static directories before collectstatic
+    has run, with cache headers for whether the name is hashed. Only in DEBUG, like runserver
+    """
+    if not settings.DEBUG:
+        raise Http404
+
+    if settings.STATIC_ROOT and staticfiles_storage.exists(path):
+        response = serve_file(request, path, document_root=settings.STATIC_ROOT)
+    else:
+        response = views.serve(request, path)
+
+    hashed_names = getattr(staticfiles_storage, 'hashed_names', frozenset)()
+
+    if path in hashed_names:
+        response['Cache-Control'] = 'public, max-age=%d, immutable' % getattr(settings, 'STATIC_CACHE_SECONDS',
+                                                                              31536000)
+    else:
+        response['Cache-Control'] = 'no-cache'
+
+    return response
@@ -0,0 +1,41 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .queries import summarize
+
+
+class _AssertMaxQueriesContext(CaptureQueriesContext):
+    def __init__(self, test_case, num, connection):
+        self.test_case = test_case
+        self.num = num
+        super(_AssertMaxQueriesContext, self).__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_AssertMaxQueriesContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+
+        stats = summarize(self.captured_queries)
+        self.test_case.assertLessEqual(
+            stats['count'], self.num,
+            "%d queries executed, budget is %d\nRepeated: %s\nCaptured queries were:\n%s" % (
+                stats['count'], self.num,
+                stats['duplicates'],
+                '\n'.join(query['sql'] for query in self.captured_queries)))
+
+
+class QueryBudgetMixin(object):
+    """
+    TestCase mixin for asserting an upper bound on the number of queries
+    """
+    def assertMaxQueries(self, num, func=None, *args, **kwargs):
+        """
+        Same as assertNumQueries but passes if fewer queries are made
+        """
+        context = _AssertMaxQueriesContext(self, num, connection)
+
+        if func is None:
+            return context
+
+        with context:
+            func(*args, **kwargs)
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pofu.settings")
 
 application = get_wsgi_application()
+
+# Needs the apps loaded by get_wsgi_application
+from game import bots  # noqa: E402
+
+bots.start_pool()
@@ -0,0 +1,17 @@
+from django import forms
+from django.contrib.auth.forms import UserCreationForm
+
+from game import bots
+
+
+class RegisterForm(UserCreationForm):
+    """
+    UserCreationForm which keeps the names bots play under for bots
+    """
+    def clean_username(self):
+        username = self.cleaned_data['username']
+
+        if bots.reserved_username(username):
+            raise forms.ValidationError("Usernames like this are kept for bots", code='reserved')
+
+        return username
@@ -23,6 +23,20 @@ class UserViewsTestCase(TestCase):
         self.client = Client()
         self.user = User.objects.create_user('test', 'test@pofu.net', 'testpass')
 
+    def test_register_rejects_bot_names(self):
+        """Names bots play under can't be registered"""
+        response = self.client.post(reverse('users:register'), {'username': 'greedy-bot-1',
+                                                                'password1': 'a-long-password',
+                                                                'password2': 'a-long-password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('username', response.context['form'].errors)
+        self.assertFalse(User.objects.filter(username='greedy-bot-1').exists())
+
+        response = self.client.post(reverse('users:register'), {'username': 'robot',
+                                                                'password1': 'a-long-password',
+                                                                'password2': 'a-long-password'})
+        self.assertEqual(response.status_code, 302)
+
     def test_home_unregistered_user(self):
         """Users home page should redirect to login unregistered user"""
         response = self.client.get(reverse('users:home'))
@@ -53,6 +67,17 @@ class UserViewsTestCase(TestCase):
         self.assertEqual(len(joining), 1)
         self.assertEqual(joining[0].message, "Test Game")
 
+    def test_home_queries_do_not_grow_with_setups(self):
+        """Hosted and joined setups are listed with their counts and hosts in one query each"""
+        self.client.login(username='test', password='testpass')
+        add_setup(self.user)
+        add_setup(self.user)
 
+        for i in range(3):
+            other = User.objects.create_user('other%d' % i)
+            add_setup(other)
+            Invitation(setup=Setup.objects.latest('pk'), user=self.user).save()
 
-
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('users:home'))
+            self.assertEqual([setup.joined() for setup in response.context['joining']], [1, 1, 2, 2, 2])
@@ -1,15 +1,15 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.forms import UserCreationForm
 
 from game.models import Game, Setup
+from .forms import RegisterForm
 
 
 @login_required
 def home(request):
     my_games = Game.objects.games_for_user(request.user)
     joining = Setup.objects.setups_for_user(request.user)
-    hosting = Setup.objects.filter(host=request.user)
+    hosting = Setup.objects.with_counts().filter(host=request.user)
     context = {'my_games': my_games,
                'joining': joining,
                'hosting': hosting}
@@ -18,12 +18,12 @@ def home(request):
 
 def register(request):
     if request.method == 'POST':
-        form = UserCreationForm(request.POST)
+        form = RegisterForm(request.POST)
         if form.is_valid():
             form.save()
             return redirect('users:home')
 
     else:
-        form = UserCreationForm()
+        form = RegisterForm()
 
     return render(request, 'users/register.html', {'form': form})
\ No newline at end of file